@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the time it takes to create the same event for many VENs with a call to
+add_event for each VEN, and with a single call to add_events_bulk.
+
+Usage: python benchmarks/bench_bulk_events.py [number of VENs]
+"""
+
+import logging
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from openleadr import OpenADRServer
+
+
+def intervals():
+    return [{'dtstart': datetime.now(timezone.utc) + timedelta(hours=1),
+             'duration': timedelta(minutes=30),
+             'signal_payload': 1}]
+
+
+def callback(ven_id, event_id, opt_type):
+    pass
+
+
+def main(count=50000):
+    logging.getLogger('openleadr').setLevel(logging.ERROR)
+    ven_ids = [f'ven{i}' for i in range(count)]
+
+    server = OpenADRServer(vtn_id='myvtn', show_fingerprint=False)
+    start = time.perf_counter()
+    for ven_id in ven_ids:
+        server.add_event(ven_id, 'simple', 'level', intervals(), callback=callback)
+    single_time = time.perf_counter() - start
+
+    server = OpenADRServer(vtn_id='myvtn', show_fingerprint=False)
+    start = time.perf_counter()
+    server.add_events_bulk(ven_ids, 'simple', 'level', intervals(), callback=callback)
+    bulk_time = time.perf_counter() - start
+
+    print(f"Creating an event for {count} VENs")
+    print(f"add_event for each VEN:     {single_time * 1e3:8.1f} ms")
+    print(f"add_events_bulk:            {bulk_time * 1e3:8.1f} ms")
+    print(f"Speedup:                    {single_time / bulk_time:8.1f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,79 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the time it takes to sign a message with the PEM-encoded key and certificate,
+which have to be parsed for every message, and with the key and certificate that
+were loaded once up front.
+
+Usage: python benchmarks/bench_signing.py [number of messages]
+"""
+
+import os
+import sys
+import time
+
+from lxml import etree
+from signxml import XMLSigner, methods
+
+from openleadr.messaging import (create_message, load_certificate_chain, load_signing_key,
+                                 _create_replay_protect, serialize_message)
+from openleadr.preflight import preflight_message
+
+CERTIFICATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'certificates')
+
+
+def main(count=1000):
+    with open(os.path.join(CERTIFICATES, 'dummy_vtn.crt'), 'rb') as file:
+        cert = file.read()
+    with open(os.path.join(CERTIFICATES, 'dummy_vtn.key'), 'rb') as file:
+        key = file.read()
+
+    # Sign with the PEM bytes, so that signxml loads the key and certificate every time
+    signer = XMLSigner(method=methods.detached,
+                       c14n_algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315")
+    signer.namespaces['oadr'] = "http://openadr.org/oadr-2.0b/2012/07"
+    signed_object = serialize_message('oadrPoll', preflight_message('oadrPoll', {'ven_id': 'ven123'}))
+    start = time.perf_counter()
+    for _ in range(count):
+        signer.sign(etree.fromstring(signed_object), key=key, cert=cert,
+                    reference_uri="#oadrSignedObject",
+                    signature_properties=_create_replay_protect())
+    pem_time = time.perf_counter() - start
+
+    loaded_key = load_signing_key(key)
+    loaded_cert = load_certificate_chain(cert)
+    start = time.perf_counter()
+    for _ in range(count):
+        signer.sign(etree.fromstring(signed_object), key=loaded_key, cert=loaded_cert,
+                    reference_uri="#oadrSignedObject",
+                    signature_properties=_create_replay_protect())
+    loaded_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(count):
+        create_message('oadrPoll', ven_id='ven123', cert=loaded_cert, key=loaded_key)
+    message_time = time.perf_counter() - start
+
+    print(f"Signing {count} messages")
+    print(f"PEM key and certificate:    {pem_time * 1e6 / count:8.1f} us per message")
+    print(f"Preloaded key and cert:     {loaded_time * 1e6 / count:8.1f} us per message")
+    print(f"Saved:                      {(pem_time - loaded_time) * 1e6 / count:8.1f} us per message")
+    print(f"Complete create_message:    {message_time * 1e6 / count:8.1f} us per message")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,162 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure how the throughput of a VTN scales with the number of worker processes. Each VEN
+requests its events, acknowledges the group event that it receives, and polls, so the
+workers render and parse XML, and write the acknowledgements to the shared state. The
+callback of the group event is in the first worker, so the acknowledgements that reach
+the other workers are passed on to it.
+
+The script prints the throughput for each number of workers, the speedup over a single
+worker, and the efficiency (the speedup divided by the number of workers; 1.0 is linear
+scaling). The load is generated by separate client processes, one for each worker, so
+the throughput only scales if there are enough CPU cores for the workers and the clients.
+
+Usage: python benchmarks/bench_workers.py [seconds per run] [number of workers ...]
+"""
+
+from datetime import datetime, timedelta, timezone
+from functools import partial
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from openleadr import OpenADRServer
+from openleadr.messaging import create_message, parse_message
+from openleadr.replay import SQLiteNonceStore
+from openleadr.state import SQLiteStateBackend
+from openleadr.workers import start_workers, stop_workers
+
+PORT = 8084
+URL = f'http://localhost:{PORT}/OpenADR2/Simple/2.0b'
+VENS = 200
+CONNECTIONS_PER_CLIENT = 16
+HEADERS = {'Content-Type': 'application/xml'}
+
+
+def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+def create_server(path, worker_id):
+    logging.getLogger('openleadr').setLevel(logging.ERROR)
+    server = OpenADRServer(vtn_id='myvtn', http_port=PORT, http_host='localhost',
+                           state_backend=SQLiteStateBackend(path),
+                           nonce_store=SQLiteNonceStore(path + '.nonces'))
+    if worker_id == 0:
+        server.add_group_event([f'ven{i}' for i in range(VENS)], 'simple', 'level',
+                               [{'dtstart': datetime.now(timezone.utc) + timedelta(hours=1),
+                                 'duration': timedelta(minutes=30),
+                                 'signal_payload': 1}],
+                               event_id='event1', callback=on_event_response)
+    return server
+
+
+async def run_ven(session, ven_id, deadline):
+    """
+    Request the events, acknowledge them and poll, until the deadline. Returns the number of requests.
+    """
+    count = 0
+    while time.perf_counter() < deadline:
+        async with session.post(f'{URL}/EiEvent', headers=HEADERS,
+                                data=create_message('oadrRequestEvent', ven_id=ven_id, request_id='req')) as response:
+            message_type, message_payload = parse_message(await response.read())
+        event_responses = [{'event_id': event['event_descriptor']['event_id'],
+                            'modification_number': event['event_descriptor']['modification_number'],
+                            'opt_type': 'optIn', 'response_code': 200, 'response_description': 'OK',
+                            'request_id': message_payload['request_id']}
+                           for event in message_payload.get('events', [])]
+        async with session.post(f'{URL}/EiEvent', headers=HEADERS,
+                                data=create_message('oadrCreatedEvent', ven_id=ven_id,
+                                                    response={'response_code': 200,
+                                                              'response_description': 'OK',
+                                                              'request_id': message_payload['request_id']},
+                                                    event_responses=event_responses)) as response:
+            await response.read()
+        async with session.post(f'{URL}/OadrPoll', headers=HEADERS,
+                                data=create_message('oadrPoll', ven_id=ven_id)) as response:
+            await response.read()
+        count += 3
+    return count
+
+
+async def load(client, duration):
+    deadline = time.perf_counter() + duration
+
+    async def connection(index):
+        # A separate session for each connection, so that the connections are spread over the workers
+        async with aiohttp.ClientSession() as session:
+            return await run_ven(session, f'ven{(client * CONNECTIONS_PER_CLIENT + index) % VENS}', deadline)
+
+    return sum(await asyncio.gather(*[connection(index) for index in range(CONNECTIONS_PER_CLIENT)]))
+
+
+def run_client(client, duration):
+    return asyncio.run(load(client, duration))
+
+
+async def wait_for_server():
+    for _ in range(300):
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f'{URL}/EiEvent', headers=HEADERS,
+                                        data=create_message('oadrRequestEvent', ven_id='ven0',
+                                                            request_id='req')) as response:
+                    if parse_message(await response.read())[0] == 'oadrDistributeEvent':
+                        return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("The VTN did not start")
+
+
+def measure(workers, duration):
+    with tempfile.TemporaryDirectory() as directory:
+        processes = start_workers(partial(create_server, os.path.join(directory, 'state.db')), workers)
+        try:
+            asyncio.run(wait_for_server())
+            # Give the other workers the time to load the group event
+            time.sleep(1)
+            with multiprocessing.get_context('spawn').Pool(workers) as pool:
+                counts = pool.starmap(run_client, [(client, duration) for client in range(workers)])
+        finally:
+            stop_workers(processes)
+    return sum(counts) / duration
+
+
+def main(duration=5, worker_counts=(1, 2, 4)):
+    print(f"Requests per second for {VENS} VENs (oadrRequestEvent, oadrCreatedEvent and oadrPoll), "
+          f"with one client process of {CONNECTIONS_PER_CLIENT} connections per worker, "
+          f"{os.cpu_count()} CPU cores")
+    base = None
+    for workers in worker_counts:
+        throughput = measure(workers, duration)
+        base = base or throughput
+        speedup = throughput / base
+        print(f"{workers:2d} workers: {throughput:10.1f} requests/s  speedup {speedup:4.2f}x  "
+              f"efficiency {speedup / workers:4.2f}")
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5,
+         [int(arg) for arg in sys.argv[2:]] or (1, 2, 4))
@@ -0,0 +1,109 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Admission control for the VTN. After an outage, many VENs may contact the VTN at the
+same moment. The AdmissionController limits the rate of requests for each service and
+the number of requests that are handled at the same time. Requests above these limits
+are shed: the VEN receives a valid OpenADR response with an error code right away,
+instead of waiting for the VTN until its request times out.
+"""
+
+from collections import Counter
+from datetime import timedelta
+import time
+
+from openleadr import errors
+
+
+class TokenBucket:
+    """
+    Allows on average rate requests per second, with bursts of at most burst requests.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Take a token from the bucket. Returns False if the bucket is empty.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class AdmissionController:
+    """
+    Decides which incoming requests are handled, and which are shed.
+
+    :param int max_concurrency: The maximum number of requests that are handled at the same
+                                time, over all services. None for no limit.
+    :param dict rates: The maximum number of requests per second for each service, by service
+                       name ('EiRegisterParty', 'EiEvent', 'EiReport', 'EiOpt' or 'OadrPoll').
+                       A value can be a number, or a (rate, burst) tuple. Services that are
+                       not listed have no rate limit.
+    :param timedelta shed_poll_freq: The requested_oadr_poll_freq in the response to a shed
+                                     oadrQueryRegistration or oadrCreatePartyRegistration,
+                                     to ask the VEN to come back later. None to use the
+                                     server's requested_poll_freq.
+    :param type shed_error: The openleadr.errors.ProtocolError that determines the response
+                            code for a shed request.
+    """
+
+    def __init__(self, max_concurrency=None, rates=None, shed_poll_freq=timedelta(minutes=1),
+                 shed_error=errors.DeploymentError):
+        self.max_concurrency = max_concurrency
+        self.shed_poll_freq = shed_poll_freq
+        self.shed_error = shed_error
+        self.buckets = {}
+        for service_name, rate in (rates or {}).items():
+            if isinstance(rate, tuple):
+                self.buckets[service_name] = TokenBucket(*rate)
+            else:
+                self.buckets[service_name] = TokenBucket(rate)
+        self.in_flight = 0
+        self.admitted = Counter()       # Admitted requests, by service name
+        self.shed = Counter()           # Shed requests, by service name
+
+    def admit(self, service_name):
+        """
+        Returns True if a request for this service may be handled. If so, you must call
+        release once the request has been handled.
+        """
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            self.shed[service_name] += 1
+            return False
+        bucket = self.buckets.get(service_name)
+        if bucket is not None and not bucket.take():
+            self.shed[service_name] += 1
+            return False
+        self.in_flight += 1
+        self.admitted[service_name] += 1
+        return True
+
+    def release(self):
+        """
+        Mark an admitted request as handled.
+        """
+        self.in_flight -= 1
@@ -22,14 +22,16 @@ from datetime import datetime, timedelta, timezone
 from dataclasses import asdict
 from functools import partial
 from http import HTTPStatus
+from urllib.parse import urlparse
 
 import aiohttp
+from aiohttp import web
 from lxml.etree import XMLSyntaxError
 from signxml.exceptions import InvalidSignature
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from openleadr import enums, objects, errors
-from openleadr.messaging import create_message, parse_message, \
-                                validate_xml_schema, validate_xml_signature
+from openleadr.messaging import create_message, parse_message_tree, load_certificate_chain, load_signing_key, \
+                                parse_xml, validate_xml_schema, validate_xml_signature, validate_xml_tree
 from openleadr import utils
 
 import tzlocal
@@ -47,7 +49,9 @@ class OpenADRClient:
     def __init__(self, ven_name, vtn_url, debug=False, cert=None, key=None,
                  passphrase=None, vtn_fingerprint=None, show_fingerprint=True, ca_file=None,
                  allow_jitter=True, ven_id=None, disable_signature=False, check_hostname=True,
-                 event_status_log_period=10, events_clean_up_period=300):
+                 event_status_log_period=10, events_clean_up_period=300, signing_pool=None,
+                 validation_policy=None, transport_address=None, push_host='0.0.0.0', push_port=None,
+                 allow_insecure_push=False):
         """
         Initializes a new OpenADR Client (Virtual End Node)
 
@@ -71,11 +75,34 @@ class OpenADRClient:
         :param bool check_hostname: Whether or not to check hostname
         :param int event_status_log_period: Setting the priod of status change logging
         :param int events_clean_up_period: Setting the priod of not relevant events clean up
+        :param SigningPool signing_pool: An openleadr.messaging.SigningPool in which outgoing
+                                         messages are created and signed, so that signing does
+                                         not block the event loop.
+        :param ValidationPolicy validation_policy: An openleadr.validation.ValidationPolicy that
+                                                   decides which incoming messages are validated
+                                                   against the XML Schema. It only applies if
+                                                   you provide the vtn_fingerprint, so that
+                                                   the messages are authenticated. By default,
+                                                   all messages are validated.
+        :param str transport_address: If you provide this URL, the client registers for the
+                                      HTTP push model: it does not poll, but runs a web server
+                                      at this address to which the VTN delivers its messages.
+                                      For example: 'http://ven.example.com:8081/OpenADR2/Simple/2.0b'.
+        :param str push_host: The host or IP address that the push web server binds to.
+        :param int push_port: The port that the push web server binds to. Defaults to the port
+                              in the transport_address.
+        :param bool allow_insecure_push: The push web server only accepts messages from the VTN
+                                         over https, and only if they are authenticated: by a
+                                         client certificate from the ca_file, or by their
+                                         signature if you provide the vtn_fingerprint. Set this
+                                         to True to receive unauthenticated messages, or
+                                         messages over plain http, for instance for testing.
         """
 
         self.ven_name = ven_name
         self.vtn_url = vtn_url.rstrip("/")
         self.ven_id = ven_id
+        self.vtn_id = None                      # The vtnID from our registration
         self.registration_id = None
         self.poll_frequency = None
         self.vtn_fingerprint = vtn_fingerprint
@@ -93,6 +120,14 @@ class OpenADRClient:
         self.client_session = None
         self.report_queue_task = None
 
+        self.transport_address = transport_address.rstrip('/') if transport_address else None
+        self.push_host = push_host
+        self.push_port = push_port
+        self.push_runner = None
+        self.push_queue = asyncio.Queue()       # Holds the messages that the VTN pushed to us
+        self.push_queue_task = None
+        self.allow_insecure_push = allow_insecure_push
+
         self.opts = []
         self.received_events = []               # Holds the events that we received.
         self.responded_events = {}              # Holds the events that we already saw.
@@ -117,12 +152,19 @@ class OpenADRClient:
                 print("You do not need to keep this a secret.".center(80))
                 print("*" * 80)
                 print("")
+            # Load the key and certificate once, instead of for every message. Key objects
+            # can't be sent to a process pool; the workers load and cache the key themselves.
+            cert = load_certificate_chain(cert)
+            if signing_pool is None or not signing_pool.use_processes:
+                key = load_signing_key(key, passphrase)
 
         self._create_message = partial(create_message,
                                        cert=cert,
                                        key=key,
                                        passphrase=passphrase,
                                        disable_signature=disable_signature)
+        self.signing_pool = signing_pool
+        self.validation_policy = validation_policy
         self.hooks = {'before_send_xml': [],
                       'after_receive_xml': [],
                       'before_schema_validation': [],
@@ -137,6 +179,10 @@ class OpenADRClient:
         #     raise NotImplementedError("You must implement on_event.")
         self.loop = asyncio.get_event_loop()
 
+        # Start receiving pushed messages before registering, so that the VTN can deliver right away
+        if self.transport_address:
+            await self._start_push_server()
+
         request_id = None
         response_type, response_payload = await self.query_registration()
         if 'registration_id' in response_payload:
@@ -159,18 +205,19 @@ class OpenADRClient:
         # Perform initial event sync
         await self.sync_events()
 
-        # Perform an initial poll
-        await self._poll()
+        if not self.transport_address:
+            # Perform an initial poll
+            await self._poll()
 
-        # Set up automatic polling
-        if self.poll_frequency > timedelta(hours=24):
-            logger.warning("Polling with intervals of more than 24 hours is not supported. "
-                           "Will use 24 hours as the polling interval.")
-            self.poll_frequency = timedelta(hours=24)
+            # Set up automatic polling
+            if self.poll_frequency > timedelta(hours=24):
+                logger.warning("Polling with intervals of more than 24 hours is not supported. "
+                               "Will use 24 hours as the polling interval.")
+                self.poll_frequency = timedelta(hours=24)
 
-        self.scheduler.add_job(self._poll,
-                               trigger='interval',
-                               seconds=self.poll_frequency.total_seconds())
+            self.scheduler.add_job(self._poll,
+                                   trigger='interval',
+                                   seconds=self.poll_frequency.total_seconds())
         self.scheduler.add_job(self._event_status_log,
                                trigger='interval',
                                seconds=self.event_status_log_period)
@@ -187,6 +234,11 @@ class OpenADRClient:
             self.scheduler.shutdown()
         if self.report_queue_task:
             self.report_queue_task.cancel()
+        if self.push_queue_task:
+            self.push_queue_task.cancel()
+        if self.push_runner:
+            await self.push_runner.cleanup()
+            self.push_runner = None
         await self.client_session.close()
         await asyncio.sleep(0)
 
@@ -391,7 +443,7 @@ class OpenADRClient:
         Request the next available message from the Server. This coroutine is called automatically.
         """
         service = 'OadrPoll'
-        message = self._create_message('oadrPoll', ven_id=self.ven_id)
+        message = await self._create_message_async('oadrPoll', ven_id=self.ven_id)
         response_type, response_payload = await self._perform_request(service, message)
         return response_type, response_payload
 
@@ -407,26 +459,31 @@ class OpenADRClient:
         """
         request_id = utils.generate_id()
         service = 'EiRegisterParty'
-        message = self._create_message('oadrQueryRegistration', request_id=request_id)
+        message = await self._create_message_async('oadrQueryRegistration', request_id=request_id)
         response_type, response_payload = await self._perform_request(service, message)
         return response_type, response_payload
 
-    async def create_party_registration(self, http_pull_model=True, xml_signature=False,
+    async def create_party_registration(self, http_pull_model=None, xml_signature=False,
                                         report_only=False, profile_name='2.0b',
                                         transport_name='simpleHttp', transport_address=None,
                                         ven_id=None, request_id=None, registration_id=None):
         """
         Take the neccessary steps to register this client with the server.
 
-        :param bool http_pull_model: Whether to use the 'pull' model for HTTP.
+        :param bool http_pull_model: Whether to use the 'pull' model for HTTP. Defaults to
+                                     the 'push' model if the client has a transport_address.
         :param bool xml_signature: Whether to sign each XML message.
         :param bool report_only: Whether or not this is a reporting-only client
                                  which does not deal with Events.
         :param str profile_name: Which OpenADR profile to use.
         :param str transport_name: The transport name to use. Either 'simpleHttp' or 'xmpp'.
         :param str transport_address: Which public-facing address the server should use
-                                      to communicate.
+                                      to communicate. Defaults to the client's transport_address.
         """
+        if http_pull_model is None:
+            http_pull_model = self.transport_address is None
+        if transport_address is None:
+            transport_address = self.transport_address
         if request_id is None:
             request_id = utils.generate_id()
         service = 'EiRegisterParty'
@@ -440,9 +497,9 @@ class OpenADRClient:
                    'transport_address': transport_address,
                    'registration_id': registration_id}
 
-        message = self._create_message('oadrCreatePartyRegistration',
-                                       request_id=request_id,
-                                       **payload)
+        message = await self._create_message_async('oadrCreatePartyRegistration',
+                                                   request_id=request_id,
+                                                   **payload)
         response_type, response_payload = await self._perform_request(service, message)
         if response_type is None:
             return
@@ -453,6 +510,8 @@ class OpenADRClient:
                          f"{status_code} {status_description}")
             return
 
+        if response_payload.get('vtn_id'):
+            self.vtn_id = response_payload['vtn_id']
         if response_payload.get('registration_id'):
             self.registration_id = response_payload['registration_id']
         else:
@@ -511,7 +570,7 @@ class OpenADRClient:
                    'ven_id': self.ven_id}
 
         service = 'EiRegisterParty'
-        message = self._create_message('oadrCancelPartyRegistration', **payload)
+        message = await self._create_message_async('oadrCancelPartyRegistration', **payload)
         response_type, response_payload = await self._perform_request(service, message)
 
         if response_type == 'oadrCanceledPartyRegistration' and response_payload['response']['response_code'] == 200:
@@ -541,7 +600,7 @@ class OpenADRClient:
         payload = {'request_id': utils.generate_id(),
                    'ven_id': self.ven_id,
                    'reply_limit': reply_limit}
-        message = self._create_message('oadrRequestEvent', **payload)
+        message = await self._create_message_async('oadrRequestEvent', **payload)
         service = 'EiEvent'
         response_type, response_payload = await self._perform_request(service, message)
         return response_type, response_payload
@@ -561,7 +620,7 @@ class OpenADRClient:
                                         'event_id': event_id,
                                         'modification_number': modification_number,
                                         'opt_type': opt_type}]}
-        message = self._create_message('oadrCreatedEvent', **payload)
+        message = await self._create_message_async('oadrCreatedEvent', **payload)
         response_type, response_payload = await self._perform_request(service, message)
 
     async def sync_events(self):
@@ -632,7 +691,7 @@ class OpenADRClient:
         }
 
         service = 'EiOpt'
-        message = self._create_message('oadrCreateOpt', **payload)
+        message = await self._create_message_async('oadrCreateOpt', **payload)
         response_type, response_payload = await self._perform_request(service, message)
         logger.info(response_type, response_payload)
 
@@ -667,7 +726,7 @@ class OpenADRClient:
         }
 
         service = 'EiOpt'
-        message = self._create_message('oadrCancelOpt', **payload)
+        message = await self._create_message_async('oadrCancelOpt', **payload)
         response_type, response_payload = await self._perform_request(service, message)
         logger.info(response_type, response_payload)
 
@@ -707,7 +766,7 @@ class OpenADRClient:
 
 
         service = 'EiReport'
-        message = self._create_message('oadrRegisterReport', **payload)
+        message = await self._create_message_async('oadrRegisterReport', **payload)
         response_type, response_payload = await self._perform_request(service, message)
 
         # Handle the subscriptions that the VTN is interested in.
@@ -831,13 +890,16 @@ class OpenADRClient:
         message_payload = {'pending_reports':
                         [{'report_request_id': utils.getmember(report, 'report_request_id')}
                             for report in response_payload['report_requests']]}
-        message = self._create_message(message_type,
-                                        response={'response_code': response_code,
-                                                    'response_description': 'OK' if response_code == 200 else 'ERROR',
-                                                    'request_id': response_payload['request_id'] if 'request_id' in response_payload else\
-                                                                  response_payload['response']['request_id']},
-                                        ven_id=self.ven_id,
-                                        **message_payload)
+        if 'request_id' in response_payload:
+            request_id = response_payload['request_id']
+        else:
+            request_id = response_payload['response']['request_id']
+        message = await self._create_message_async(message_type,
+                                                    response={'response_code': response_code,
+                                                              'response_description': 'OK' if response_code == 200 else 'ERROR',
+                                                              'request_id': request_id},
+                                                    ven_id=self.ven_id,
+                                                    **message_payload)
         await self._perform_request(service, message)
 
     # async def create_single_report(self, report_request):
@@ -954,19 +1016,19 @@ class OpenADRClient:
                 logger.info(f"Report with report_request_id {report_request_id} will be followed by a new report.")
                 # Send oadrCanceledReport with oadrPendingReport message
                 message_payload = {'pending_reports': [{'report_request_id': report_request_id}]}
-                message = self._create_message(message_type,
-                                            response=response,
-                                            ven_id=self.ven_id,
-                                            report_request_id=report_request_id,
-                                            **message_payload)
+                message = await self._create_message_async(message_type,
+                                                        response=response,
+                                                        ven_id=self.ven_id,
+                                                        report_request_id=report_request_id,
+                                                        **message_payload)
                 await self.update_report(report_request_id)
             else:
                 logger.info(f"Report with report_request_id {report_request_id} will not be followed by a new report.")
                 # Send simple oadrCanceledReport message
-                message = self._create_message(message_type,
-                                            response=response,
-                                            ven_id=self.ven_id,
-                                            report_request_id=report_request_id)
+                message = await self._create_message_async(message_type,
+                                                        response=response,
+                                                        ven_id=self.ven_id,
+                                                        report_request_id=report_request_id)
             self.report_requests.remove(report_request)
             await self._perform_request(service, message)
         else:
@@ -980,10 +1042,10 @@ class OpenADRClient:
             while True:
                 report = await self.pending_reports.get()
                 service = 'EiReport'
-                message = self._create_message('oadrUpdateReport',
-                                               ven_id=self.ven_id,
-                                               request_id=utils.generate_id(),
-                                               reports=[report])
+                message = await self._create_message_async('oadrUpdateReport',
+                                                           ven_id=self.ven_id,
+                                                           request_id=utils.generate_id(),
+                                                           reports=[report])
                 try:
                     # response_type, response_payload = await self._perform_request(service, message)
                     response_payload = await self._perform_request(service, message)
@@ -1033,8 +1095,10 @@ class OpenADRClient:
                             'response_description': 'ERROR',
                             'request_id': message['request_id']}
 
-                message = self._create_message('oadrCanceledPartyRegistration', response=response, ven_id=self.ven_id,
-                                               registration_id=self.registration_id)
+                message = await self._create_message_async('oadrCanceledPartyRegistration',
+                                                           response=response,
+                                                           ven_id=self.ven_id,
+                                                           registration_id=self.registration_id)
                 service = 'EiRegisterParty'
                 response_type, response_payload = await self._perform_request(service, message)
                 logger.info(response_type, response_payload)
@@ -1055,7 +1119,10 @@ class OpenADRClient:
         self.pending_reports = None
         self.scheduler.remove_all_jobs()
 
-        message = self._create_message('oadrCanceledPartyRegistration', response=response, ven_id=self.ven_id, registration_id=self.registration_id)
+        message = await self._create_message_async('oadrCanceledPartyRegistration',
+                                                   response=response,
+                                                   ven_id=self.ven_id,
+                                                   registration_id=self.registration_id)
         service = 'EiRegisterParty'
         response_type, response_payload = await self._perform_request(service, message)
         self.registration_id = None
@@ -1071,11 +1138,11 @@ class OpenADRClient:
         """
         Send an empty oadrResponse, for instance after receiving oadrRequestReregistration.
         """
-        msg = self._create_message('oadrResponse',
-                                   ven_id=self.ven_id,
-                                   response={'response_code': response_code,
-                                             'response_description': response_description,
-                                             'request_id': request_id})
+        msg = await self._create_message_async('oadrResponse',
+                                               ven_id=self.ven_id,
+                                               response={'response_code': response_code,
+                                                         'response_description': response_description,
+                                                         'request_id': request_id})
         await self._perform_request(service, msg)
 
     ###########################################################################
@@ -1084,6 +1151,14 @@ class OpenADRClient:
     #                                                                         #
     ###########################################################################
 
+    async def _create_message_async(self, message_type, **message_payload):
+        """
+        Create an outgoing message, using the signing pool if one is configured.
+        """
+        if self.signing_pool is None:
+            return self._create_message(message_type, **message_payload)
+        return await self.signing_pool.run(self._create_message, message_type, **message_payload)
+
     async def _perform_request(self, service, message):
         await self._ensure_client_session()
         url = f"{self.vtn_url}/{service}"
@@ -1106,13 +1181,33 @@ class OpenADRClient:
             return None, {}
         if len(content) == 0:
             return None
+        message_type, message_payload = await self._parse_message(content)
+        if message_type is None:
+            return None, {}
+        if 'response' in message_payload and 'response_code' in message_payload['response']:
+            if message_payload['response']['response_code'] != 200:
+                logger.warning("We got a non-OK OpenADR response from the server: "
+                               f"{message_payload['response']['response_code']}: "
+                               f"{message_payload['response']['response_description']}")
+        return message_type, message_payload
+
+    async def _parse_message(self, content):
+        """
+        Validate and parse an incoming message. Returns (None, {}) if the message is not valid.
+        """
         try:
             await self._execute_hooks('before_schema_validation', utils.ensure_str(content))
-            tree = validate_xml_schema(content)
-            if self.vtn_fingerprint:
+            if self.validation_policy is not None and self.vtn_fingerprint:
+                # The validation policy only applies to messages that are signed by the VTN
+                tree = parse_xml(content)
                 validate_xml_signature(tree, cert_fingerprint=self.vtn_fingerprint)
+                validate_xml_tree(tree, self.validation_policy)
+            else:
+                tree = validate_xml_schema(content)
+                if self.vtn_fingerprint:
+                    validate_xml_signature(tree, cert_fingerprint=self.vtn_fingerprint)
             await self._execute_hooks('before_parse_xml', utils.ensure_str(content))
-            message_type, message_payload = parse_message(content)
+            message_type, message_payload = parse_message_tree(tree)
             await self._execute_hooks('after_parse_xml', message_type, message_payload)
         except XMLSyntaxError as err:
             logger.warning(f"Incoming message did not pass XML schema validation: {err}")
@@ -1126,11 +1221,6 @@ class OpenADRClient:
         except Exception as err:
             logger.error(f"The incoming message could not be parsed or validated: {err}")
             return None, {}
-        if 'response' in message_payload and 'response_code' in message_payload['response']:
-            if message_payload['response']['response_code'] != 200:
-                logger.warning("We got a non-OK OpenADR response from the server: "
-                               f"{message_payload['response']['response_code']}: "
-                               f"{message_payload['response']['response_description']}")
         return message_type, message_payload
 
     async def _execute_hooks(self, hook_name, *args, **kwargs):
@@ -1223,10 +1313,10 @@ class OpenADRClient:
             response = {'response_code': 200 if invalid_vtn_id is False else enums.STATUS_CODES.INVALID_ID,
                         'response_description': 'OK' if invalid_vtn_id is False else 'ERROR',
                         'request_id': message['request_id']}
-            message = self._create_message('oadrCreatedEvent',
-                                           response=response,
-                                           event_responses=event_responses,
-                                           ven_id=self.ven_id)
+            message = await self._create_message_async('oadrCreatedEvent',
+                                                       response=response,
+                                                       event_responses=event_responses,
+                                                       ven_id=self.ven_id)
             service = 'EiEvent'
             await self._perform_request(service, message)
             # response_type, response_payload = await self._perform_request(service, message)
@@ -1262,6 +1352,12 @@ class OpenADRClient:
     async def _poll(self):
         logger.debug("Now polling for new messages")
         response_type, response_payload = await self.poll()
+        await self._handle_message(response_type, response_payload)
+
+    async def _handle_message(self, response_type, response_payload):
+        """
+        Handle a message that the VTN sent us, in response to a poll or by pushing it.
+        """
         if response_type is None:
             return
 
@@ -1289,12 +1385,12 @@ class OpenADRClient:
             # We don't support receiving reports from the VTN at this moment
             logger.warning("The VTN offered reports, but OpenLEADR "
                            "does not support reports in this direction.")
-            message = self._create_message('oadrRegisteredReport',
-                                           report_requests=[],
-                                           ven_id=self.ven_id,
-                                           response={'response_code': 200,
-                                                     'response_description': 'OK',
-                                                     'request_id': response_payload['request_id']})
+            message = await self._create_message_async('oadrRegisteredReport',
+                                                       report_requests=[],
+                                                       ven_id=self.ven_id,
+                                                       response={'response_code': 200,
+                                                                 'response_description': 'OK',
+                                                                 'request_id': response_payload['request_id']})
             service = 'EiReport'
             reponse_type, response_payload = await self._perform_request(service, message)
 
@@ -1313,6 +1409,82 @@ class OpenADRClient:
         # Immediately poll again, because there might be more messages
         # await self._poll()
 
+    async def _start_push_server(self):
+        """
+        Start the web server that receives the messages that the VTN pushes to us.
+        """
+        address = urlparse(self.transport_address)
+        port = self.push_port or address.port or (443 if address.scheme == 'https' else 80)
+        if address.scheme == 'https' and not self.cert_path:
+            raise ValueError(f"The transport_address {self.transport_address} uses https, but you "
+                             "did not provide a cert and key for the push web server.")
+        client_certificates = address.scheme == 'https' and bool(self.ca_file)
+        if not self.allow_insecure_push:
+            if address.scheme != 'https':
+                raise ValueError(f"The transport_address {self.transport_address} uses plain http, so "
+                                 "anyone who can reach it could push messages to this VEN. Use https, or "
+                                 "set allow_insecure_push=True if you accept this.")
+            if not client_certificates and not self.vtn_fingerprint:
+                raise ValueError("The push web server can not authenticate the VTN. Provide a ca_file "
+                                 "to require client certificates, or the vtn_fingerprint to check the "
+                                 "signatures, or set allow_insecure_push=True if you accept this.")
+        app = web.Application()
+        app.add_routes([web.post(f"{address.path}/{service}", self._on_push)
+                        for service in ('EiEvent', 'EiReport', 'EiRegisterParty', 'EiOpt')])
+        if address.scheme == 'https':
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(self.cert_path, self.key_path, self.passphrase)
+            if client_certificates:
+                # Only accept messages from parties with a certificate from our CA
+                ssl_context.load_verify_locations(self.ca_file)
+                ssl_context.verify_mode = ssl.CERT_REQUIRED
+        else:
+            ssl_context = None
+        self.push_runner = web.AppRunner(app)
+        await self.push_runner.setup()
+        site = web.TCPSite(self.push_runner, host=self.push_host, port=port, ssl_context=ssl_context)
+        await site.start()
+        self.push_queue_task = self.loop.create_task(self._push_queue_worker())
+        logger.info(f"Receiving pushed messages at {self.transport_address}")
+
+    async def _on_push(self, request):
+        """
+        Receive a message that the VTN pushed to us. The message is acknowledged right away
+        and handled afterwards, in the order in which the messages were received.
+        """
+        content = await request.read()
+        await self._execute_hooks('after_receive_xml', utils.ensure_str(content))
+        message_type, message_payload = await self._parse_message(content)
+        if message_type is None:
+            return web.Response(text='Invalid message', status=HTTPStatus.BAD_REQUEST)
+        # Only accept messages that are meant for us, from the VTN that we registered with
+        ven_id = message_payload.get('ven_id')
+        vtn_id = message_payload.get('vtn_id')
+        if (ven_id is not None and ven_id != self.ven_id) \
+                or (vtn_id is not None and self.vtn_id is not None and vtn_id != self.vtn_id):
+            logger.warning(f"Ignoring a pushed {message_type} message for venID {ven_id} from vtnID "
+                           f"{vtn_id}, we are venID {self.ven_id} registered with vtnID {self.vtn_id}.")
+            return web.Response(text='Invalid venID or vtnID', status=HTTPStatus.FORBIDDEN)
+        self.push_queue.put_nowait((message_type, message_payload))
+        msg = await self._create_message_async('oadrResponse',
+                                               ven_id=self.ven_id,
+                                               response={'response_code': 200,
+                                                         'response_description': 'OK',
+                                                         'request_id': message_payload.get('request_id')})
+        return web.Response(text=msg, status=HTTPStatus.OK, content_type='application/xml')
+
+    async def _push_queue_worker(self):
+        """
+        A Queue worker that handles the messages that the VTN pushed to us.
+        """
+        while True:
+            message_type, message_payload = await self.push_queue.get()
+            try:
+                await self._handle_message(message_type, message_payload)
+            except Exception as err:
+                logger.error(f"Could not handle the pushed {message_type} message: "
+                             f"{err.__class__.__name__}: {err}")
+
     async def _ensure_client_session(self):
         if not self.client_session:
             headers = {'content-type': 'application/xml'}
@@ -102,3 +102,10 @@ class RequestReregistration(Exception):
 
 class SendEmptyHTTPResponse(Exception):
     pass
+
+
+class RequestShed(Exception):
+    def __init__(self, message_type=None, message_payload=None):
+        super().__init__()
+        self.message_type = message_type
+        self.message_payload = message_payload
@@ -0,0 +1,189 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timer-driven status transitions for the events on the VTN.
+
+The times at which an event goes from 'far' to 'near' (at the start of its ramp up
+period), to 'active' and to 'completed' follow from its active period. The
+EventStatusScheduler keeps these transitions in a heap and updates the status of each
+event when the time comes, using a single timer on the asyncio event loop.
+"""
+
+from datetime import datetime, timezone
+import asyncio
+import heapq
+import itertools
+import logging
+
+from openleadr import enums, utils
+
+logger = logging.getLogger('openleadr')
+
+
+def event_transitions(event):
+    """
+    Get a list of (time, event_status) tuples for the status transitions of an event.
+    """
+    active_period = utils.getmember(event, 'active_period')
+    dtstart = utils.getmember(active_period, 'dtstart')
+    if dtstart.tzinfo is None:
+        dtstart = dtstart.astimezone(timezone.utc)
+    duration = utils.getmember(active_period, 'duration')
+    ramp_up_period = utils.getmember(active_period, 'ramp_up_period', missing=None)
+    transitions = []
+    if ramp_up_period is not None:
+        transitions.append((dtstart - ramp_up_period, enums.EVENT_STATUS.NEAR))
+    transitions.append((dtstart, enums.EVENT_STATUS.ACTIVE))
+    if duration.total_seconds() > 0:
+        transitions.append((dtstart + duration, enums.EVENT_STATUS.COMPLETED))
+    return transitions
+
+
+class EventStatusScheduler:
+    """
+    Updates the status of the events in an EventStore at the moment that it changes.
+
+    :param EventStore store: The store that holds the events.
+    :param callable on_status_change: Called with (ven_ids, event_id, old_status, new_status)
+                                      after the status of an event was changed.
+    """
+
+    def __init__(self, store, on_status_change=None):
+        self.store = store
+        self.on_status_change = on_status_change
+        self._transitions = []   # heap of (time, sequence, ((ven_id, event_id), ...))
+        self._sequence = itertools.count()
+        self._loop = None
+        self._timer = None
+        self._timer_time = None
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    def __len__(self):
+        return len(self._transitions)
+
+    def schedule_event(self, event, ven_id=None):
+        """
+        Bring the status of an event up to date, and schedule its future status transitions.
+
+        :param event: The event.
+        :param str ven_id: The VEN that this event belongs to, or None for a group event.
+        """
+        self.schedule_events([(ven_id, event)])
+
+    def schedule_events(self, events, same_active_period=False):
+        """
+        Bring the status of events up to date, and schedule their future status transitions.
+        Events that share the same active period object share their scheduled transitions.
+
+        :param list events: A list of (ven_id, event) tuples, with a ven_id of None for group events.
+        :param bool same_active_period: Whether all events have equal active periods, so that
+                                        they all share their scheduled transitions.
+        """
+        now = datetime.now(timezone.utc)
+        by_active_period = {}
+        for ven_id, event in events:
+            event_descriptor = utils.getmember(event, 'event_descriptor')
+            event_status = utils.getmember(event_descriptor, 'event_status')
+            if event_status == enums.EVENT_STATUS.CANCELLED:
+                continue
+            key = None if same_active_period else id(utils.getmember(event, 'active_period'))
+            if key not in by_active_period:
+                by_active_period[key] = (event, [])
+            by_active_period[key][1].append(
+                (ven_id, utils.getmember(event_descriptor, 'event_id'), event_status))
+
+        for first_event, period_events in by_active_period.values():
+            new_status = utils.determine_event_status(utils.getmember(first_event, 'active_period'), now)
+            keys = []
+            for ven_id, event_id, event_status in period_events:
+                if event_status != new_status:
+                    self._set_status(ven_id, event_id, new_status)
+                keys.append((ven_id, event_id))
+            keys = tuple(keys)
+            for time, _ in event_transitions(first_event):
+                if time > now:
+                    heapq.heappush(self._transitions, (time, next(self._sequence), keys))
+        self._arm_timer()
+
+    def start(self):
+        """
+        Start applying the status transitions. Must be called from a running event loop.
+        """
+        self._loop = asyncio.get_event_loop()
+        self._fire()
+
+    def stop(self):
+        """
+        Stop applying the status transitions. Transitions that are due are applied when
+        the scheduler is started again.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        self._loop = self._timer = self._timer_time = None
+
+    def _arm_timer(self):
+        if self._loop is None or not self._transitions:
+            return
+        time = self._transitions[0][0]
+        if self._timer is not None:
+            if self._timer_time <= time:
+                return
+            self._timer.cancel()
+        delay = (time - datetime.now(timezone.utc)).total_seconds()
+        self._timer = self._loop.call_at(self._loop.time() + max(delay, 0), self._fire)
+        self._timer_time = time
+
+    def _fire(self):
+        self._timer = self._timer_time = None
+        now = datetime.now(timezone.utc)
+        while self._transitions and self._transitions[0][0] <= now:
+            time, _, keys = heapq.heappop(self._transitions)
+            for ven_id, event_id in keys:
+                self._apply_transition(ven_id, event_id, time)
+        self._arm_timer()
+
+    def _apply_transition(self, ven_id, event_id, time):
+        event = self._get_event(ven_id, event_id)
+        if event is None:
+            return
+        old_status = utils.getmember(event, 'event_descriptor.event_status')
+        if old_status == enums.EVENT_STATUS.CANCELLED:
+            return
+        # The timer may go off slightly early, so the status is determined for the transition time
+        new_status = utils.determine_event_status(utils.getmember(event, 'active_period'),
+                                                  max(time, datetime.now(timezone.utc)))
+        if new_status != old_status:
+            self._set_status(ven_id, event_id, new_status)
+            if self.on_status_change is not None:
+                ven_ids = [ven_id] if ven_id is not None else list(self.store.delivery_states(event_id))
+                self.on_status_change(ven_ids, event_id, old_status, new_status)
+
+    def _get_event(self, ven_id, event_id):
+        if ven_id is None:
+            return self.store.get_group_event(event_id)
+        return self.store.get_event(ven_id, event_id)
+
+    def _set_status(self, ven_id, event_id, event_status):
+        if ven_id is None:
+            self.store.set_group_event_status(event_id, event_status)
+        else:
+            self.store.set_event_status(ven_id, event_id, event_status)
+        utils.setmember(self._get_event(ven_id, event_id),
+                        'event_descriptor.created_date_time', datetime.now(timezone.utc))
@@ -0,0 +1,666 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-memory storage for the events that the VTN distributes to its VENs, optionally
+backed by a StateBackend from openleadr.state.
+"""
+
+from collections import OrderedDict, deque
+from copy import deepcopy
+import time
+
+from openleadr import enums, utils
+from openleadr.state import merge_dicts
+
+
+class DeliveryState:
+    """
+    The delivery state of a group event for a single VEN.
+    """
+    __slots__ = ('delivered', 'opt_type', 'acknowledged')
+
+    def __init__(self):
+        self.delivered = None       # The modification number that was last delivered
+        self.opt_type = None        # The opt type from the last oadrCreatedEvent
+        self.acknowledged = None    # The modification number that was last acknowledged
+
+    def __eq__(self, other):
+        if not isinstance(other, DeliveryState):
+            return NotImplemented
+        return (self.delivered, self.opt_type, self.acknowledged) == \
+            (other.delivered, other.opt_type, other.acknowledged)
+
+    def __repr__(self):
+        return (f"DeliveryState(delivered={self.delivered}, opt_type={self.opt_type}, "
+                f"acknowledged={self.acknowledged})")
+
+
+class RenderCache:
+    """
+    Keeps the rendered oadrEvent elements of events, and the combined elements of the
+    event set that was last sent to each VEN. An event is identified by its
+    (event_id, modification_number, event_status), so a cached element is replaced
+    automatically when an event is modified, cancelled or changes its status.
+    """
+
+    def __init__(self):
+        self._events = {}       # {key: (modification_number, event_status, fragment)}
+        self._event_sets = {}   # {ven_id: (((event_id, modification_number, event_status), ...), fragment)}
+        self.hits = 0
+        self.misses = 0
+        self.event_hits = 0
+        self.event_misses = 0
+
+    def render_events(self, ven_id, events, keys, render):
+        """
+        Get the combined rendered oadrEvent elements for the (ordered) events for a VEN.
+
+        :param str ven_id: The VEN that the events are for
+        :param list events: The events, in the order in which they are sent
+        :param list keys: The key for the cached element of each event
+        :param callable render: A function that renders a single event to a string
+        """
+        versions = tuple((utils.getmember(event, 'event_descriptor.event_id'),
+                          utils.getmember(event, 'event_descriptor.modification_number'),
+                          utils.getmember(event, 'event_descriptor.event_status'))
+                         for event in events)
+        cached = self._event_sets.get(ven_id)
+        if cached is not None and cached[0] == versions:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        fragment = ''.join(self._render_event(key, event, version[1:], render)
+                           for key, event, version in zip(keys, events, versions))
+        self._event_sets[ven_id] = (versions, fragment)
+        return fragment
+
+    def _render_event(self, key, event, version, render):
+        cached = self._events.get(key)
+        if cached is not None and cached[:2] == version:
+            self.event_hits += 1
+            return cached[2]
+        self.event_misses += 1
+        fragment = render(event)
+        self._events[key] = (*version, fragment)
+        return fragment
+
+    def invalidate(self, ven_id=None, key=None):
+        """
+        Forget the event set for a VEN and/or the rendered element of a single event.
+        """
+        self._event_sets.pop(ven_id, None)
+        self._events.pop(key, None)
+
+    def clear(self):
+        """
+        Forget all rendered elements.
+        """
+        self._events.clear()
+        self._event_sets.clear()
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of event sets that were served from the cache.
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._events)
+
+
+class EventStore:
+    """
+    Holds the events for each VEN, indexed by (ven_id, event_id), by event_id
+    and by event status, so that events can be found without scanning lists.
+
+    The events for a VEN keep the order in which they were added. Reading
+    ``store[ven_id]`` gives a list of the events for that VEN, like the
+    plain dict of lists that was used before.
+
+    A group event is a single event object that is shared by many VENs. Its
+    delivery state per VEN is kept in a side table, and its oadrEvent element
+    is rendered once for each modification and then reused for every VEN.
+
+    The rendered events are kept in the render_cache, see render_events.
+
+    If a StateBackend is given, every change is saved to the backend. The events for a VEN
+    are loaded from the backend when they are first used, and the on_load callback is then
+    called with the ven_id and the list of loaded events. Group events are loaded at once
+    by load_group_events. Use load_all to load the events for all VENs, for instance before
+    using events_with_status or iterating over the store. Events that are changed by another
+    process that shares the backend are loaded again when the backend is refreshed. When
+    two processes change the events of the same VEN, or the same group event, at the same
+    time, the changes are merged by event_id and by VEN.
+
+    :param StateBackend backend: The backend to save the events to.
+    """
+
+    def __init__(self, backend=None):
+        self._events = {}        # {ven_id: {event_id: event}}
+        self._by_event_id = {}   # {event_id: {ven_id: event}}
+        self._by_status = {}     # {event_status: {(ven_id, event_id)}}
+        self._status = {}        # {(ven_id, event_id): event_status}
+        self._deliveries = {}    # {event_id: {ven_id: DeliveryState}} for group events
+        self._sort_keys = {}     # {(ven_id, event_id): (modification_number, dtstart, priority)}
+        self.render_cache = RenderCache()
+        self.backend = backend
+        self.on_load = None
+        self._stored = set()
+        if backend is not None:
+            self._stored.update(backend.keys('events'))
+            backend.subscribe('events', self.forget)
+            backend.subscribe('group_events', self.reload_group_event)
+            backend.set_merge('events', merge_dicts)
+            backend.set_merge('group_events', merge_group_events)
+
+    def load_group_events(self):
+        """
+        Load the group events from the backend. Returns the list of loaded events.
+        """
+        if self.backend is None:
+            return []
+        events = [event for event in map(self._load_group_event, self.backend.keys('group_events'))
+                  if event is not None]
+        if events and self.on_load is not None:
+            self.on_load(None, events)
+        return events
+
+    def _load_group_event(self, event_id):
+        stored = self.backend.load('group_events', event_id)
+        if stored is None:
+            return None
+        event, deliveries = stored
+        event_status = utils.getmember(event, 'event_descriptor.event_status', None)
+        for ven_id in deliveries:
+            self._events.setdefault(ven_id, {})[event_id] = event
+            self._by_event_id.setdefault(event_id, {})[ven_id] = event
+            self._index_status(ven_id, event_id, event_status)
+        self._deliveries[event_id] = deliveries
+        return event
+
+    def forget(self, ven_id):
+        """
+        Forget the events for this VEN, other than group events, so that they are
+        loaded from the backend again when they are next used.
+        """
+        for event_id in list(self._events.get(ven_id, ())):
+            if event_id not in self._deliveries:
+                self._remove(ven_id, event_id)
+        self._stored.add(ven_id)
+
+    def reload_group_event(self, event_id):
+        """
+        Load a group event from the backend again.
+        """
+        for ven_id in list(self._deliveries.get(event_id, ())):
+            self._remove(ven_id, event_id)
+        event = self._load_group_event(event_id)
+        if event is not None and self.on_load is not None:
+            self.on_load(None, [event])
+
+    def load_all(self):
+        """
+        Load the events for all VENs from the backend.
+        """
+        for ven_id in list(self._stored):
+            self._load(ven_id)
+
+    def _load(self, ven_id):
+        if ven_id not in self._stored:
+            return
+        self._stored.discard(ven_id)
+        stored = self.backend.load('events', ven_id)
+        if not stored:
+            return
+        events = self._events.setdefault(ven_id, {})
+        for event_id, event in stored.items():
+            events[event_id] = event
+            self._by_event_id.setdefault(event_id, {})[ven_id] = event
+            self._index_status(ven_id, event_id, utils.getmember(event, 'event_descriptor.event_status', None))
+        if self.on_load is not None:
+            self.on_load(ven_id, list(stored.values()))
+
+    def _save(self, ven_id, event_id):
+        if self.backend is None:
+            return
+        if event_id in self._deliveries:
+            self._save_group_event(event_id)
+            return
+        events = {own_event_id: event for own_event_id, event in self._events.get(ven_id, {}).items()
+                  if own_event_id not in self._deliveries}
+        if events:
+            self.backend.save('events', ven_id, events)
+        else:
+            self.backend.delete('events', ven_id)
+
+    def _save_group_event(self, event_id):
+        if self.backend is None:
+            return
+        if event_id in self._deliveries:
+            self.backend.save('group_events', event_id, (self.get_group_event(event_id), self._deliveries[event_id]))
+        else:
+            self.backend.delete('group_events', event_id)
+
+    def add_event(self, ven_id, event):
+        """
+        Add an event for a VEN. An earlier event with the same event_id for this VEN is replaced.
+        """
+        self._load(ven_id)
+        event_id = utils.getmember(event, 'event_descriptor.event_id')
+        if event_id in self._events.get(ven_id, {}):
+            self.remove_event(ven_id, event_id)
+        self._events.setdefault(ven_id, {})[event_id] = event
+        self._by_event_id.setdefault(event_id, {})[ven_id] = event
+        self._index_status(ven_id, event_id, utils.getmember(event, 'event_descriptor.event_status', None))
+        self.render_cache.invalidate(ven_id)
+        self._save(ven_id, event_id)
+        return event_id
+
+    def add_events(self, events):
+        """
+        Add many events at once, each for a single VEN. Takes a list of (ven_id, event) tuples.
+        Earlier events with the same event_id for a VEN are replaced.
+        """
+        changed = {}
+        for ven_id, event in events:
+            self._load(ven_id)
+            event_id = utils.getmember(event, 'event_descriptor.event_id')
+            ven_events = self._events.setdefault(ven_id, {})
+            if event_id in ven_events:
+                self.remove_event(ven_id, event_id)
+                ven_events = self._events.setdefault(ven_id, {})
+            ven_events[event_id] = event
+            self._by_event_id.setdefault(event_id, {})[ven_id] = event
+            self._index_status(ven_id, event_id, utils.getmember(event, 'event_descriptor.event_status', None))
+            changed[ven_id] = event_id
+        # The cache and the backend are only updated once for each VEN
+        for ven_id, event_id in changed.items():
+            self.render_cache.invalidate(ven_id)
+            self._save(ven_id, event_id)
+
+    def add_group_event(self, ven_ids, event):
+        """
+        Add a single event that is shared by all of the given VENs. Earlier events with
+        the same event_id for these VENs are replaced.
+        """
+        event_id = utils.getmember(event, 'event_descriptor.event_id')
+        event_status = utils.getmember(event, 'event_descriptor.event_status', None)
+        self.remove_group_event(event_id)
+        for ven_id in ven_ids:
+            self._load(ven_id)
+            if event_id in self._events.get(ven_id, {}):
+                self.remove_event(ven_id, event_id)
+        deliveries = self._deliveries[event_id] = {}
+        for ven_id in ven_ids:
+            self._events.setdefault(ven_id, {})[event_id] = event
+            self._by_event_id.setdefault(event_id, {})[ven_id] = event
+            self._index_status(ven_id, event_id, event_status)
+            deliveries[ven_id] = DeliveryState()
+        self._save_group_event(event_id)
+        return event_id
+
+    def is_group_event(self, event_id):
+        """
+        Whether the event with this event_id is a group event.
+        """
+        return event_id in self._deliveries
+
+    def get_group_event(self, event_id):
+        """
+        Get the shared event object of a group event, or None if there is no such group event.
+        """
+        deliveries = self._deliveries.get(event_id)
+        if not deliveries:
+            return None
+        return self._events[next(iter(deliveries))][event_id]
+
+    def has_event(self, event_id):
+        """
+        Whether there is an event with this event_id for any VEN.
+        """
+        return event_id in self._by_event_id
+
+    def get_event(self, ven_id, event_id, modification_number=None):
+        """
+        Get the event with this event_id for this VEN, or None if it does not exist. If a
+        modification_number is given, the event is only returned if its modification number matches.
+        """
+        self._load(ven_id)
+        event = self._events.get(ven_id, {}).get(event_id)
+        if event is None or modification_number is None:
+            return event
+        if utils.getmember(event, 'event_descriptor.modification_number') != modification_number:
+            return None
+        return event
+
+    def get_events(self, ven_id):
+        """
+        Get a list of the events for this VEN, in the order in which they were added.
+        """
+        self._load(ven_id)
+        return list(self._events.get(ven_id, {}).values())
+
+    def find_events(self, event_id, modification_number=None):
+        """
+        Get a list of (ven_id, event) tuples for the events with this event_id,
+        optionally with this modification_number, for all VENs.
+        """
+        events = self._by_event_id.get(event_id, {}).items()
+        if modification_number is None:
+            return list(events)
+        return [(ven_id, event) for ven_id, event in events
+                if utils.getmember(event, 'event_descriptor.modification_number') == modification_number]
+
+    def events_with_status(self, event_status):
+        """
+        Get a list of (ven_id, event) tuples for the events that have this status.
+        """
+        return [(ven_id, self._events[ven_id][event_id])
+                for ven_id, event_id in self._by_status.get(event_status, ())]
+
+    def remove_event(self, ven_id, event_id):
+        """
+        Remove an event for a VEN. Returns the event, or None if it did not exist.
+        """
+        self._load(ven_id)
+        is_group_event = event_id in self._deliveries
+        event = self._remove(ven_id, event_id)
+        if event is not None:
+            if is_group_event:
+                self._save_group_event(event_id)
+            else:
+                self._save(ven_id, event_id)
+        return event
+
+    def _remove(self, ven_id, event_id):
+        event = self._events.get(ven_id, {}).pop(event_id, None)
+        if event is None:
+            return None
+        del self._by_event_id[event_id][ven_id]
+        if not self._by_event_id[event_id]:
+            del self._by_event_id[event_id]
+        self._unindex_status(ven_id, event_id)
+        self._sort_keys.pop((ven_id, event_id), None)
+        if event_id in self._deliveries:
+            self._deliveries[event_id].pop(ven_id, None)
+            if not self._deliveries[event_id]:
+                del self._deliveries[event_id]
+                self.render_cache.invalidate(key=event_id)
+            self.render_cache.invalidate(ven_id)
+        else:
+            self.render_cache.invalidate(ven_id, (ven_id, event_id))
+        return event
+
+    def remove_group_event(self, event_id):
+        """
+        Remove a group event for all of its VENs. Returns the list of VENs that had the event.
+        """
+        ven_ids = list(self._deliveries.get(event_id, ()))
+        for ven_id in ven_ids:
+            self.remove_event(ven_id, event_id)
+        return ven_ids
+
+    def detach_event(self, ven_id, event_id):
+        """
+        Give this VEN its own copy of a group event, so that the event can be changed for
+        this VEN only. Returns the (copied) event, or None if the VEN does not have the event.
+        """
+        event = self.get_event(ven_id, event_id)
+        if event is not None and event_id in self._deliveries:
+            event = deepcopy(event)
+            self.add_event(ven_id, event)
+        return event
+
+    def set_group_event_status(self, event_id, event_status):
+        """
+        Set the status of a group event for all of its VENs.
+        """
+        utils.setmember(self.get_group_event(event_id), 'event_descriptor.event_status', event_status)
+        for ven_id in self._deliveries[event_id]:
+            self._index_status(ven_id, event_id, event_status)
+        self._save_group_event(event_id)
+
+    def delivery_state(self, ven_id, event_id):
+        """
+        Get the DeliveryState of a group event for this VEN, or None if this is not a group event.
+        """
+        return self._deliveries.get(event_id, {}).get(ven_id)
+
+    def delivery_states(self, event_id):
+        """
+        Get a dict of {ven_id: DeliveryState} for a group event.
+        """
+        return dict(self._deliveries.get(event_id, {}))
+
+    def mark_delivered(self, ven_id, event_id):
+        """
+        Record that the current modification of a group event was delivered to this VEN.
+        """
+        state = self.delivery_state(ven_id, event_id)
+        if state is not None:
+            modification_number = utils.getmember(self._events[ven_id][event_id],
+                                                  'event_descriptor.modification_number')
+            if state.delivered != modification_number:
+                state.delivered = modification_number
+                self._save_group_event(event_id)
+
+    def mark_acknowledged(self, ven_id, event_id, modification_number, opt_type):
+        """
+        Record the response of this VEN to a group event. Returns False if this VEN
+        already gave the same response to this modification of the event.
+        """
+        state = self.delivery_state(ven_id, event_id)
+        if state is None:
+            return False
+        if (state.acknowledged, state.opt_type) == (modification_number, opt_type):
+            return False
+        state.acknowledged = modification_number
+        state.opt_type = opt_type
+        self._save_group_event(event_id)
+        return True
+
+    def render_events(self, ven_id, events, render):
+        """
+        Get the rendered oadrEvent elements for these events for this VEN, as a single
+        string. Events are only rendered again when they were modified or when their
+        status changed, and a group event is rendered only once for all of its VENs.
+
+        :param str ven_id: The VEN that the events are for
+        :param list events: The events for this VEN, in the order in which they are sent
+        :param callable render: A function that renders a single event to a string
+        """
+        keys = []
+        for event in events:
+            event_id = utils.getmember(event, 'event_descriptor.event_id')
+            keys.append(event_id if event_id in self._deliveries else (ven_id, event_id))
+        return self.render_cache.render_events(ven_id, events, keys, render)
+
+    def set_event_status(self, ven_id, event_id, event_status):
+        """
+        Set the status of an event and update the status index.
+        """
+        self._load(ven_id)
+        event = self._events[ven_id][event_id]
+        utils.setmember(event, 'event_descriptor.event_status', event_status)
+        self._index_status(ven_id, event_id, event_status)
+        self._save(ven_id, event_id)
+
+    def ordered_events(self, ven_id, update_statuses=True):
+        """
+        Return the events for this VEN in the order in which they should be delivered:
+        active events before other events, earlier before later, and higher priority before
+        lower priority. Events that are otherwise equal keep the order in which they were added.
+
+        :param bool update_statuses: Whether to determine the current status of each event
+                                     first. This is not needed if the statuses are kept up
+                                     to date by an EventStatusScheduler.
+        """
+        self._load(ven_id)
+        if update_statuses:
+            events = utils.order_events(self.get_events(ven_id))
+            for event in events:
+                event_id = utils.getmember(event, 'event_descriptor.event_id')
+                event_status = utils.getmember(event, 'event_descriptor.event_status')
+                if self._status.get((ven_id, event_id)) != event_status:
+                    self._index_status(ven_id, event_id, event_status)
+                    self._save(ven_id, event_id)
+            return events
+        events = self._events.get(ven_id, {})
+        order = sorted(events, key=lambda event_id: self._sort_key(ven_id, event_id, events[event_id]))
+        return [events[event_id] for event_id in order]
+
+    def _sort_key(self, ven_id, event_id, event):
+        key = (ven_id, event_id)
+        modification_number = utils.getmember(event, 'event_descriptor.modification_number')
+        cached = self._sort_keys.get(key)
+        if cached is None or cached[0] != modification_number:
+            priority = utils.getmember(event, 'event_descriptor.priority', missing=0) or float('inf')
+            cached = (modification_number, utils.getmember(event, 'active_period.dtstart'), priority)
+            self._sort_keys[key] = cached
+        if self._status.get(key) == enums.EVENT_STATUS.ACTIVE:
+            return (0, cached[1], cached[2])
+        return (1, cached[1], 0)
+
+    def _index_status(self, ven_id, event_id, event_status):
+        key = (ven_id, event_id)
+        if self._status.get(key, object()) == event_status:
+            return
+        self._unindex_status(ven_id, event_id)
+        self._status[key] = event_status
+        self._by_status.setdefault(event_status, set()).add(key)
+
+    def _unindex_status(self, ven_id, event_id):
+        key = (ven_id, event_id)
+        if key in self._status:
+            event_status = self._status.pop(key)
+            self._by_status[event_status].discard(key)
+            if not self._by_status[event_status]:
+                del self._by_status[event_status]
+
+    def __getitem__(self, ven_id):
+        self._load(ven_id)
+        if ven_id not in self._events:
+            raise KeyError(ven_id)
+        return self.get_events(ven_id)
+
+    def __contains__(self, ven_id):
+        self._load(ven_id)
+        return ven_id in self._events
+
+    def __iter__(self):
+        return iter(self._events)
+
+    def __len__(self):
+        return len(self._events)
+
+    def items(self):
+        return [(ven_id, self.get_events(ven_id)) for ven_id in self._events]
+
+
+def merge_group_events(base, ours, theirs):
+    """
+    Merge the changes that two processes made to a stored group event. The delivery states
+    are merged by VEN; if both processes changed the event itself, this process's event is kept.
+    """
+    base_event, base_deliveries = base or (None, None)
+    our_event, our_deliveries = ours or (None, None)
+    their_event, their_deliveries = theirs or (None, None)
+    deliveries = merge_dicts(base_deliveries, our_deliveries, their_deliveries)
+    if deliveries is None:
+        return None
+    if our_event is None or (our_event == base_event and their_event is not None):
+        return their_event, deliveries
+    return our_event, deliveries
+
+
+class CompletedEvents:
+    """
+    Remembers the event_ids of the events that were completed for each VEN, so that a
+    late oadrCreatedEvent for a completed event is not treated as an error. An event_id
+    is forgotten after ttl seconds, and at most max_per_ven event_ids are kept for each
+    VEN, so the memory use stays bounded however long the VTN runs.
+
+    Use ``(ven_id, event_id) in completed_events`` to check for a completed event.
+
+    :param float ttl: The number of seconds that an event_id is remembered.
+    :param int max_per_ven: The maximum number of event_ids that are remembered for each VEN.
+    """
+
+    def __init__(self, ttl=86400, max_per_ven=1000):
+        self.ttl = ttl
+        self.max_per_ven = max_per_ven
+        self._event_ids = {}    # {ven_id: OrderedDict(event_id: completed_at)}, oldest first
+        self._expiry = deque()  # (completed_at, ven_id, event_id) tuples, oldest first
+        self._size = 0
+
+    def add(self, ven_id, event_id):
+        """
+        Remember that this event was completed for this VEN.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        event_ids = self._event_ids.setdefault(ven_id, OrderedDict())
+        if event_id in event_ids:
+            event_ids.move_to_end(event_id)
+        else:
+            self._size += 1
+        event_ids[event_id] = now
+        self._expiry.append((now, ven_id, event_id))
+        if len(event_ids) > self.max_per_ven:
+            event_ids.popitem(last=False)
+            self._size -= 1
+        # Entries for event_ids that were added again or evicted stay in the expiry queue
+        # until they expire. Compact it when they make up more than half of the queue.
+        if len(self._expiry) > 2 * self._size + 16:
+            self._compact()
+
+    def count(self, ven_id):
+        """
+        The number of completed event_ids that are remembered for this VEN.
+        """
+        self._expire(time.monotonic())
+        return len(self._event_ids.get(ven_id, ()))
+
+    def _expire(self, now):
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now - self.ttl:
+            completed_at, ven_id, event_id = expiry.popleft()
+            event_ids = self._event_ids.get(ven_id)
+            # Skip the entries that were evicted or added again in the meantime
+            if event_ids is not None and event_ids.get(event_id) == completed_at:
+                del event_ids[event_id]
+                self._size -= 1
+                if not event_ids:
+                    del self._event_ids[ven_id]
+
+    def _compact(self):
+        entries = [(completed_at, ven_id, event_id)
+                   for ven_id, event_ids in self._event_ids.items()
+                   for event_id, completed_at in event_ids.items()]
+        entries.sort(key=lambda entry: entry[0])
+        self._expiry = deque(entries)
+
+    def __contains__(self, item):
+        ven_id, event_id = item
+        self._expire(time.monotonic())
+        return event_id in self._event_ids.get(ven_id, ())
+
+    def __len__(self):
+        self._expire(time.monotonic())
+        return self._size
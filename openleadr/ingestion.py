@@ -0,0 +1,242 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Asynchronous ingestion of report values.
+
+Normally, the VTN calls the report callbacks while it handles the oadrUpdateReport
+message, so the VEN waits for the callbacks before it gets its oadrUpdatedReport. With a
+ReportQueue, the VTN puts the values from the report in a bounded queue and responds
+right away. Worker tasks take the values from the queue and deliver them to the
+callbacks in columnar batches.
+"""
+
+from datetime import timezone
+import asyncio
+import logging
+
+from openleadr import errors, utils
+
+logger = logging.getLogger('openleadr')
+
+WHEN_FULL = ('wait', 'reject', 'drop')
+
+
+class ReportBatch:
+    """
+    A batch of values for one r_id of a report, stored as a column of timestamps and a
+    column of values. Iterating over a batch gives (timestamp, value) tuples, like the
+    lists that the report callbacks receive without a ReportQueue.
+
+    :ivar str report_request_id: The reportRequestID of the report.
+    :ivar str r_id: The rID of the values.
+    :ivar list timestamps: The dtstart of each value.
+    :ivar list values: The values.
+    """
+
+    __slots__ = ('report_request_id', 'r_id', 'timestamps', 'values')
+
+    def __init__(self, report_request_id, r_id, timestamps, values):
+        self.report_request_id = report_request_id
+        self.r_id = r_id
+        self.timestamps = timestamps
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return zip(self.timestamps, self.values)
+
+    def __eq__(self, other):
+        if isinstance(other, ReportBatch):
+            return (self.report_request_id, self.r_id, self.timestamps, self.values) == \
+                (other.report_request_id, other.r_id, other.timestamps, other.values)
+        return list(self) == other
+
+    def __repr__(self):
+        return (f"ReportBatch(report_request_id={self.report_request_id!r}, "
+                f"r_id={self.r_id!r}, {len(self)} values)")
+
+    def to_numpy(self):
+        """
+        Return the timestamps and values as NumPy arrays. The timestamps are converted to
+        UTC and returned as a datetime64[us] array. Requires NumPy.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("ReportBatch.to_numpy requires NumPy, which is not installed.")
+        timestamps = numpy.array([ts.astimezone(timezone.utc).replace(tzinfo=None)
+                                  if ts.tzinfo is not None else ts for ts in self.timestamps],
+                                 dtype='datetime64[us]')
+        return timestamps, numpy.asarray(self.values)
+
+
+class ReportQueue:
+    """
+    Delivers the values of incoming reports to the report callbacks in the background.
+
+    :param int max_size: The maximum number of batches that may wait in the queue. With
+                         'reject' or 'drop', a message with more batches than this is
+                         always rejected or dropped, so keep it well above the number of
+                         batches in your largest oadrUpdateReport.
+    :param int batch_size: The maximum number of values in a batch.
+    :param int workers: The number of tasks that deliver batches to the callbacks. With more
+                        than one worker, the batches of a report may be delivered out of order.
+    :param str when_full: What happens to a report that doesn't fit in the queue: 'wait' for
+                          space before responding to the VEN, 'reject' the report with an error
+                          response, so that the VEN can send it again later, or 'drop' the
+                          values of the report.
+    :param type reject_error: The openleadr.errors.ProtocolError that determines the
+                              response code when a report is rejected.
+    """
+
+    def __init__(self, max_size=1000, batch_size=1000, workers=1, when_full='wait',
+                 reject_error=errors.DeploymentError):
+        if when_full not in WHEN_FULL:
+            raise ValueError(f"The when_full parameter must be one of {', '.join(WHEN_FULL)}, "
+                             f"not {when_full!r}.")
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.workers = workers
+        self.when_full = when_full
+        self.reject_error = reject_error
+        self.received = 0       # Values that were put in the queue
+        self.delivered = 0      # Values that were delivered to the callbacks
+        self.dropped = 0        # Values that were dropped because the queue was full
+        self.rejected = 0       # Reports that were rejected because the queue was full
+        self._queue = None
+        self._tasks = []
+
+    @property
+    def depth(self):
+        """
+        The number of batches that are waiting in the queue.
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """
+        Start the worker tasks. Must be called from a running event loop. The workers are
+        also started when the first report is put in the queue.
+        """
+        self._get_queue()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.ensure_future(self._work()))
+
+    async def join(self):
+        """
+        Wait until all batches in the queue have been delivered.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """
+        Deliver the batches that are still in the queue, and stop the worker tasks.
+        """
+        if self._tasks:
+            await self.join()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+
+    async def put(self, report_request_id, records, route):
+        """
+        Collect the (r_id, dtstart, value) records of a report in batches and put them in
+        the queue. Records for an r_id without a callback are skipped.
+
+        :param str report_request_id: The reportRequestID of the report.
+        :param records: An iterable of (r_id, dtstart, value) tuples.
+        :param dict route: The report callbacks for this report, by r_id.
+        """
+        await self.put_batches(self.make_batches(report_request_id, records, route))
+
+    def make_batches(self, report_request_id, records, route):
+        """
+        Collect the (r_id, dtstart, value) records of a report in batches of at most
+        batch_size values, without putting them in the queue. Returns a list of
+        (callback, ReportBatch) tuples for put_batches.
+        """
+        batches = []
+        columns = {}
+        for r_id, dtstart, value in records:
+            column = columns.get(r_id)
+            if column is None:
+                callback = route.get(r_id)
+                if callback is None:
+                    continue
+                column = columns[r_id] = (callback, [], [])
+            column[1].append(dtstart)
+            column[2].append(value)
+            if len(column[2]) >= self.batch_size:
+                batches.append((column[0], ReportBatch(report_request_id, r_id, column[1], column[2])))
+                del columns[r_id]
+        for r_id, (callback, timestamps, values) in columns.items():
+            batches.append((callback, ReportBatch(report_request_id, r_id, timestamps, values)))
+        return batches
+
+    async def put_batches(self, batches):
+        """
+        Put the batches from make_batches in the queue, for instance the batches of all
+        reports in a message. If the queue does not have room for all of them, and
+        when_full is 'reject' or 'drop', none of them are put in the queue. This means
+        that a message with more than max_size batches is always rejected or dropped.
+        """
+        if not batches:
+            return
+        if not self._tasks:
+            self.start()
+        queue = self._queue
+        count = sum(len(batch) for callback, batch in batches)
+        if self.when_full != 'wait' and self.max_size - queue.qsize() < len(batches):
+            report_request_ids = ', '.join(dict.fromkeys(batch.report_request_id for callback, batch in batches))
+            if len(batches) > self.max_size:
+                reason = (f"The {len(batches)} batches for report request(s) {report_request_ids} "
+                          f"don't fit in a report queue with a max_size of {self.max_size}")
+            else:
+                reason = f"The report queue is full, no room for report request(s) {report_request_ids}"
+            if self.when_full == 'drop':
+                self.dropped += count
+                logger.warning(f"{reason}, dropping {count} values.")
+                return
+            # The caller logs the rejection, with the queue metrics
+            self.rejected += 1
+            logger.debug(f"{reason}, rejecting the report.")
+            raise self.reject_error()
+        for item in batches:
+            await queue.put(item)
+        self.received += count
+
+    def _get_queue(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        return self._queue
+
+    async def _work(self):
+        queue = self._queue
+        while True:
+            callback, batch = await queue.get()
+            try:
+                await utils.await_if_required(callback(batch))
+                self.delivered += len(batch)
+            except Exception as err:
+                logger.error(f"An exception occurred in the report callback for r_id {batch.r_id} "
+                             f"of report request {batch.report_request_id}: "
+                             f"{err.__class__.__name__}: {err}")
+            finally:
+                queue.task_done()
@@ -0,0 +1,115 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A cache for the results of the ven_lookup and fingerprint_lookup functions, which are
+often backed by a database. A result is kept for ttl seconds, and the lookups for a VEN
+that are started while the same lookup is already running wait for its result instead
+of starting another one.
+"""
+
+from collections import OrderedDict
+import asyncio
+import time
+
+from openleadr import utils
+
+
+class LookupCache:
+    """
+    Keeps the results of lookups by (lookup name, ven_id). Empty results (None or {}, for
+    unknown VENs) are not kept, so that a VEN can be used as soon as it is known.
+
+    :param float ttl: The number of seconds that a result is kept.
+    :param int max_size: The maximum number of results that are kept. The least recently
+                         used results are removed first.
+    """
+
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._results = OrderedDict()   # {(name, ven_id): (expires, result)}, least recently used first
+        self._pending = {}              # {(name, ven_id): asyncio.Future} for running lookups
+        self._names = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0              # Lookups that waited for a running lookup
+
+    async def get(self, name, ven_id, lookup):
+        """
+        Get the result of the lookup for this VEN, from the cache or by calling the lookup
+        function with the ven_id.
+
+        :param str name: The name of the lookup, for instance 'ven_lookup'.
+        :param str ven_id: The ven_id to look up.
+        :param callable lookup: The (sync or async) lookup function.
+        """
+        key = (name, ven_id)
+        self._names.add(name)
+        cached = self._results.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self._results.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            del self._results[key]
+        if key in self._pending:
+            self.coalesced += 1
+            return await asyncio.shield(self._pending[key])
+
+        self.misses += 1
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await utils.await_if_required(lookup(ven_id))
+        except BaseException as err:
+            future.set_exception(err)
+            # Don't warn about an exception that no other lookup was waiting for
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if result and self._pending.get(key) is future:
+                self._results[key] = (time.monotonic() + self.ttl, result)
+                if len(self._results) > self.max_size:
+                    self._results.popitem(last=False)
+        finally:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+        return result
+
+    def invalidate(self, ven_id=None):
+        """
+        Forget the results for this VEN, or for all VENs if no ven_id is given. Lookups
+        that are running for the VEN are not shared with later lookups.
+        """
+        if ven_id is None:
+            self._results.clear()
+            self._pending.clear()
+            return
+        for name in self._names:
+            self._results.pop((name, ven_id), None)
+            self._pending.pop((name, ven_id), None)
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of lookups that did not call the lookup function.
+        """
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    def __len__(self):
+        return len(self._results)
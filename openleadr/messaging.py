@@ -22,10 +22,20 @@ from uuid import uuid4
 from lxml.etree import Element
 from openleadr import errors
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict
+from functools import partial, lru_cache
+from OpenSSL import crypto
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from signxml.util import iterate_pem
+import asyncio
 import os
+import threading
 
 from openleadr import utils
 from .preflight import preflight_message
+from .serializers import serialize_message
+from .replay import MemoryNonceStore
 
 import logging
 logger = logging.getLogger('openleadr')
@@ -40,6 +50,7 @@ XML_SCHEMA_LOCATION = os.path.join(os.path.dirname(__file__), 'schema', 'oadr_20
 with open(XML_SCHEMA_LOCATION) as file:
     XML_SCHEMA = etree.XMLSchema(etree.parse(file))
 XML_PARSER = etree.XMLParser(schema=XML_SCHEMA)
+PLAIN_XML_PARSER = etree.XMLParser()
 
 
 def parse_message(data):
@@ -62,64 +73,374 @@ def parse_message(data):
     return message_type, message_payload
 
 
+def parse_message_tree(tree, stream_report_intervals=False):
+    """
+    Distill the usable parts of a message from an already parsed XML tree. This gives the
+    same result as parse_message, but avoids parsing the XML content a second time.
+    :param tree lxml.etree: The XML tree, as returned by validate_xml_schema
+    :param bool stream_report_intervals: For an oadrUpdateReport, leave the intervals out of the
+                                         reports, and add an 'interval_values' generator to each
+                                         report instead, that yields (r_id, dtstart, value) tuples
+                                         straight from the XML tree.
+
+    Returns a message type (str) and a message payload (dict)
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Parsing message: {etree.tostring(tree).decode('utf-8')}")
+    skip_tag = None
+    if stream_report_intervals:
+        update_report = tree.find(_UPDATE_REPORT_PATH)
+        if update_report is not None:
+            skip_tag = _INTERVALS_TAG
+    message_dict = {_build_name(tree.tag): _tree_to_dict(tree, skip_tag)}
+    message_type, message_payload = message_dict['oadrPayload']['oadrSignedObject'].popitem()
+    message_payload = utils.normalize_dict(message_payload)
+    if skip_tag is not None:
+        report_elements = update_report.iterfind(_REPORT_TAG)
+        for report, report_element in zip(message_payload.get('reports', []), report_elements):
+            report['interval_values'] = iter_report_values(report_element)
+    return message_type, message_payload
+
+
+def get_report_request_ids(tree):
+    """
+    Return the reportRequestIDs of the reports in an oadrUpdateReport tree, or an empty
+    list for other messages.
+    :param tree lxml.etree: The XML tree, as returned by validate_xml_schema
+    """
+    update_report = tree.find(_UPDATE_REPORT_PATH)
+    if update_report is None:
+        return []
+    return [(report_element.findtext(_REPORT_REQUEST_ID_TAG) or '').strip()
+            for report_element in update_report.iterfind(_REPORT_TAG)]
+
+
+def iter_report_values(report_element):
+    """
+    Yield an (r_id, dtstart, value) tuple for each interval in an oadrReport element,
+    without building the complete dict for each interval. The values are converted
+    in the same way as parse_message would.
+    :param report_element lxml.etree.Element: The oadrReport element
+    """
+    for interval in report_element.iterfind(_INTERVAL_PATH):
+        dtstart = interval.findtext(_INTERVAL_DTSTART_PATH)
+        r_id = interval.findtext(_REPORT_PAYLOAD_RID_PATH)
+        value = interval.findtext(_REPORT_PAYLOAD_VALUE_PATH)
+        yield (utils.normalize_value(r_id.strip()) if r_id else None,
+               utils.parse_datetime(dtstart.strip()) if dtstart else None,
+               float(value) if value else None)
+
+
 def create_message(message_type, cert=None, key=None, passphrase=None, disable_signature=False, **message_payload):
     """
     Create and optionally sign an OpenADR message. Returns an XML string.
+
+    The key can be a PEM-encoded private key or a key object from load_signing_key, and the
+    cert can be a PEM-encoded certificate (chain) or the result of load_certificate_chain.
+    PEM-encoded keys and certificates are only loaded once and then kept in a cache.
     """
     message_payload = preflight_message(message_type, message_payload)
-    template = TEMPLATES.get_template(f'{message_type}.xml')
-    signed_object = utils.flatten_xml(template.render(**message_payload))
-    envelope = TEMPLATES.get_template('oadrPayload.xml')
+    signed_object = serialize_message(message_type, message_payload)
+    if signed_object is None:
+        template = TEMPLATES.get_template(f'{message_type}.xml')
+        signed_object = template.render(**message_payload)
     if cert and key and not disable_signature:
+        if isinstance(key, (str, bytes)):
+            key = load_signing_key(key, passphrase)
+        if isinstance(cert, (str, bytes)):
+            cert = load_certificate_chain(cert)
         tree = etree.fromstring(signed_object)
         signature_tree = SIGNER.sign(tree,
                                      key=key,
                                      cert=cert,
-                                     passphrase=utils.ensure_bytes(passphrase),
                                      reference_uri="#oadrSignedObject",
                                      signature_properties=_create_replay_protect())
         signature = etree.tostring(signature_tree).decode('utf-8')
     else:
         signature = None
-    msg = envelope.render(template=f'{message_type}',
-                          signature=signature,
-                          signed_object=signed_object)
-    logger.debug(f"Created message: {msg}")
+    msg = _create_envelope(signed_object, signature)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Created message: {msg}")
     return msg
 
 
+def render_event(event):
+    """
+    Render the oadrEvent element for a single event to a string, exactly as it would
+    appear inside an oadrDistributeEvent message. The rendered elements of the events can
+    be passed to the oadrDistributeEvent template as _rendered_events, next to the events
+    themselves, so that an event that is sent to many VENs is only checked and rendered once.
+    """
+    message_payload = preflight_message('oadrDistributeEvent', {'events': [event]})
+    template = TEMPLATES.get_template('parts/eiEvent.xml')
+    return template.render(event=message_payload['events'][0])
+
+
+@lru_cache(maxsize=16)
+def load_signing_key(key, passphrase=None):
+    """
+    Load a PEM-encoded private key, so that it does not have to be decrypted
+    and parsed again for every message that is signed with it.
+
+    :param bytes key: The PEM-encoded private key
+    :param str passphrase: The passphrase for the private key, if it is encrypted
+    """
+    return load_pem_private_key(utils.ensure_bytes(key), password=utils.ensure_bytes(passphrase))
+
+
+@lru_cache(maxsize=16)
+def load_certificate_chain(cert):
+    """
+    Split a PEM-encoded certificate (chain) into a tuple of certificates,
+    which is the form in which the signer includes them in the signature.
+
+    :param bytes cert: The PEM-encoded certificate or certificate chain
+    """
+    return tuple(utils.ensure_str(pem) for pem in iterate_pem(utils.ensure_bytes(cert)))
+
+
+async def create_message_async(message_type, signing_pool=None, **kwargs):
+    """
+    Create and optionally sign an OpenADR message without blocking the event loop.
+    The message is created in the signing pool, if one is given. Takes the same
+    arguments as create_message. Returns an XML string.
+    """
+    if signing_pool is None:
+        return create_message(message_type, **kwargs)
+    return await signing_pool.create_message(message_type, **kwargs)
+
+
+class WorkerPool:
+    """
+    A pool of worker threads or processes that runs CPU-heavy work off the event loop,
+    with a bound on the number of jobs that are handed to the workers at the same time.
+    """
+
+    def __init__(self, max_workers=None, use_processes=False, max_concurrency=None):
+        """
+        :param int max_workers: The number of worker threads or processes. Defaults to the
+                                number of CPUs.
+        :param bool use_processes: Whether to use a process pool instead of a thread pool.
+        :param int max_concurrency: The maximum number of jobs that are handed to the
+                                    workers at the same time. Other jobs wait in line.
+                                    Defaults to max_workers.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers
+        self.use_processes = use_processes
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                               thread_name_prefix='openleadr-worker')
+        self._semaphore = None
+        self._queued = 0
+        self._in_flight = 0
+
+    @property
+    def queue_depth(self):
+        """
+        The number of jobs that are waiting for a free worker.
+        """
+        return self._queued
+
+    @property
+    def in_flight(self):
+        """
+        The number of jobs that are being run by the workers.
+        """
+        return self._in_flight
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the pool and return its result.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def shutdown(self, wait=True):
+        """
+        Shut down the workers in the pool.
+        """
+        self.executor.shutdown(wait=wait)
+
+
+class SigningPool(WorkerPool):
+    """
+    A pool of worker threads or processes in which outgoing messages are created and signed,
+    so that the RSA signing and XML canonicalization do not block the event loop.
+    """
+
+    async def create_message(self, message_type, **kwargs):
+        """
+        Create and optionally sign an OpenADR message in the pool. Takes the same
+        arguments as create_message. Returns an XML string.
+        """
+        return await self.run(create_message, message_type, **kwargs)
+
+
+class VerificationPool(WorkerPool):
+    """
+    A pool of worker threads in which the signatures of incoming messages are verified,
+    so that the verification does not block the event loop. Because the parsed XML tree
+    cannot be sent to another process, this pool always uses threads.
+    """
+
+    def __init__(self, max_workers=None, max_concurrency=None):
+        """
+        :param int max_workers: The number of worker threads. Defaults to the number of CPUs.
+        :param int max_concurrency: The maximum number of messages that are verified at the
+                                    same time. Other messages wait in line. Defaults to
+                                    max_workers.
+        """
+        super().__init__(max_workers=max_workers, max_concurrency=max_concurrency)
+
+    async def validate_xml_signature(self, xml_tree, cert_fingerprint=None):
+        """
+        Validate the XMLDSIG signature and the ReplayProtect element in the pool.
+        Takes the same arguments as validate_xml_signature.
+        """
+        await self.run(validate_xml_signature, xml_tree, cert_fingerprint=cert_fingerprint)
+
+
+def _create_envelope(signed_object, signature=None):
+    """
+    Wrap the signed object and its signature in an oadrPayload.
+    """
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<oadr:oadrPayload xmlns:oadr="http://openadr.org/oadr-2.0b/2012/07">\n'
+            f'{signature or ""}{signed_object}\n'
+            '</oadr:oadrPayload>')
+
+
 def validate_xml_schema(content):
     """
     Validates the XML tree against the schema. Return the XML tree.
     """
     if isinstance(content, str):
         content = content.encode('utf-8')
-    tree = etree.fromstring(content, XML_PARSER)
+    return etree.fromstring(content, XML_PARSER)
+
+
+def parse_xml(content):
+    """
+    Parse the XML content without validating it against the schema. Return the XML tree.
+    Use validate_xml_tree to validate it once the sender has been authenticated.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return etree.fromstring(content, PLAIN_XML_PARSER)
+
+
+def validate_xml_tree(tree, validation_policy=None, ven_id=None):
+    """
+    Validate an XML tree from parse_xml against the schema. Return the XML tree.
+
+    If a ValidationPolicy is given, the tree is only validated if the policy says so for
+    this message type and ven_id. Only give a policy for messages of which the sender was
+    authenticated, for instance by its TLS client certificate or by the message signature,
+    and only give the ven_id that was authenticated.
+    """
+    message_type = _peek_message_type(tree)
+    if validation_policy is not None and not validation_policy.should_validate(message_type, ven_id):
+        return tree
+    try:
+        XML_SCHEMA.assertValid(tree)
+    except etree.DocumentInvalid as err:
+        if validation_policy is not None:
+            validation_policy.record_failure(message_type, ven_id)
+        # Raise the same error as the validating parser would
+        error = err.error_log.last_error
+        raise etree.XMLSyntaxError(error.message, error.type, error.line, error.column) from err
     return tree
 
 
+def _peek_message_type(tree):
+    """
+    Get the message type from an XML tree that was not validated yet.
+    """
+    signed_object = tree.find('{http://openadr.org/oadr-2.0b/2012/07}oadrSignedObject')
+    if signed_object is None or len(signed_object) == 0:
+        return None
+    return etree.QName(signed_object[0]).localname
+
+
 def validate_xml_signature(xml_tree, cert_fingerprint=None):
     """
     Validate the XMLDSIG signature and the ReplayProtect element.
     """
     cert = utils.extract_pem_cert(xml_tree)
-    if cert_fingerprint:
-        fingerprint = utils.certificate_fingerprint(cert)
-        if fingerprint != cert_fingerprint:
-            raise errors.FingerprintMismatch("The certificate fingerprint was incorrect. "
-                                             f"Expected: {cert_fingerprint}; "
-                                             f"Received: {fingerprint}. Ignoring message.")
-    VERIFIER.verify(xml_tree, x509_cert=utils.ensure_bytes(cert), expect_references=2)
+    fingerprint = utils.certificate_fingerprint(cert)
+    if cert_fingerprint and fingerprint != cert_fingerprint:
+        raise errors.FingerprintMismatch("The certificate fingerprint was incorrect. "
+                                         f"Expected: {cert_fingerprint}; "
+                                         f"Received: {fingerprint}. Ignoring message.")
+    _verify_signature(xml_tree, cert, fingerprint)
+
+
+def _verify_signature(xml_tree, cert, fingerprint):
+    """
+    Verify the signature using the (cached) parsed certificate, and check the ReplayProtect.
+    """
+    _get_verifier().verify(xml_tree, x509_cert=load_certificate(cert, fingerprint), expect_references=2)
     _verify_replay_protect(xml_tree)
 
 
+def _get_verifier():
+    """
+    The XMLVerifier keeps state on the instance during verification,
+    so each worker thread uses its own.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return VERIFIER
+    if not hasattr(_THREAD_LOCAL, 'verifier'):
+        _THREAD_LOCAL.verifier = XMLVerifier()
+    return _THREAD_LOCAL.verifier
+
+
+def load_certificate(cert, fingerprint=None):
+    """
+    Return the parsed X509 certificate for a PEM-encoded certificate. Parsed
+    certificates are cached by their fingerprint, so that the certificate
+    of a VEN is not parsed again for every message it sends.
+
+    :param str cert: The PEM-encoded certificate
+    :param str fingerprint: The fingerprint of the certificate, if it is already known
+    """
+    if fingerprint is None:
+        fingerprint = utils.certificate_fingerprint(cert)
+    with _CERTIFICATE_CACHE_LOCK:
+        x509_cert = _CERTIFICATE_CACHE.get(fingerprint)
+        if x509_cert is not None:
+            _CERTIFICATE_CACHE.move_to_end(fingerprint)
+            return x509_cert
+    x509_cert = crypto.load_certificate(crypto.FILETYPE_PEM, utils.ensure_bytes(cert))
+    with _CERTIFICATE_CACHE_LOCK:
+        _CERTIFICATE_CACHE[fingerprint] = x509_cert
+        while len(_CERTIFICATE_CACHE) > CERTIFICATE_CACHE_SIZE:
+            _CERTIFICATE_CACHE.popitem(last=False)
+    return x509_cert
+
+
 def validate_xml_signature_none(xml_tree):
     assert xml_tree.find('.//{http://www.w3.org/2000/09/xmldsig#}X509Certificate') is None
 
 
 async def authenticate_message(request, message_tree, message_payload,
                                fingerprint_lookup=None, ven_lookup=None,
-                               verify_message_signature=True):
+                               verify_message_signature=True, verification_pool=None):
     if request.secure and 'ven_id' in message_payload:
         connection_fingerprint = utils.get_cert_fingerprint_from_request(request)
         if connection_fingerprint is None:
@@ -165,13 +486,64 @@ async def authenticate_message(request, message_tree, message_payload,
                 raise errors.NotRegisteredOrAuthorizedError(msg)
 
             try:
-                validate_xml_signature(message_tree)
+                if verification_pool is None:
+                    _verify_signature(message_tree, message_cert, message_fingerprint)
+                else:
+                    await verification_pool.run(_verify_signature, message_tree,
+                                                message_cert, message_fingerprint)
             except ValueError:
                 msg = ("The message signature did not match the message contents. Please make sure "
                        "you are using the correct XMLDSig algorithm and C14n canonicalization.")
                 raise errors.NotRegisteredOrAuthorizedError(msg)
 
 
+def _build_name(tag):
+    """
+    Convert an lxml tag name to the name that xmltodict would give it.
+    """
+    if tag[0] != '{':
+        return tag
+    namespace, name = tag[1:].split('}', 1)
+    short_namespace = NAMESPACES.get(namespace, namespace)
+    if not short_namespace:
+        return name
+    return f"{short_namespace}:{name}"
+
+
+def _tree_to_dict(element, skip_tag=None):
+    """
+    Convert an lxml element to the same structure that
+    xmltodict.parse(process_namespaces=True) would produce.
+    Child elements with the skip_tag are left out.
+    """
+    item = None
+    if element.attrib:
+        item = {f"@{_build_name(key)}": value for key, value in element.attrib.items()}
+    data = [element.text] if element.text else []
+    for child in element:
+        # Comments and processing instructions are skipped, but their tails are not.
+        if isinstance(child.tag, str) and child.tag != skip_tag:
+            name = _build_name(child.tag)
+            value = _tree_to_dict(child, skip_tag)
+            if item is None:
+                item = {}
+            if name in item:
+                if isinstance(item[name], list):
+                    item[name].append(value)
+                else:
+                    item[name] = [item[name], value]
+            else:
+                item[name] = value
+        if child.tail:
+            data.append(child.tail)
+    text = "".join(data).strip() or None
+    if item is None:
+        return text
+    if text:
+        item['#text'] = text
+    return item
+
+
 def _create_replay_protect():
     dt_element = Element("{http://openadr.org/oadr-2.0b/2012/07/xmldsig-properties}timestamp")
     dt_element.text = utils.datetimeformat(datetime.now(timezone.utc))
@@ -199,24 +571,49 @@ def _verify_replay_protect(xml_tree):
             raise ValueError("Missing 'nonce' element in ReplayProtect in incoming message.")
         if timestamp < datetime.now(timezone.utc) - REPLAY_PROTECT_MAX_TIME_DELTA:
             raise ValueError("The message was signed too long ago.")
-        elif (timestamp, nonce) in NONCE_CACHE:
-            raise ValueError("This combination of timestamp and nonce was already used.")
-    _update_nonce_cache(timestamp, nonce)
+    if not NONCE_CACHE.add(timestamp, nonce, timestamp + REPLAY_PROTECT_MAX_TIME_DELTA):
+        raise ValueError("This combination of timestamp and nonce was already used.")
+
+
+# Element paths for streaming the values from an oadrUpdateReport
+_UPDATE_REPORT_PATH = ('{http://openadr.org/oadr-2.0b/2012/07}oadrSignedObject/'
+                       '{http://openadr.org/oadr-2.0b/2012/07}oadrUpdateReport')
+_REPORT_TAG = '{http://openadr.org/oadr-2.0b/2012/07}oadrReport'
+_REPORT_REQUEST_ID_TAG = '{http://docs.oasis-open.org/ns/energyinterop/201110}reportRequestID'
+_INTERVALS_TAG = '{urn:ietf:params:xml:ns:icalendar-2.0:stream}intervals'
+_INTERVAL_PATH = (f'{_INTERVALS_TAG}/'
+                  '{http://docs.oasis-open.org/ns/energyinterop/201110}interval')
+_INTERVAL_DTSTART_PATH = ('{urn:ietf:params:xml:ns:icalendar-2.0}dtstart/'
+                          '{urn:ietf:params:xml:ns:icalendar-2.0}date-time')
+_REPORT_PAYLOAD_RID_PATH = ('{http://openadr.org/oadr-2.0b/2012/07}oadrReportPayload/'
+                            '{http://docs.oasis-open.org/ns/energyinterop/201110}rID')
+_REPORT_PAYLOAD_VALUE_PATH = ('{http://openadr.org/oadr-2.0b/2012/07}oadrReportPayload/'
+                              '{http://docs.oasis-open.org/ns/energyinterop/201110}payloadFloat/'
+                              '{http://docs.oasis-open.org/ns/energyinterop/201110}value')
+
+# Parsed certificates, by fingerprint
+CERTIFICATE_CACHE_SIZE = 10000
+_CERTIFICATE_CACHE = OrderedDict()
+_CERTIFICATE_CACHE_LOCK = threading.Lock()
+_THREAD_LOCAL = threading.local()
 
+# Replay protect settings
+REPLAY_PROTECT_MAX_TIME_DELTA = timedelta(seconds=5)
+NONCE_CACHE = MemoryNonceStore()
 
-def _update_nonce_cache(timestamp, nonce):
-    NONCE_CACHE.add((timestamp, nonce))
-    for timestamp, nonce in list(NONCE_CACHE):
-        if timestamp < datetime.now(timezone.utc) - REPLAY_PROTECT_MAX_TIME_DELTA:
-            NONCE_CACHE.remove((timestamp, nonce))
 
+class FlatPackageLoader(PackageLoader):
+    """
+    Loads the templates with their indentation and line breaks removed,
+    so that the rendered messages are flat without further processing.
+    """
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        return utils.flatten_xml(source), filename, uptodate
 
-# Replay protect settings
-REPLAY_PROTECT_MAX_TIME_DELTA = timedelta(seconds=5)
-NONCE_CACHE = set()
 
 # Settings for jinja2
-TEMPLATES = Environment(loader=PackageLoader('openleadr', 'templates'))
+TEMPLATES = Environment(loader=FlatPackageLoader('openleadr', 'templates'))
 TEMPLATES.filters['datetimeformat'] = utils.datetimeformat
 TEMPLATES.filters['timedeltaformat'] = utils.timedeltaformat
 TEMPLATES.filters['booleanformat'] = utils.booleanformat
@@ -68,8 +68,14 @@ def _preflight_oadrRegisterReport(message_payload):
 def _preflight_oadrDistributeEvent(message_payload):
     if 'parse_duration' not in globals():
         from .utils import parse_duration
+    # Events that were already rendered (see messaging.render_event) have been checked before
+    if message_payload.get('_rendered_events') is not None:
+        events = []
+    else:
+        events = message_payload['events']
+
     # Check that the total event_duration matches the sum of the interval durations (rule 8)
-    for event in message_payload['events']:
+    for event in events:
         active_period_duration = event['active_period']['duration']
         signal_durations = []
         for signal in event['event_signals']:
@@ -89,7 +95,7 @@ def _preflight_oadrDistributeEvent(message_payload):
                 event['active_period']['duration'] = signal_durations[0]
 
     # Check that payload values with signal name SIMPLE are constricted (rule 9)
-    for event in message_payload['events']:
+    for event in events:
         for event_signal in event['event_signals']:
             if event_signal['signal_name'] == "SIMPLE":
                 for interval in event_signal['intervals']:
@@ -98,7 +104,7 @@ def _preflight_oadrDistributeEvent(message_payload):
                                          "must be one of 0, 1, 2 or 3")
 
     # Check that the current_value is 0 for SIMPLE events that are not yet active (rule 14)
-    for event in message_payload['events']:
+    for event in events:
         for event_signal in event['event_signals']:
             if 'current_value' in event_signal and event_signal['current_value'] != 0:
                 if event_signal['signal_name'] == "SIMPLE" \
@@ -109,7 +115,7 @@ def _preflight_oadrDistributeEvent(message_payload):
                     event_signal['current_value'] = 0
 
     # Add the correct namespace to the measurement
-    for event in message_payload['events']:
+    for event in events:
         for event_signal in event['event_signals']:
             if 'measurement' in event_signal and event_signal['measurement'] is not None:
                 if event_signal['measurement']['name'] in enums._MEASUREMENT_NAMESPACES:
@@ -120,7 +126,7 @@ def _preflight_oadrDistributeEvent(message_payload):
                     raise ValueError("The Measurement Name is unknown")
 
     # Check that there is a valid oadrResponseRequired value for each Event
-    for event in message_payload['events']:
+    for event in events:
         if 'response_required' not in event:
             event['response_required'] = 'always'
         elif event['response_required'] not in ('never', 'always'):
@@ -130,7 +136,7 @@ def _preflight_oadrDistributeEvent(message_payload):
             event['response_required'] = 'always'
 
     # Check that there is a valid oadrResponseRequired value for each Event
-    for event in message_payload['events']:
+    for event in events:
         if 'created_date_time' not in event['event_descriptor'] \
                 or not event['event_descriptor']['created_date_time']:
             logger.warning("Your event descriptor did not contain a created_date_time. "
@@ -138,7 +144,7 @@ def _preflight_oadrDistributeEvent(message_payload):
             event['event_descriptor']['created_date_time'] = datetime.now(timezone.utc)
 
     # Check that the target designations are correct and consistent
-    for event in message_payload['events']:
+    for event in events:
         if 'targets' in event and 'targets_by_type' in event:
             if utils.group_targets_by_type(event['targets']) != event['targets_by_type']:
                 raise ValueError("You assigned both 'targets' and 'targets_by_type' in your event, "
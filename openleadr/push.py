@@ -0,0 +1,234 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Delivery of messages to VENs that registered for the HTTP PUSH model.
+
+Instead of waiting for the VEN to poll, the VTN posts the message to the transport
+address that the VEN gave in its oadrCreatePartyRegistration. The PushDispatcher uses
+one pooled aiohttp session for all VENs, limits the number of messages that are sent
+at the same time, retries failed deliveries, and delivers the messages for each VEN in
+the order in which they were pushed.
+"""
+
+from collections import deque
+from http import HTTPStatus
+from urllib.parse import urlparse
+import asyncio
+import logging
+
+import aiohttp
+
+from openleadr import utils
+from openleadr.state import StateDict
+
+logger = logging.getLogger('openleadr')
+
+# The service endpoint of the VEN for each type of message that the VTN can push
+PUSH_SERVICES = {'oadrDistributeEvent': 'EiEvent',
+                 'oadrCreateReport': 'EiReport',
+                 'oadrCancelReport': 'EiReport',
+                 'oadrRegisterReport': 'EiReport',
+                 'oadrRequestReregistration': 'EiRegisterParty',
+                 'oadrCancelPartyRegistration': 'EiRegisterParty'}
+
+
+class PushDispatcher:
+    """
+    Sends messages to push-mode VENs.
+
+    :param int max_concurrency: The maximum number of messages that are sent at the same time.
+    :param int max_connections: The maximum number of open connections in the connection pool.
+    :param int retries: The number of times a failed delivery is retried.
+    :param float retry_delay: The delay before the first retry in seconds. The delay
+                              doubles for every next retry.
+    :param float timeout: The timeout for a single delivery in seconds.
+    :param ssl.SSLContext ssl_context: The SSL context for the connections to the VENs.
+                                       The OpenADRServer uses its own HTTP certificate and
+                                       CA file by default.
+    :param callable allow_address: A function that receives the ven_id and the transport
+                                   address that the VEN registered, and returns whether
+                                   messages may be pushed to that address. The VEN chooses
+                                   its transport address, so without this function, the VTN
+                                   sends its (signed) messages to any host that a registering
+                                   VEN names.
+    """
+
+    def __init__(self, max_concurrency=100, max_connections=100, retries=3, retry_delay=1,
+                 timeout=10, ssl_context=None, allow_address=None):
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.allow_address = allow_address
+        self.vtn_id = None
+        self.create_message = None      # Coroutine function that creates (and signs) a message
+        self.delivered = 0
+        self.failed = 0
+        self._addresses = {}            # {ven_id: transport_address}
+        self._queues = {}               # {ven_id: deque of (message, on_failure, on_success)}
+        self._workers = {}              # {ven_id: asyncio.Task}
+        self._session = None
+        self._semaphore = None
+
+    def register(self, ven_id, transport_address):
+        """
+        Deliver the messages for this VEN to the given transport address from now on.
+        Raises a ValueError if the transport address is not an http or https URL, or
+        if allow_address does not allow it.
+        """
+        address = urlparse(transport_address)
+        if address.scheme not in ('http', 'https') or not address.hostname:
+            raise ValueError(f"The transport address {transport_address!r} is not an http or https URL.")
+        if self.allow_address is not None and not self.allow_address(ven_id, transport_address):
+            raise ValueError(f"The transport address {transport_address!r} is not allowed for VEN {ven_id}.")
+        self._addresses[ven_id] = transport_address.rstrip('/')
+
+    def unregister(self, ven_id):
+        """
+        Stop pushing messages to this VEN.
+        """
+        self._addresses.pop(ven_id, None)
+
+    def use_state_backend(self, state_backend):
+        """
+        Keep the transport addresses of the VENs in a StateBackend, so that they
+        survive a restart of the VTN.
+        """
+        self._addresses = StateDict(state_backend, 'push_addresses')
+
+    def is_push_ven(self, ven_id):
+        return ven_id in self._addresses
+
+    @property
+    def queue_depth(self):
+        """
+        The number of messages that are waiting to be sent.
+        """
+        return sum(len(queue) for queue in self._queues.values())
+
+    def push(self, ven_id, message, on_failure=None, on_success=None):
+        """
+        Queue a message for delivery to a VEN. Messages that are queued while the event
+        loop is not running are sent once start is called.
+
+        :param str ven_id: The VEN to deliver the message to.
+        :param message: A (message_type, message_payload) tuple, or a coroutine function
+                        that returns such a tuple (or None, to send nothing) right before
+                        the message is sent.
+        :param callable on_failure: Called with the ven_id and message_type if the
+                                    message could not be delivered.
+        :param callable on_success: Called with the ven_id and message_type once the
+                                    message was delivered.
+        """
+        self._queues.setdefault(ven_id, deque()).append((message, on_failure, on_success))
+        if ven_id not in self._workers:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._workers[ven_id] = asyncio.ensure_future(self._deliver_queue(ven_id))
+
+    def start(self):
+        """
+        Start delivering the messages that were queued before the event loop was running.
+        Must be called from a running event loop.
+        """
+        for ven_id in self._queues:
+            if ven_id not in self._workers:
+                self._workers[ven_id] = asyncio.ensure_future(self._deliver_queue(ven_id))
+
+    async def close(self):
+        """
+        Stop delivering messages and close the connection pool.
+        """
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        self._workers.clear()
+        self._queues.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _deliver_queue(self, ven_id):
+        queue = self._queues[ven_id]
+        try:
+            while queue:
+                message, on_failure, on_success = queue.popleft()
+                try:
+                    await self._deliver(ven_id, message, on_failure, on_success)
+                except Exception as err:
+                    logger.error(f"Could not push a message to VEN {ven_id}: "
+                                 f"{err.__class__.__name__}: {err}")
+        finally:
+            self._workers.pop(ven_id, None)
+            if not queue:
+                self._queues.pop(ven_id, None)
+
+    async def _deliver(self, ven_id, message, on_failure, on_success):
+        if callable(message):
+            message = await message()
+            if message is None:
+                return
+        message_type, message_payload = message
+        message_payload.setdefault('vtn_id', self.vtn_id)
+        message_payload.setdefault('request_id', utils.generate_id())
+        msg = await self.create_message(message_type, **message_payload)
+
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            if ven_id not in self._addresses:
+                break
+            url = f"{self._addresses[ven_id]}/{PUSH_SERVICES[message_type]}"
+            try:
+                async with self._get_semaphore():
+                    async with self._get_session().post(url, data=msg) as response:
+                        content = await response.read()
+                if response.status == HTTPStatus.OK:
+                    self.delivered += 1
+                    if on_success is not None:
+                        on_success(ven_id, message_type)
+                    return
+                logger.warning(f"Non-OK status {response.status} when pushing {message_type} "
+                               f"to VEN {ven_id} at {url}: {content.decode('utf-8')}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                logger.warning(f"Could not push {message_type} to VEN {ven_id} at {url}: "
+                               f"{err.__class__.__name__}: {err}")
+
+        self.failed += 1
+        logger.error(f"Giving up on pushing {message_type} to VEN {ven_id}.")
+        if on_failure is not None:
+            on_failure(ven_id, message_type)
+
+    def _get_session(self):
+        if self._session is None:
+            if self.ssl_context is not None:
+                connector = aiohttp.TCPConnector(limit=self.max_connections, ssl=self.ssl_context)
+            else:
+                connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  headers={'content-type': 'application/xml'},
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    def _get_semaphore(self):
+        # The semaphore is created lazily, so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
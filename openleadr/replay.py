@@ -0,0 +1,135 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stores for the (timestamp, nonce) combinations from the ReplayProtect element of signed
+messages. A combination that was seen before within the replay protection window is
+refused, so that a signed message can not be re-played by an attacker.
+
+The MemoryNonceStore is used by default. To share the replay protection between multiple
+VTN processes on the same machine, use an SQLiteNonceStore with the same database file in
+each process. You can implement your own store by subclassing NonceStore.
+"""
+
+from datetime import datetime, timezone
+import heapq
+import sqlite3
+import threading
+
+
+class NonceStore:
+    """
+    Base class for nonce stores.
+    """
+
+    def add(self, timestamp, nonce, expires):
+        """
+        Add the timestamp and nonce combination to the store, unless it is already there.
+        Checking and adding must happen atomically.
+
+        :param datetime timestamp: The timestamp from the ReplayProtect element.
+        :param str nonce: The nonce from the ReplayProtect element.
+        :param datetime expires: The moment after which the combination may be forgotten.
+
+        Returns True if the combination was added, or False if it was already in the store.
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryNonceStore(NonceStore):
+    """
+    Keeps the nonces in a set for constant-time lookups, and their expiry times
+    in a heap, so that expired nonces can be removed without scanning the set.
+    """
+
+    def __init__(self):
+        self._nonces = set()
+        self._expiry = []
+        self._lock = threading.Lock()
+
+    def add(self, timestamp, nonce, expires):
+        key = (timestamp, nonce)
+        with self._lock:
+            self._expire(datetime.now(timezone.utc))
+            if key in self._nonces:
+                return False
+            self._nonces.add(key)
+            heapq.heappush(self._expiry, (expires, key))
+            return True
+
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] < now:
+            expires, key = heapq.heappop(self._expiry)
+            self._nonces.discard(key)
+
+    def __len__(self):
+        return len(self._nonces)
+
+
+class SQLiteNonceStore(NonceStore):
+    """
+    Keeps the nonces in an SQLite database, so that multiple processes can share them.
+    The primary key on the table makes the check-and-add atomic between processes.
+    """
+
+    # Remove expired nonces at most this often (in seconds)
+    expire_interval = 1
+
+    def __init__(self, path, timeout=5):
+        """
+        :param str path: The path to the database file. Use the same file in all processes.
+        :param float timeout: How long to wait for a lock on the database (in seconds).
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS nonces ("
+                                 "timestamp REAL NOT NULL, "
+                                 "nonce TEXT NOT NULL, "
+                                 "expires REAL NOT NULL, "
+                                 "PRIMARY KEY (timestamp, nonce)) WITHOUT ROWID")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS nonces_expires ON nonces (expires)")
+        self._lock = threading.Lock()
+        self._last_expired = 0
+
+    def add(self, timestamp, nonce, expires):
+        now = datetime.now(timezone.utc).timestamp()
+        with self._lock:
+            if now - self._last_expired >= self.expire_interval:
+                self._connection.execute("DELETE FROM nonces WHERE expires < ?", (now,))
+                self._last_expired = now
+            cursor = self._connection.execute("INSERT OR IGNORE INTO nonces (timestamp, nonce, expires) "
+                                              "VALUES (?, ?, ?)",
+                                              (timestamp.timestamp(), nonce, expires.timestamp()))
+            return cursor.rowcount == 1
+
+    def __len__(self):
+        now = datetime.now(timezone.utc).timestamp()
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM nonces WHERE expires >= ?",
+                                            (now,)).fetchone()[0]
+
+    def close(self):
+        """
+        Close the connection to the database.
+        """
+        with self._lock:
+            self._connection.close()
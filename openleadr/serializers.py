@@ -0,0 +1,274 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Direct serializers for the messages that are sent most often. Each serializer
+produces the same (flattened) oadrSignedObject as the corresponding Jinja template
+would, but without the template rendering and flattening overhead.
+
+A serializer receives the preflighted message payload and returns the signed
+object as a string. If it cannot handle a payload, the template is used instead.
+To always use the template for a message type, switch its serializer off using
+disable_serializers.
+"""
+
+from openleadr.utils import datetimeformat, timedeltaformat
+
+# Stand-in for a value that a template would consider undefined
+_UNDEFINED = object()
+
+_SIGNED_OBJECT_START = ('<oadr:oadrSignedObject xmlns:oadr="http://openadr.org/oadr-2.0b/2012/07" '
+                        'oadr:Id="oadrSignedObject">')
+_SIGNED_OBJECT_END = '</oadr:oadrSignedObject>'
+_EI = 'xmlns:ei="http://docs.oasis-open.org/ns/energyinterop/201110"'
+_PYLD = 'xmlns="http://docs.oasis-open.org/ns/energyinterop/201110/payloads"'
+
+
+class _UseTemplate(Exception):
+    """
+    Raised when a payload should be rendered by the template instead.
+    """
+
+
+def serialize_message(message_type, payload):
+    """
+    Serialize the payload to an oadrSignedObject string. Returns None if there is
+    no serializer for this message type, or if the template should be used instead.
+    """
+    if message_type not in _ENABLED:
+        return None
+    serializer = SERIALIZERS[message_type]
+    try:
+        return serializer(payload)
+    except _UseTemplate:
+        return None
+
+
+def _member(obj, name):
+    """
+    Get a member from a dict or object, like a template would.
+    """
+    if obj is _UNDEFINED:
+        # The template would raise an UndefinedError here
+        raise _UseTemplate()
+    if isinstance(obj, dict):
+        return obj.get(name, _UNDEFINED)
+    return getattr(obj, name, _UNDEFINED)
+
+
+def _text(value):
+    """
+    Format a value like a template would.
+    """
+    if value is _UNDEFINED:
+        return ''
+    return str(value)
+
+
+def _present(value):
+    """
+    The equivalent of 'value is defined and value is not none'.
+    """
+    return value is not _UNDEFINED and value is not None
+
+
+def _truthy(value):
+    return value is not _UNDEFINED and bool(value)
+
+
+def _serialize_oadrPoll(payload):
+    return (f'{_SIGNED_OBJECT_START}'
+            f'<oadr:oadrPoll ei:schemaVersion="2.0b" {_EI}>'
+            f'<ei:venID>{_text(payload.get("ven_id", _UNDEFINED))}</ei:venID>'
+            f'</oadr:oadrPoll>'
+            f'{_SIGNED_OBJECT_END}')
+
+
+def _serialize_oadrResponse(payload):
+    response = payload.get('response', _UNDEFINED)
+    request_id = _member(response, 'request_id')
+    if _present(request_id):
+        request_id = f'<requestID {_PYLD}>{request_id}</requestID>'
+    else:
+        request_id = f'<requestID {_PYLD} />'
+    return (f'{_SIGNED_OBJECT_START}'
+            f'<oadr:oadrResponse ei:schemaVersion="2.0b" {_EI}>'
+            f'<ei:eiResponse>'
+            f'<ei:responseCode>{_text(_member(response, "response_code"))}</ei:responseCode>'
+            f'<ei:responseDescription>{_text(_member(response, "response_description"))}'
+            f'</ei:responseDescription>'
+            f'{request_id}'
+            f'</ei:eiResponse>'
+            f'<ei:venID>{_text(payload.get("ven_id", _UNDEFINED))}</ei:venID>'
+            f'</oadr:oadrResponse>'
+            f'{_SIGNED_OBJECT_END}')
+
+
+def _serialize_oadrCreatedEvent(payload):
+    response = payload.get('response', _UNDEFINED)
+    event_responses = payload.get('event_responses', _UNDEFINED)
+    request_id = _member(response, 'request_id')
+    parts = [_SIGNED_OBJECT_START,
+             f'<oadr:oadrCreatedEvent ei:schemaVersion="2.0b" {_EI}>',
+             f'<eiCreatedEvent {_PYLD}>',
+             '<ei:eiResponse>',
+             f'<ei:responseCode>{_text(_member(response, "response_code"))}</ei:responseCode>',
+             f'<ei:responseDescription>{_text(_member(response, "response_description"))}'
+             '</ei:responseDescription>']
+    if not _present(event_responses) and _present(request_id):
+        parts.append(f'<requestID {_PYLD}>{request_id}</requestID>')
+    else:
+        parts.append(f'<requestID {_PYLD}></requestID>')
+    parts.append('</ei:eiResponse>')
+    if _present(event_responses):
+        parts.append('<ei:eventResponses>')
+        for event_response in event_responses:
+            parts.append('<ei:eventResponse>')
+            parts.append(f'<ei:responseCode>{_text(_member(event_response, "response_code"))}</ei:responseCode>')
+            response_description = _member(event_response, 'response_description')
+            if _present(response_description):
+                parts.append(f'<ei:responseDescription>{response_description}</ei:responseDescription>')
+            parts.append(f'<requestID {_PYLD}>{_text(_member(event_response, "request_id"))}</requestID>'
+                         '<ei:qualifiedEventID>'
+                         f'<ei:eventID>{_text(_member(event_response, "event_id"))}</ei:eventID>'
+                         '<ei:modificationNumber>'
+                         f'{_text(_member(event_response, "modification_number"))}'
+                         '</ei:modificationNumber>'
+                         '</ei:qualifiedEventID>'
+                         f'<ei:optType>{_text(_member(event_response, "opt_type"))}</ei:optType>'
+                         '</ei:eventResponse>')
+        parts.append('</ei:eventResponses>')
+    parts.append(f'<ei:venID>{_text(payload.get("ven_id", _UNDEFINED))}</ei:venID>'
+                 '</eiCreatedEvent>'
+                 '</oadr:oadrCreatedEvent>'
+                 f'{_SIGNED_OBJECT_END}')
+    return "".join(parts)
+
+
+def _serialize_oadrRequestEvent(payload):
+    reply_limit = payload.get('reply_limit', _UNDEFINED)
+    if _present(reply_limit):
+        reply_limit = f'<replyLimit>{reply_limit}</replyLimit>'
+    else:
+        reply_limit = ''
+    return (f'{_SIGNED_OBJECT_START}'
+            f'<oadr:oadrRequestEvent ei:schemaVersion="2.0b" {_EI}>'
+            f'<eiRequestEvent {_PYLD}>'
+            f'<requestID>{_text(payload.get("request_id", _UNDEFINED))}</requestID>'
+            f'<ei:venID>{_text(payload.get("ven_id", _UNDEFINED))}</ei:venID>'
+            f'{reply_limit}'
+            f'</eiRequestEvent>'
+            f'</oadr:oadrRequestEvent>'
+            f'{_SIGNED_OBJECT_END}')
+
+
+def _serialize_oadrUpdateReport(payload):
+    reports = payload.get('reports', _UNDEFINED)
+    # Report descriptions are rare in updates; leave those to the template.
+    if _truthy(reports) and any(_truthy(_member(report, 'report_descriptions')) for report in reports):
+        raise _UseTemplate()
+
+    parts = ['<oadr:oadrSignedObject xmlns:oadr="http://openadr.org/oadr-2.0b/2012/07" '
+             'xmlns:pyld="http://docs.oasis-open.org/ns/energyinterop/201110/payloads" '
+             'xmlns:emix="http://docs.oasis-open.org/ns/emix/2011/06" oadr:Id="oadrSignedObject">',
+             f'<oadr:oadrUpdateReport ei:schemaVersion="2.0b" {_EI}>',
+             f'<pyld:requestID>{_text(payload.get("request_id", _UNDEFINED))}</pyld:requestID>']
+    if _truthy(reports):
+        for report in reports:
+            parts.append('<oadr:oadrReport xmlns:xcal="urn:ietf:params:xml:ns:icalendar-2.0">')
+            dtstart = _member(report, 'dtstart')
+            if _present(dtstart):
+                parts.append(f'<xcal:dtstart><xcal:date-time>{_text(datetimeformat(dtstart))}'
+                             '</xcal:date-time></xcal:dtstart>')
+            intervals = _member(report, 'intervals')
+            if _truthy(intervals):
+                parts.append('<strm:intervals xmlns:strm="urn:ietf:params:xml:ns:icalendar-2.0:stream" '
+                             'xmlns:xcal="urn:ietf:params:xml:ns:icalendar-2.0">')
+                for interval in intervals:
+                    parts.append(_serialize_report_interval(interval))
+                parts.append('</strm:intervals>')
+            parts.append(f'<ei:eiReportID>{_text(_member(report, "report_id"))}</ei:eiReportID>'
+                         f'<ei:reportRequestID>{_text(_member(report, "report_request_id"))}'
+                         '</ei:reportRequestID>'
+                         f'<ei:reportSpecifierID>{_text(_member(report, "report_specifier_id"))}'
+                         '</ei:reportSpecifierID>')
+            report_name = _member(report, 'report_name')
+            if _truthy(report_name):
+                parts.append(f'<ei:reportName>{report_name}</ei:reportName>')
+            parts.append(f'<ei:createdDateTime>{_text(datetimeformat(_member(report, "created_date_time")))}'
+                         '</ei:createdDateTime>'
+                         '</oadr:oadrReport>')
+    ven_id = payload.get('ven_id', _UNDEFINED)
+    if _present(ven_id):
+        parts.append(f'<ei:venID>{ven_id}</ei:venID>')
+    parts.append('</oadr:oadrUpdateReport>')
+    parts.append(_SIGNED_OBJECT_END)
+    return "".join(parts)
+
+
+def _serialize_report_interval(interval):
+    report_payload = _member(interval, 'report_payload')
+    parts = ['<ei:interval><xcal:dtstart><xcal:date-time>',
+             _text(datetimeformat(_member(interval, 'dtstart'))),
+             '</xcal:date-time></xcal:dtstart>']
+    duration = _member(interval, 'duration')
+    if _present(duration):
+        parts.append(f'<xcal:duration><xcal:duration>{_text(timedeltaformat(duration))}'
+                     '</xcal:duration></xcal:duration>')
+    parts.append(f'<oadr:oadrReportPayload><ei:rID>{_text(_member(report_payload, "r_id"))}</ei:rID>')
+    confidence = _member(report_payload, 'confidence')
+    if _present(confidence):
+        parts.append(f'<ei:confidence>{confidence}</ei:confidence>')
+    accuracy = _member(report_payload, 'accuracy')
+    if _present(accuracy):
+        parts.append(f'<ei:accuracy>{accuracy}</ei:accuracy>')
+    parts.append(f'<ei:payloadFloat><ei:value>{_text(_member(report_payload, "value"))}</ei:value></ei:payloadFloat>')
+    data_quality = _member(report_payload, 'data_quality')
+    if _present(data_quality):
+        parts.append(f'<oadr:oadrDataQuality>{data_quality}</oadr:oadrDataQuality>')
+    parts.append('</oadr:oadrReportPayload></ei:interval>')
+    return "".join(parts)
+
+
+SERIALIZERS = {'oadrPoll': _serialize_oadrPoll,
+               'oadrResponse': _serialize_oadrResponse,
+               'oadrCreatedEvent': _serialize_oadrCreatedEvent,
+               'oadrRequestEvent': _serialize_oadrRequestEvent,
+               'oadrUpdateReport': _serialize_oadrUpdateReport}
+
+# The message types for which the serializer is used
+_ENABLED = set(SERIALIZERS)
+
+
+def enable_serializers(*message_types):
+    """
+    Use the direct serializers for the given message types, or for all message types
+    that have one if you don't give any.
+    """
+    for message_type in message_types or SERIALIZERS:
+        if message_type not in SERIALIZERS:
+            raise ValueError(f"There is no serializer for {message_type}. The message types "
+                             f"with a serializer are: {', '.join(SERIALIZERS)}.")
+        _ENABLED.add(message_type)
+
+
+def disable_serializers(*message_types):
+    """
+    Render the given message types, or all message types if you don't give any, using
+    their template instead of the direct serializer.
+    """
+    for message_type in message_types or SERIALIZERS:
+        _ENABLED.discard(message_type)
@@ -17,11 +17,18 @@
 from aiohttp import web
 from openleadr.service import EventService, PollService, RegistrationService, ReportService, \
                               VTNService
-from openleadr.messaging import create_message
-from openleadr import objects, enums, utils
+from openleadr.messaging import create_message, load_certificate_chain, load_signing_key
+from openleadr import objects, enums, utils, messaging
+from openleadr.lookups import LookupCache
+from openleadr.push import PushDispatcher, PUSH_SERVICES
+from openleadr.replay import MemoryNonceStore
+from openleadr.state import MemoryStateBackend
+from openleadr.workers import WorkerMailbox
 from functools import partial
+from dataclasses import asdict, is_dataclass
 from datetime import datetime, timedelta, timezone
 import asyncio
+import gc
 import inspect
 import logging
 import ssl
@@ -32,6 +39,7 @@ logger = logging.getLogger('openleadr')
 class OpenADRServer:
     _MAP = {'on_created_event': 'event_service',
             'on_request_event': 'event_service',
+            'on_event_status_change': 'event_service',
 
             'on_register_report': 'report_service',
             'on_create_report': 'report_service',
@@ -49,7 +57,10 @@ class OpenADRServer:
                  show_fingerprint=True, http_port=8080, http_host='127.0.0.1', http_cert=None,
                  http_key=None, http_key_passphrase=None, http_path_prefix='/OpenADR2/Simple/2.0b',
                  requested_poll_freq=timedelta(seconds=10), http_ca_file=None, ven_lookup=None,
-                 verify_message_signatures=True, show_server_cert_domain=True):
+                 verify_message_signatures=True, show_server_cert_domain=True, signing_pool=None,
+                 verification_pool=None, nonce_store=None, validation_policy=None, push_dispatcher=None,
+                 state_backend=None, lookup_cache=None, report_queue=None,
+                 admission_controller=None):
         """
         Create a new OpenADR VTN (Server).
 
@@ -75,6 +86,40 @@ class OpenADRServer:
         :param ven_lookup: A callback that takes a ven_id and returns a dict containing the
                            ven_id, ven_name, fingerprint and registration_id.
         :param verify_message_signatures: Whether to verify message signatures.
+        :param SigningPool signing_pool: An openleadr.messaging.SigningPool in which outgoing
+                                         messages are created and signed, so that signing does
+                                         not block the event loop.
+        :param VerificationPool verification_pool: An openleadr.messaging.VerificationPool in which
+                                                   the signatures of incoming messages are verified,
+                                                   so that verification does not block the event loop.
+        :param NonceStore nonce_store: An openleadr.replay.NonceStore that keeps the nonces of
+                                       signed messages for replay protection. Use an
+                                       SQLiteNonceStore to share them between VTN processes.
+        :param ValidationPolicy validation_policy: An openleadr.validation.ValidationPolicy that
+                                                   decides which incoming messages are validated
+                                                   against the XML Schema. By default, all
+                                                   messages are validated.
+        :param PushDispatcher push_dispatcher: An openleadr.push.PushDispatcher that delivers
+                                               messages to VENs that registered for the HTTP
+                                               push model. A default one is created if you
+                                               don't provide one.
+        :param StateBackend state_backend: An openleadr.state.StateBackend that keeps the events,
+                                           the registered and requested reports and the push
+                                           registrations, so that they survive a restart. By
+                                           default, they are only kept in memory.
+        :param LookupCache lookup_cache: An openleadr.lookups.LookupCache that keeps the results
+                                         of the ven_lookup and fingerprint_lookup. A default one
+                                         is created if you don't provide one.
+        :param ReportQueue report_queue: An openleadr.ingestion.ReportQueue that delivers the
+                                         values of incoming reports to the report callbacks in
+                                         the background, so that the VTN can respond to the
+                                         VEN right away. By default, the callbacks are called
+                                         before the VTN responds.
+        :param AdmissionController admission_controller: An openleadr.admission.AdmissionController
+                                                         that limits the rate and the number of
+                                                         concurrent requests, and sheds the
+                                                         requests above these limits. By default,
+                                                         all requests are handled.
         """
         # Set up the message queues
 
@@ -84,16 +129,50 @@ class OpenADRServer:
         # Globally enable or disable the verification of message
         # signatures. Only used in combination with TLS.
         VTNService.verify_message_signatures = verify_message_signatures
+        VTNService.verification_pool = verification_pool
+        VTNService.validation_policy = validation_policy
+        self.validation_policy = validation_policy
+        self.verification_pool = verification_pool
+        if lookup_cache is None:
+            lookup_cache = LookupCache()
+        VTNService.lookup_cache = lookup_cache
+        self.lookup_cache = lookup_cache
+        VTNService.admission_controller = admission_controller
+        self.admission_controller = admission_controller
+        if nonce_store is not None:
+            messaging.NONCE_CACHE = nonce_store
 
         # Create the separate OpenADR services
-        self.services['event_service'] = EventService(vtn_id)
-        self.services['report_service'] = ReportService(vtn_id)
-        self.services['poll_service'] = PollService(vtn_id)
+        self.services['event_service'] = EventService(vtn_id, state_backend=state_backend)
+        self.services['report_service'] = ReportService(vtn_id, state_backend=state_backend,
+                                                        report_queue=report_queue)
+        self.services['poll_service'] = PollService(vtn_id, state_backend=state_backend)
         self.services['registration_service'] = RegistrationService(vtn_id, poll_freq=requested_poll_freq)
 
         # Register the other services with the poll service
         self.services['poll_service'].event_service = self.services['event_service']
         self.services['poll_service'].report_service = self.services['report_service']
+        self.services['registration_service'].report_service = self.services['report_service']
+        self.services['event_service'].events_updated = self.services['poll_service'].events_updated
+
+        # Deliver messages to VENs that use the HTTP push model
+        if push_dispatcher is None:
+            push_dispatcher = PushDispatcher()
+        push_dispatcher.vtn_id = vtn_id
+        push_dispatcher.create_message = self.services['event_service']._create_message_async
+        self.services['event_service'].push_dispatcher = push_dispatcher
+        self.services['registration_service'].push_dispatcher = push_dispatcher
+        self.push_dispatcher = push_dispatcher
+        self.report_queue = report_queue
+
+        # Load the stored group events; the other stored state is loaded when it is first used
+        self.state_backend = state_backend
+        self.state_refresh_interval = 0.1
+        self._refresh_task = None
+        self.worker_id = None       # Set by openleadr.workers when running multiple worker processes
+        if state_backend is not None:
+            push_dispatcher.use_state_backend(state_backend)
+            self.services['event_service'].events.load_group_events()
 
         # Set up the HTTP handlers for the services
         http_path_prefix = http_path_prefix.rstrip("/")
@@ -114,6 +193,9 @@ class OpenADRServer:
             self.ssl_context.load_verify_locations(http_ca_file)
             self.ssl_context.verify_mode = ssl.CERT_REQUIRED
             self.ssl_context.load_cert_chain(http_cert, http_key, http_key_passphrase)
+            if push_dispatcher.ssl_context is None:
+                push_dispatcher.ssl_context = ssl.create_default_context(cafile=http_ca_file)
+                push_dispatcher.ssl_context.load_cert_chain(http_cert, http_key, http_key_passphrase)
         else:
             self.ssl_context = None
 
@@ -136,8 +218,15 @@ class OpenADRServer:
                     print(utils.certificate_domain(cert).center(80))
                 print("*" * 80)
                 print("")
+            # Load the key and certificate once, instead of for every message. Key objects
+            # can't be sent to a process pool; the workers load and cache the key themselves.
+            cert = load_certificate_chain(cert)
+            if signing_pool is None or not signing_pool.use_processes:
+                key = load_signing_key(key, passphrase)
         VTNService._create_message = partial(create_message, cert=cert, key=key,
                                              passphrase=passphrase)
+        VTNService.signing_pool = signing_pool
+        self.signing_pool = signing_pool
         if fingerprint_lookup is not None:
             logger.warning("DeprecationWarning: the argument 'fingerprint_lookup' is deprecated and "
                            "is replaced by 'ven_lookup'. 'fingerprint_lookup' will be removed in a "
@@ -156,13 +245,33 @@ class OpenADRServer:
         """
         Starts the server in an already-running asyncio loop.
         """
+        if self.worker_id is not None:
+            self._check_worker_setup()
+            # Each worker would have its own cache, and invalidate_ven would only reach one of them
+            VTNService.lookup_cache = None
+            # Callbacks stay in this worker; the other workers pass the messages for them on
+            mailbox = WorkerMailbox(self.state_backend, self.worker_id)
+            self.services['event_service'].use_mailbox(mailbox)
+            self.services['report_service'].use_mailbox(mailbox)
         self.app_runner = web.AppRunner(self.app)
         await self.app_runner.setup()
         site = web.TCPSite(self.app_runner,
                            port=self.http_port,
                            host=self.http_host,
-                           ssl_context=self.ssl_context)
+                           ssl_context=self.ssl_context,
+                           reuse_port=self.worker_id is not None)
         await site.start()
+        if self.worker_id in (None, 0):
+            self.services['event_service'].scheduler.start()
+            self.push_dispatcher.start()
+        else:
+            # Only the first worker updates the event statuses and pushes messages
+            self.services['event_service'].push_dispatcher = None
+        if self.worker_id is not None and self.state_backend is not None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_state())
+        if self.worker_id not in (None, 0):
+            # The first worker shows the address for all workers
+            return
         protocol = 'https' if self.ssl_context else 'http'
         print("")
         print("*" * 80)
@@ -174,11 +283,54 @@ class OpenADRServer:
     async def run_async(self):
         await self.run()
 
+    def _check_worker_setup(self):
+        """
+        Refuse to run as a worker process with state that is only kept in this process.
+        Each worker only sees the messages that the operating system gives it, so anything
+        that is not in the shared state backend would be missing in the other workers.
+        """
+        problems = []
+        if self.state_backend is None or isinstance(self.state_backend, MemoryStateBackend):
+            problems.append("the workers need a state_backend that they can share, like an "
+                            "SQLiteStateBackend")
+        if VTNService.verify_message_signatures and isinstance(messaging.NONCE_CACHE, MemoryNonceStore):
+            problems.append("a MemoryNonceStore would let a message be replayed to another worker; "
+                            "use a shared nonce_store, like an SQLiteNonceStore")
+        if problems:
+            raise ValueError(f"Worker {self.worker_id} can not be started: {'; '.join(problems)}.")
+
+    async def _refresh_state(self):
+        """
+        Load the state that was changed by the other worker processes.
+        """
+        while True:
+            await asyncio.sleep(self.state_refresh_interval)
+            try:
+                self.state_backend.refresh()
+            except Exception as err:
+                logger.error(f"Could not refresh the VTN state: {err.__class__.__name__}: {err}")
+
     async def stop(self):
         """
         Stop the server in a graceful manner.
         """
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        self.services['event_service'].scheduler.stop()
+        await self.push_dispatcher.close()
         await self.app_runner.cleanup()
+        if self.report_queue is not None:
+            await self.report_queue.close()
+        if self.state_backend is not None:
+            await self.state_backend.flush_async()
+
+    def invalidate_ven(self, ven_id):
+        """
+        Forget the cached ven_lookup and fingerprint_lookup results for this VEN, for instance
+        after you changed its registration or certificate outside of OpenADR.
+        """
+        self.lookup_cache.invalidate(ven_id)
 
     def add_event(self, ven_id, signal_name, signal_type, intervals, callback=None, delivery_callback=None,
                   event_id=None, targets=None, targets_by_type=None, target=None, response_required='always',
@@ -210,6 +362,108 @@ class OpenADRServer:
                          "message queuing system, you should not assign an on_poll handler. "
                          "Your Event will NOT be added.")
             return
+        if target is None and targets is None and targets_by_type is None:
+            targets = [{'ven_id': ven_id}]
+        event = self._create_event(signal_name, signal_type, intervals, event_id, targets, targets_by_type,
+                                   target, response_required, market_context, notification_period,
+                                   ramp_up_period, recovery_period)
+        return self.add_raw_event(ven_id=ven_id, event=event, callback=callback,
+                                  delivery_callback=delivery_callback)
+
+    def add_events_bulk(self, ven_ids, signal_name, signal_type, intervals, callback=None,
+                        delivery_callback=None, targets=None, targets_by_type=None, target=None,
+                        response_required='always', market_context="oadr://unknown.context",
+                        notification_period=None, ramp_up_period=None, recovery_period=None):
+        """
+        Convenience method to add an event with a single signal for each of many VENs at once.
+        Each VEN gets its own event with its own event_id, but the arguments and the callback
+        are checked only once, and the status transitions of the events are scheduled once.
+
+        :param ven_ids: A list of ven_ids, or a dict of {ven_id: target(s)} to give the event
+                        for each VEN its own target(s).
+
+        The other arguments are the same as for add_event. If you don't provide a target, the
+        event for each VEN targets that ven_id. Returns the list of event_ids, in the same
+        order as the ven_ids. A ven_id that occurs more than once gets an event for each time.
+        """
+        if self.services['event_service'].polling_method == 'external':
+            logger.error("You cannot use the add_events_bulk method after you assign your own on_poll "
+                         "handler. Your Events will NOT be added.")
+            return
+        target_vens = target is None and targets is None and targets_by_type is None
+        if target_vens:
+            targets = []
+        template = self._create_event(signal_name, signal_type, intervals, None, targets, targets_by_type,
+                                      target, response_required, market_context, notification_period,
+                                      ramp_up_period, recovery_period)
+        self._check_event_callback(template, callback)
+        self._set_event_defaults(template)
+        template.event_descriptor.event_status = utils.determine_event_status(template.active_period)
+
+        ven_targets = ven_ids if isinstance(ven_ids, dict) else None
+        ven_ids = list(ven_ids)
+        events = []
+        event_ids = utils.generate_ids(len(ven_ids))
+        # The events don't contain reference cycles, so the garbage collector can be paused
+        # while they are created, instead of scanning all objects again and again.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for ven_id, event_id in zip(ven_ids, event_ids):
+                if ven_targets is not None:
+                    ven_target = ven_targets[ven_id]
+                    event_targets = [_shallow_copy(target) for target in ven_target] \
+                        if isinstance(ven_target, list) else [_shallow_copy(ven_target)]
+                elif target_vens:
+                    event_targets = [{'ven_id': ven_id}]
+                else:
+                    event_targets = [_shallow_copy(target) for target in template.targets]
+                # Copies that skip __post_init__, because the template was already checked
+                event = _copy_event(template, event_targets)
+                event.event_descriptor.event_id = event_id
+                self._add_event_callbacks(event_id, event, callback, delivery_callback)
+                events.append((ven_id, event))
+            self.events.add_events(events)
+            self.services['event_service'].scheduler.schedule_events(events, same_active_period=True)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.services['event_service'].events_changed(dict.fromkeys(ven_ids))
+        return event_ids
+
+    def add_group_event(self, ven_ids, signal_name, signal_type, intervals, callback=None,
+                        delivery_callback=None, event_id=None, targets=None, targets_by_type=None,
+                        target=None, response_required='always', market_context="oadr://unknown.context",
+                        notification_period=None, ramp_up_period=None, recovery_period=None):
+        """
+        Convenience method to add an event with a single signal that is delivered to many VENs.
+        The event is stored only once, and its XML is rendered only once per modification.
+
+        :param list ven_ids: The ven_ids to whom this event must be delivered.
+
+        The other arguments are the same as for add_event. If you don't provide a target, the
+        event will target each of the given ven_ids. For large groups, you should target a
+        group_id or party_id instead, to keep the message small.
+        """
+        if self.services['event_service'].polling_method == 'external':
+            logger.error("You cannot use the add_group_event method after you assign your own on_poll "
+                         "handler. Your Event will NOT be added.")
+            return
+        ven_ids = list(ven_ids)
+        if target is None and targets is None and targets_by_type is None:
+            targets = [{'ven_id': ven_id} for ven_id in ven_ids]
+        event = self._create_event(signal_name, signal_type, intervals, event_id, targets, targets_by_type,
+                                   target, response_required, market_context, notification_period,
+                                   ramp_up_period, recovery_period)
+        return self.add_raw_group_event(ven_ids=ven_ids, event=event, callback=callback,
+                                        delivery_callback=delivery_callback)
+
+    def _create_event(self, signal_name, signal_type, intervals, event_id, targets, targets_by_type,
+                      target, response_required, market_context, notification_period,
+                      ramp_up_period, recovery_period):
+        """
+        Create an Event with a single signal from the arguments to add_event.
+        """
         if not re.match(r"^(([^:/?#]+):)?(//([^/?#]*))?([^?#]*)(\?([^#]*))?(#(.*))?", market_context):
             raise ValueError("The Market Context must be a valid URI.")
         event_id = event_id or utils.generate_id()
@@ -219,9 +473,7 @@ class OpenADRServer:
                              f"you provided '{response_required}'.")
 
         # Figure out the target for this Event
-        if target is None and targets is None and targets_by_type is None:
-            targets = [{'ven_id': ven_id}]
-        elif target is not None:
+        if target is not None:
             targets = [target]
         elif targets_by_type is not None:
             targets = utils.ungroup_targets_by_type(targets_by_type)
@@ -265,8 +517,7 @@ class OpenADRServer:
                               event_signals=[event_signal],
                               targets=targets,
                               response_required=response_required)
-        self.add_raw_event(ven_id=ven_id, event=event, callback=callback, delivery_callback=delivery_callback)
-        return event_id
+        return event
 
     def add_raw_event(self, ven_id, event, callback=None, delivery_callback=None):
         """
@@ -277,6 +528,43 @@ class OpenADRServer:
         :param callable callback: A callback that will receive the opt status for this event.
                                   This callback receives ven_id, event_id, opt_type as its arguments.
         """
+        self._check_event_callback(event, callback)
+        event_id = self._set_event_defaults(event)
+
+        # Add event to the queue
+        self.events.add_event(ven_id, event)
+        self.services['event_service'].scheduler.schedule_event(event, ven_id)
+        self.services['event_service'].events_changed([ven_id])
+        self._add_event_callbacks(event_id, event, callback, delivery_callback)
+        return event_id
+
+    def add_raw_group_event(self, ven_ids, event, callback=None, delivery_callback=None):
+        """
+        Add a single event that is delivered to many VENs. The event is stored once and shared
+        by all VENs, and its XML is rendered once for each modification. The delivery state
+        for each VEN is available from server.events.delivery_states(event_id).
+
+        :param list ven_ids: The ven_ids to which this event should be distributed.
+        :param dict event: The event (as a dict or as a objects.Event instance)
+                           that contains the event details.
+        :param callable callback: A callback that will receive the opt status for this event from
+                                  each VEN. This callback receives ven_id, event_id, opt_type as its
+                                  arguments. It cannot be a Future.
+        """
+        if asyncio.isfuture(callback):
+            raise ValueError("The 'callback' for a group event cannot be a Future, because it "
+                             "will receive a response from each VEN.")
+        self._check_event_callback(event, callback)
+        event_id = self._set_event_defaults(event)
+
+        ven_ids = list(ven_ids)
+        self.events.add_group_event(ven_ids, event)
+        self.services['event_service'].scheduler.schedule_event(event)
+        self.services['event_service'].events_changed(ven_ids)
+        self._add_event_callbacks(event_id, event, callback, delivery_callback)
+        return event_id
+
+    def _check_event_callback(self, event, callback):
         if utils.getmember(event, 'response_required') == 'always':
             if callback is None:
                 logger.warning("You did not provide a 'callback', which means you won't know if the "
@@ -289,10 +577,8 @@ class OpenADRServer:
                                      "'ven_id' (str), 'event_id' (str), 'opt_type' (str). Please fix "
                                      "your 'callback' handler.")
 
+    def _set_event_defaults(self, event):
         event_id = utils.getmember(event, 'event_descriptor.event_id')
-        # Create the event queue if it does not exist yet
-        if ven_id not in self.events:
-            self.events[ven_id] = []
 
         # Add some default properties to the event if they are not already set
         if not utils.getmember(event, 'event_descriptor.event_status', None):
@@ -304,17 +590,19 @@ class OpenADRServer:
             utils.setmember(event, 'active_period', active_period)
         if not utils.getmember(event, 'event_descriptor.priority', None):
             utils.setmember(event, 'event_descriptor.priority', 0)
+        return event_id
 
-        # Add event to the queue
-        self.events[ven_id].append(event)
-        self.events_updated[ven_id] = True
-
+    def _add_event_callbacks(self, event_id, event, callback, delivery_callback):
         # Add the callback for the response to this event
+        mailbox = self.services['event_service'].mailbox
         if callback is not None:
             self.event_callbacks[event_id] = (event, callback)
+            if mailbox is not None:
+                mailbox.claim(f'event/{event_id}')
         if delivery_callback is not None:
             self.event_delivery_callbacks[event_id] = delivery_callback
-        return event_id
+            if mailbox is not None:
+                mailbox.claim(f'delivery/{event_id}')
 
     def cancel_event(self, ven_id, event_id):
         """
@@ -325,24 +613,66 @@ class OpenADRServer:
                            f"ven_id {ven_id}, but this ven_id does not exist.")
             return
 
-        event = utils.find_by(self.events[ven_id], 'event_descriptor.event_id', event_id)
+        event = self.events.get_event(ven_id, event_id)
         if not event:
             logger.error("""The event you tried to cancel was not found. """
                          f"""Was looking for event_id {event_id} for ven {ven_id}."""
                          f"""Only found these: {[utils.getmember(e, 'event_descriptor.event_id') for e in self.events[ven_id]]}""")
             return
 
+        # A group event is only cancelled for this VEN, so it gets its own copy
+        event = self.events.detach_event(ven_id, event_id)
+
         # Set the Event Status to cancelled
-        utils.setmember(event, 'event_descriptor.event_status', enums.EVENT_STATUS.CANCELLED)
+        self.events.set_event_status(ven_id, event_id, enums.EVENT_STATUS.CANCELLED)
+        utils.increment_event_modification_number(event)
+        self.services['event_service'].events_changed([ven_id])
+
+    def cancel_group_event(self, event_id):
+        """
+        Mark the indicated group event as cancelled for all of its VENs.
+        """
+        if not self.events.is_group_event(event_id):
+            logger.error(f"The group event you tried to cancel was not found. "
+                         f"Was looking for event_id {event_id}.")
+            return
+        event = self.events.get_group_event(event_id)
+        if event is None:
+            logger.warning(f"The group event {event_id} is no longer shared by any VENs, "
+                           f"so there is nothing to cancel.")
+            return
+        ven_ids = list(self.events.delivery_states(event_id))
+        # The modification number is changed first, so that it is saved along with the status
         utils.increment_event_modification_number(event)
-        self.events_updated[ven_id] = True
+        self.events.set_group_event_status(event_id, enums.EVENT_STATUS.CANCELLED)
+        self.services['event_service'].events_changed(ven_ids)
+
+    def push_message(self, ven_id, message_type, **message_payload):
+        """
+        Send a message to a VEN that registered for the HTTP push model, for instance an
+        oadrCreateReport, oadrCancelReport or oadrRequestReregistration. Returns False if
+        the VEN does not use the push model. Must be called from a running event loop.
+
+        :param str ven_id: The ven_id of the VEN to send the message to.
+        :param str message_type: The type of message, one of openleadr.push.PUSH_SERVICES.
+        """
+        if message_type not in PUSH_SERVICES:
+            raise ValueError(f"Messages of type {message_type} can not be pushed to a VEN. "
+                             f"""Use one of '{"', '".join(PUSH_SERVICES)}'.""")
+        if not self.push_dispatcher.is_push_ven(ven_id):
+            logger.warning(f"VEN {ven_id} does not use the HTTP push model, "
+                           f"the {message_type} message was not sent.")
+            return False
+        message_payload.setdefault('ven_id', ven_id)
+        self.push_dispatcher.push(ven_id, (message_type, message_payload))
+        return True
 
     def add_handler(self, name, func):
         """
         Add a handler to the OpenADRServer.
 
         :param str name: The name for this handler. Should be one of: on_created_event,
-                            on_request_event, on_register_report, on_create_report,
+                            on_request_event, on_event_status_change, on_register_report, on_create_report,
                             on_created_report, on_request_report, on_update_report, on_poll,
                             on_query_registration, on_create_party_registration,
                             on_cancel_party_registration.
@@ -378,3 +708,39 @@ class OpenADRServer:
     @property
     def event_delivery_callbacks(self):
         return self.services['event_service'].event_delivery_callbacks
+
+
+def _shallow_copy(obj):
+    if isinstance(obj, dict):
+        return obj.copy()
+    new_obj = object.__new__(type(obj))
+    new_obj.__dict__.update(obj.__dict__)
+    return new_obj
+
+
+def _copy_event(event, targets):
+    """
+    Copy an Event, without sharing any of its parts that can be changed with the original,
+    and give it the given list of targets. The values in it, like datetimes and strings,
+    are shared.
+    """
+    new_event = _shallow_copy(event)
+    new_event.event_descriptor = _shallow_copy(event.event_descriptor)
+    new_event.active_period = _shallow_copy(event.active_period)
+    new_event.event_signals = [_copy_signal(signal) for signal in event.event_signals]
+    new_event.targets = targets
+    new_event.targets_by_type = utils.group_targets_by_type(
+        [asdict(target) if is_dataclass(target) else target for target in targets])
+    return new_event
+
+
+def _copy_signal(signal):
+    new_signal = _shallow_copy(signal)
+    new_signal.intervals = [_shallow_copy(interval) for interval in signal.intervals]
+    if signal.targets is not None:
+        new_signal.targets = [_shallow_copy(target) for target in signal.targets]
+    if signal.targets_by_type is not None:
+        new_signal.targets_by_type = {key: list(value) for key, value in signal.targets_by_type.items()}
+    if signal.measurement is not None:
+        new_signal.measurement = _shallow_copy(signal.measurement)
+    return new_signal
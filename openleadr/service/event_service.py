@@ -16,7 +16,11 @@
 
 from . import service, handler, VTNService
 import asyncio
+from functools import partial
 from openleadr import utils, errors, enums
+from openleadr.event_scheduler import EventStatusScheduler
+from openleadr.event_store import CompletedEvents, EventStore
+from openleadr.messaging import render_event
 import logging
 logger = logging.getLogger('openleadr')
 
@@ -24,14 +28,35 @@ logger = logging.getLogger('openleadr')
 @service('EiEvent')
 class EventService(VTNService):
 
-    def __init__(self, vtn_id, polling_method='internal'):
+    def __init__(self, vtn_id, polling_method='internal', state_backend=None):
         super().__init__(vtn_id)
         self.polling_method = polling_method
-        self.events = {}
-        self.completed_event_ids = {}   # Holds the ids of completed events
+        self.events = EventStore(state_backend)
+        self.scheduler = EventStatusScheduler(self.events, self._event_status_changed)
+        self.events.on_load = self._events_loaded
+        self.events_updated = {}        # Shared with the PollService by the OpenADRServer
+        self.push_dispatcher = None     # Set by the OpenADRServer
+        self._push_pending = set()      # VENs for which an oadrDistributeEvent push is queued
+        self._push_completed = {}       # {ven_id: completed event_ids in the push that is being sent}
+        self.completed_event_ids = CompletedEvents()
         self.event_callbacks = {}
         self.event_opt_types = {}
         self.event_delivery_callbacks = {}
+        self.on_event_status_change = None
+        self.mailbox = None             # Set by the OpenADRServer when it runs as a worker process
+
+    def use_mailbox(self, mailbox):
+        """
+        Pass the responses and deliveries for events with callbacks in other worker
+        processes on to those workers, and receive the ones for our own callbacks.
+        """
+        self.mailbox = mailbox
+        mailbox.handlers['created_event'] = self._call_event_callback
+        mailbox.handlers['event_delivered'] = self._call_delivery_callback
+        for event_id in self.event_callbacks:
+            mailbox.claim(f'event/{event_id}')
+        for event_id in self.event_delivery_callbacks:
+            mailbox.claim(f'delivery/{event_id}')
 
     @handler('oadrRequestEvent')
     async def request_event(self, payload):
@@ -39,22 +64,32 @@ class EventService(VTNService):
         The VEN requests us to send any events we have.
         """
         ven_id = payload['ven_id']
+        message_type, message_payload, completed_event_ids = await self._distribute_events(ven_id)
+        self._remove_completed_events(ven_id, completed_event_ids)
+        return message_type, message_payload
+
+    async def _distribute_events(self, ven_id):
+        """
+        Get the oadrDistributeEvent for this VEN, and the event_ids of the completed events
+        in it. These are delivered for the last time, and should be removed once the message
+        has been delivered.
+        """
+        completed_event_ids = []
         if self.polling_method == 'internal':
-            if ven_id in self.events and self.events[ven_id]:
-                events = utils.order_events(self.events[ven_id])
+            # The statuses are kept up to date by the scheduler while the server is running
+            events = self.events.ordered_events(ven_id, update_statuses=not self.scheduler.running)
+            if events:
+                # Use the rendered events, which are only rendered again if they have changed
+                rendered_events = self.events.render_events(ven_id, events, render_event)
                 for event in events:
-                    event_status = utils.getmember(event, 'event_descriptor.event_status')
-                    # Pop the event from the events so that this is the last time it is communicated
-                    if event_status == enums.EVENT_STATUS.COMPLETED:
-                        if ven_id not in self.completed_event_ids:
-                            self.completed_event_ids[ven_id] = []
-                        event_id = utils.getmember(event, 'event_descriptor.event_id')
-                        self.completed_event_ids[ven_id].append(event_id)
-                        self.events[ven_id].pop(self.events[ven_id].index(event))
+                    event_id = utils.getmember(event, 'event_descriptor.event_id')
+                    self.events.mark_delivered(ven_id, event_id)
+                    if utils.getmember(event, 'event_descriptor.event_status') == enums.EVENT_STATUS.COMPLETED:
+                        completed_event_ids.append(event_id)
             else:
                 events = None
         else:
-            result = self.on_request_event(ven_id=payload['ven_id'])
+            result = self.on_request_event(ven_id=ven_id)
             if asyncio.iscoroutine(result):
                 result = await result
             if result is None:
@@ -63,15 +98,121 @@ class EventService(VTNService):
                 events = utils.order_events(result)
 
         if events is None:
-            return 'oadrResponse', {}
-        else:
-            # Fire the delivery callbacks, if any
-            for event in events:
-                event_id = utils.getmember(event, 'event_descriptor.event_id')
-                if event_id in self.event_delivery_callbacks:
-                    await utils.await_if_required(self.event_delivery_callbacks[event_id]())
-            return 'oadrDistributeEvent', {'events': events}
-        return 'oadrResponse', result
+            return 'oadrResponse', {}, completed_event_ids
+        # Fire the delivery callbacks, if any
+        for event in events:
+            event_id = utils.getmember(event, 'event_descriptor.event_id')
+            if event_id in self.event_delivery_callbacks:
+                await self._call_delivery_callback(event_id)
+            elif self.mailbox is not None:
+                self.mailbox.send(f'delivery/{event_id}', 'event_delivered', event_id)
+        message_payload = {'events': events}
+        if self.polling_method == 'internal':
+            message_payload['_rendered_events'] = rendered_events
+        return 'oadrDistributeEvent', message_payload, completed_event_ids
+
+    def shed_response(self, message_type, message_payload):
+        """
+        Answer a shed oadrRequestEvent with an oadrDistributeEvent without events.
+        """
+        response_type, response_payload = super().shed_response(message_type, message_payload)
+        if message_type != 'oadrRequestEvent':
+            return response_type, response_payload
+        response_payload['request_id'] = utils.generate_id()
+        response_payload['events'] = []
+        return 'oadrDistributeEvent', response_payload
+
+    async def _call_delivery_callback(self, event_id):
+        callback = self.event_delivery_callbacks.get(event_id)
+        if callback is not None:
+            await utils.await_if_required(callback())
+
+    def _remove_completed_events(self, ven_id, completed_event_ids):
+        # Pop the completed events from the events so that this is the last time they are communicated
+        for event_id in completed_event_ids:
+            self.completed_event_ids.add(ven_id, event_id)
+            self._remove_event(ven_id, event_id)
+
+    def events_changed(self, ven_ids):
+        """
+        Make sure that these VENs receive their updated events: VENs that use the push
+        model get them right away, other VENs get them on their next poll.
+        """
+        for ven_id in ven_ids:
+            self.events_updated[ven_id] = True
+            if self.push_dispatcher is not None and self.push_dispatcher.is_push_ven(ven_id) \
+                    and ven_id not in self._push_pending:
+                self._push_pending.add(ven_id)
+                self.push_dispatcher.push(ven_id, partial(self._next_push, ven_id),
+                                          on_failure=self._push_failed,
+                                          on_success=self._push_delivered)
+
+    async def _next_push(self, ven_id):
+        """
+        Get the oadrDistributeEvent for a push-mode VEN, right before it is sent, so that
+        all changes up to that moment are delivered in a single message.
+        """
+        self._push_pending.discard(ven_id)
+        if not self.events_updated.get(ven_id):
+            return None
+        self.events_updated[ven_id] = False
+        message_type, message_payload, completed_event_ids = await self._distribute_events(ven_id)
+        if message_type != 'oadrDistributeEvent':
+            return None
+        # The completed events are only removed once the VEN has received them
+        self._push_completed[ven_id] = completed_event_ids
+        return message_type, message_payload
+
+    def _push_delivered(self, ven_id, message_type):
+        self._remove_completed_events(ven_id, self._push_completed.pop(ven_id, []))
+
+    def _push_failed(self, ven_id, message_type):
+        # Fall back to delivering the events when the VEN polls
+        self._push_completed.pop(ven_id, None)
+        self.events_updated[ven_id] = True
+
+    def _event_status_changed(self, ven_ids, event_id, old_status, new_status):
+        """
+        Make sure that the VENs receive the new status of an event on their next poll,
+        and call the on_event_status_change handler if there is one.
+        """
+        self.events_changed(ven_ids)
+        if self.on_event_status_change is not None:
+            for ven_id in ven_ids:
+                result = self.on_event_status_change(ven_id=ven_id, event_id=event_id,
+                                                     old_status=old_status, new_status=new_status)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+
+    def _events_loaded(self, ven_id, events):
+        """
+        Bring the status of events that were loaded from the state backend up to date,
+        and schedule their status transitions. The VENs receive the events again if their
+        status changed while they were stored.
+        """
+        statuses = [utils.getmember(event, 'event_descriptor.event_status') for event in events]
+        self.scheduler.schedule_events([(ven_id, event) for event in events])
+        for event, event_status in zip(events, statuses):
+            if utils.getmember(event, 'event_descriptor.event_status') != event_status:
+                if ven_id is None:
+                    event_id = utils.getmember(event, 'event_descriptor.event_id')
+                    self.events_changed(self.events.delivery_states(event_id))
+                else:
+                    self.events_changed([ven_id])
+
+    def _remove_event(self, ven_id, event_id):
+        """
+        Remove an event for a VEN, and forget the callbacks of a group event once
+        it has been removed for all of its VENs.
+        """
+        is_group_event = self.events.is_group_event(event_id)
+        self.events.remove_event(ven_id, event_id)
+        if is_group_event and not self.events.has_event(event_id):
+            self.event_callbacks.pop(event_id, None)
+            self.event_delivery_callbacks.pop(event_id, None)
+            if self.mailbox is not None:
+                self.mailbox.release(f'event/{event_id}')
+                self.mailbox.release(f'delivery/{event_id}')
 
     def on_request_event(self, ven_id):
         """
@@ -94,32 +235,26 @@ class EventService(VTNService):
                 event_id = event_response['event_id']
                 modification_number = event_response['modification_number']
                 opt_type = event_response['opt_type']
-                event = utils.find_by(self.events[ven_id],
-                                      'event_descriptor.event_id', event_id,
-                                      'event_descriptor.modification_number', modification_number)
+                event = self.events.get_event(ven_id, event_id, modification_number)
                 if not event:
-                    if event_id not in self.completed_event_ids.get(ven_id, []):
+                    if (ven_id, event_id) not in self.completed_event_ids:
                         logger.warning(f"""Got an oadrCreatedEvent message from ven '{ven_id}' """
                                        f"""for event '{event_id}' with modification number """
                                        f"""{modification_number} that does not exist.""")
                         raise errors.InvalidIdError
+                # The callback for a group event receives the responses from all VENs,
+                # but a repeated response from the same VEN is only passed on once.
+                is_group_event = self.events.is_group_event(event_id)
+                if not is_group_event or self.events.mark_acknowledged(ven_id, event_id,
+                                                                       modification_number, opt_type):
+                    if event_id in self.event_callbacks:
+                        await self._call_event_callback(ven_id, event_id, opt_type, is_group_event)
+                    elif self.mailbox is not None:
+                        self.mailbox.send(f'event/{event_id}', 'created_event',
+                                          ven_id, event_id, opt_type, is_group_event)
                 # Remove the event from the events list if the cancellation is confirmed.
                 if utils.getmember(event, 'event_descriptor.event_status') == enums.EVENT_STATUS.CANCELLED:
-                    utils.pop_by(self.events[ven_id], 'event_descriptor.event_id', event_id)
-                if event_response['event_id'] in self.event_callbacks:
-                    event, callback = self.event_callbacks.pop(event_id)
-                    if isinstance(callback, asyncio.Future):
-                        if callback.done():
-                            logger.warning(f"Got a second response '{opt_type}' from ven '{ven_id}' "
-                                           f"to event '{event_id}', which we cannot use because the "
-                                           "callback future you provided was already completed during "
-                                           "the first response.")
-                        else:
-                            callback.set_result(opt_type)
-                    else:
-                        result = callback(ven_id=ven_id, event_id=event_id, opt_type=opt_type)
-                        if asyncio.iscoroutine(result):
-                            result = await result
+                    self._remove_event(ven_id, event_id)
         else:
             for event_response in payload['event_responses']:
                 event_id = event_response['event_id']
@@ -129,6 +264,33 @@ class EventService(VTNService):
                                                                              opt_type=opt_type))
         return 'oadrResponse', {}
 
+    async def _call_event_callback(self, ven_id, event_id, opt_type, is_group_event):
+        """
+        Pass the response of a VEN to the callback of an event. The callback of a group
+        event is kept for the responses of the other VENs.
+        """
+        if is_group_event:
+            event_callback = self.event_callbacks.get(event_id)
+        else:
+            event_callback = self.event_callbacks.pop(event_id, None)
+            if self.mailbox is not None:
+                self.mailbox.release(f'event/{event_id}')
+        if event_callback is None:
+            return
+        event, callback = event_callback
+        if isinstance(callback, asyncio.Future):
+            if callback.done():
+                logger.warning(f"Got a second response '{opt_type}' from ven '{ven_id}' "
+                               f"to event '{event_id}', which we cannot use because the "
+                               "callback future you provided was already completed during "
+                               "the first response.")
+            else:
+                callback.set_result(opt_type)
+        else:
+            result = callback(ven_id=ven_id, event_id=event_id, opt_type=opt_type)
+            if asyncio.iscoroutine(result):
+                result = await result
+
     def on_created_event(self, ven_id, event_id, opt_type):
         """
         Placeholder for the on_created_event handler.
@@ -16,6 +16,7 @@
 
 from openleadr.service import service, handler, VTNService
 from openleadr import objects
+from openleadr.state import StateDict
 import asyncio
 from dataclasses import asdict
 import logging
@@ -102,10 +103,15 @@ logger = logging.getLogger('openleadr')
 @service('OadrPoll')
 class PollService(VTNService):
 
-    def __init__(self, vtn_id, polling_method='internal', event_service=None, report_service=None):
+    def __init__(self, vtn_id, polling_method='internal', event_service=None, report_service=None,
+                 state_backend=None):
         super().__init__(vtn_id)
         self.polling_method = polling_method
-        self.events_updated = {}
+        if state_backend is not None:
+            self.events_updated = StateDict(state_backend, 'events_updated')
+            state_backend.set_merge('events_updated', _merge_events_updated)
+        else:
+            self.events_updated = {}
         self.report_requests = {}
         self.event_service = event_service
         self.report_service = report_service
@@ -150,3 +156,12 @@ class PollService(VTNService):
                        "are available), an Event or list of Events, a RequestReregistration "
                        " or RequestReport.")
         return None
+
+
+def _merge_events_updated(base, ours, theirs):
+    """
+    Merge the 'events updated' flags for a VEN that two processes wrote at the same time.
+    A process only sets the flag when the events changed, so the VEN receives its events
+    again if either process set it, even if the flag was already set before.
+    """
+    return ours or theirs
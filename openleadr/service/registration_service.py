@@ -66,6 +66,8 @@ class RegistrationService(VTNService):
     def __init__(self, vtn_id, poll_freq):
         super().__init__(vtn_id)
         self.poll_freq = poll_freq
+        self.push_dispatcher = None     # Set by the OpenADRServer
+        self.report_service = None      # Set by the OpenADRServer
 
     @handler('oadrQueryRegistration')
     async def query_registration(self, payload):
@@ -102,6 +104,10 @@ class RegistrationService(VTNService):
                 response_payload = {}
             else:
                 ven_id, registration_id = result
+                self._register_transport(ven_id, payload)
+                # The VEN's registration and fingerprint may have changed
+                if self.lookup_cache is not None:
+                    self.lookup_cache.invalidate(ven_id)
                 transports = [{'transport_name': payload['transport_name']}]
                 response_payload = {'ven_id': result[0],
                                     'registration_id': result[1],
@@ -115,6 +121,44 @@ class RegistrationService(VTNService):
                                 'requested_oadr_poll_freq': self.poll_freq}
         return 'oadrCreatedPartyRegistration', response_payload
 
+    def _register_transport(self, ven_id, payload):
+        """
+        Deliver messages to VENs that use the HTTP push model at their transport address.
+        """
+        if self.push_dispatcher is None:
+            return
+        if payload.get('http_pull_model') is False:
+            if payload.get('transport_address'):
+                try:
+                    self.push_dispatcher.register(ven_id, payload['transport_address'])
+                    return
+                except ValueError as err:
+                    logger.warning(f"VEN {ven_id} registered for the HTTP push model, but {err} "
+                                   "Messages will be delivered when the VEN polls.")
+            else:
+                logger.warning(f"VEN {ven_id} registered for the HTTP push model, but did not "
+                               "provide a transport address. Messages will be delivered when "
+                               "the VEN polls.")
+        self.push_dispatcher.unregister(ven_id)
+
+    def shed_response(self, message_type, message_payload):
+        """
+        Ask VENs whose registration was shed to come back later.
+        """
+        if message_type not in ('oadrQueryRegistration', 'oadrCreatePartyRegistration'):
+            return super().shed_response(message_type, message_payload)
+        error = self.admission_controller.shed_error()
+        profiles = [{'profile_name': message_payload.get('profile_name', '2.0b'),
+                     'transports': [{'transport_name': message_payload.get('transport_name', 'simpleHttp')}]}]
+        response_payload = {'response': {'response_code': error.response_code,
+                                         'response_description': error.response_description,
+                                         'request_id': message_payload.get('request_id')},
+                            'vtn_id': self.vtn_id,
+                            'ven_id': message_payload.get('ven_id'),
+                            'profiles': profiles,
+                            'requested_oadr_poll_freq': self.admission_controller.shed_poll_freq or self.poll_freq}
+        return 'oadrCreatedPartyRegistration', response_payload
+
     def on_create_party_registration(self, payload):
         """
         Placeholder for the on_create_party_registration handler
@@ -131,9 +175,15 @@ class RegistrationService(VTNService):
         """
         Cancel the registration of a party.
         """
+        if self.push_dispatcher is not None:
+            self.push_dispatcher.unregister(payload.get('ven_id'))
+        if self.report_service is not None:
+            self.report_service.remove_report_routes(payload.get('ven_id'))
         result = self.on_cancel_party_registration(payload)
         if iscoroutine(result):
             result = await result
+        if self.lookup_cache is not None:
+            self.lookup_cache.invalidate(payload.get('ven_id'))
         return result
 
     def on_cancel_party_registration(self, ven_id):
@@ -16,7 +16,11 @@
 
 from . import service, handler, VTNService
 from asyncio import iscoroutine
-from openleadr import objects, utils
+from openleadr import errors, objects, utils
+from openleadr.messaging import get_report_request_ids, parse_message_tree
+from openleadr.state import StateDict
+from collections.abc import MutableMapping
+import hashlib
 import logging
 import inspect
 logger = logging.getLogger('openleadr')
@@ -63,18 +67,73 @@ logger = logging.getLogger('openleadr')
 @service('EiReport')
 class ReportService(VTNService):
 
-    def __init__(self, vtn_id):
+    # Deliver report values to the callbacks in lists of at most this many values,
+    # instead of all values for an r_id at once, to limit memory use for large reports.
+    report_chunk_size = None
+
+    def __init__(self, vtn_id, state_backend=None, report_queue=None):
         super().__init__(vtn_id)
-        self.report_callbacks = {}
-        self.registered_reports = {}
-        self.requested_reports = {}
+        # The callbacks for the requested reports, by report_request_id and r_id
+        self.report_routes = {}
+        # The report_request_ids that we requested from each VEN, by report_specifier_id
+        self.ven_report_routes = {}
+        self.report_callbacks = ReportCallbacks(self.report_routes)
+        # A hash of the reports that each VEN registered, to recognize a repeated registration
+        self.registered_reports_hashes = {}
+        self.skipped_registrations = 0
+        self.report_queue = report_queue
+        if state_backend is not None:
+            self.registered_reports = StateDict(state_backend, 'registered_reports')
+            self.requested_reports = StateDict(state_backend, 'requested_reports')
+        else:
+            self.registered_reports = {}
+            self.requested_reports = {}
         self.created_reports = {}
+        self.mailbox = None     # Set by the OpenADRServer when it runs as a worker process
+
+    def use_mailbox(self, mailbox):
+        """
+        Pass the values of reports with callbacks in other worker processes on to those
+        workers, and receive the ones for our own callbacks.
+        """
+        self.mailbox = mailbox
+        mailbox.handlers['report_values'] = self._receive_report_values
+        mailbox.handlers['remove_report_routes'] = self.remove_report_routes
+        for ven_id, ven_routes in self.ven_report_routes.items():
+            mailbox.claim(f'reports/{ven_id}')
+            for report_request_id in ven_routes.values():
+                mailbox.claim(f'report/{report_request_id}')
+
+    def parse_message(self, message_tree):
+        """
+        When there are callbacks for all reports in the message, the values of incoming
+        reports are read straight from the XML tree, instead of from the parsed intervals.
+        """
+        if self.report_routes:
+            report_request_ids = get_report_request_ids(message_tree)
+            if report_request_ids and all(rrid in self.report_routes for rrid in report_request_ids):
+                return parse_message_tree(message_tree, stream_report_intervals=True)
+        return parse_message_tree(message_tree)
 
     @handler('oadrRegisterReport')
     async def register_report(self, payload):
         """
         Handle the VENs reporting capabilities.
         """
+        if payload.get('reports') is None:
+            # If the client does not send any reports, reply with an empty oadrRegisteredReport message.
+            return 'oadrRegisteredReport', {'report_requests': []}
+
+        # If the VEN registers the same reports again, for instance after it reconnected,
+        # we give it the same report requests as before, unless the handler was replaced.
+        ven_id = payload['ven_id']
+        reports_hash = (_hash_reports(payload['reports']), self.on_register_report)
+        if self.registered_reports_hashes.get(ven_id) == reports_hash:
+            previous_requests = self.requested_reports.get(ven_id, [])
+            if all(rr.report_request_id in self.report_routes for rr in previous_requests):
+                self.skipped_registrations += 1
+                return 'oadrRegisteredReport', {'report_requests': previous_requests}
+
         report_requests = []
         args = inspect.signature(self.on_register_report).parameters
         if all(['ven_id' in args, 'resource_id' in args, 'measurement' in args,
@@ -84,18 +143,17 @@ class ReportService(VTNService):
         else:
             mode = 'full'
 
-        if payload.get('reports') is None:
-            # If the client does not send any reports, reply with an empty oadrRegisteredReport message.
-            return 'oadrRegisteredReport', {'report_requests': []}
-
+        ven_reports = self.registered_reports.get(ven_id, [])
+        specifier_ids = {report['report_specifier_id'] for report in payload['reports']}
+        ven_reports = [report for report in ven_reports if report['report_specifier_id'] not in specifier_ids]
         for report in payload['reports']:
-            if payload['ven_id'] not in self.registered_reports:
-                self.registered_reports[payload['ven_id']] = []
-
             report_copy = report.copy()
             report_copy['report_name'] = report_copy['report_name'][9:]
-            self.registered_reports[payload['ven_id']].append(report_copy)
+            ven_reports.append(report_copy)
+        # Assign the list again, so that it is saved in the state backend
+        self.registered_reports[ven_id] = ven_reports
 
+        for report in payload['reports']:
             if report['report_name'] == 'METADATA_TELEMETRY_STATUS':
                 if mode == 'compact':
                     results = [self.on_register_report(ven_id=payload['ven_id'],
@@ -177,6 +235,7 @@ class ReportService(VTNService):
             orig_report = payload['reports'][i]
             report_specifier_id = orig_report['report_specifier_id']
             report_request_id = utils.generate_id()
+            route = self._add_report_route(payload['ven_id'], report_specifier_id, report_request_id)
             specifier_payloads = []
             for rrq in report_request:
                 if len(rrq) == 3:
@@ -189,8 +248,8 @@ class ReportService(VTNService):
                 reading_type = report_description['reading_type']
                 specifier_payloads.append(objects.SpecifierPayload(r_id=r_id,
                                                                    reading_type=reading_type))
-                # Append the callback to our list of known callbacks
-                self.report_callbacks[(report_request_id, r_id)] = callback
+                # Route the values for this r_id to the callback
+                route[r_id] = callback
 
             # Add the ReportSpecifier to the ReportRequest
             report_specifier = objects.ReportSpecifier(report_specifier_id=report_specifier_id,
@@ -207,9 +266,56 @@ class ReportService(VTNService):
         response_payload = {'report_requests': oadr_report_requests}
 
         # Store the requested reports
-        self.requested_reports[payload['ven_id']] = oadr_report_requests
+        self.requested_reports[ven_id] = oadr_report_requests
+        self.registered_reports_hashes[ven_id] = reports_hash
         return response_type, response_payload
 
+    def shed_response(self, message_type, message_payload):
+        """
+        Answer a shed oadrRegisterReport or oadrUpdateReport with its own response type.
+        """
+        response_type, response_payload = super().shed_response(message_type, message_payload)
+        if message_type == 'oadrRegisterReport':
+            response_payload['report_requests'] = []
+            return 'oadrRegisteredReport', response_payload
+        if message_type == 'oadrUpdateReport':
+            return 'oadrUpdatedReport', response_payload
+        return response_type, response_payload
+
+    def _add_report_route(self, ven_id, report_specifier_id, report_request_id):
+        """
+        Add an empty routing table for a new report request. If the VEN registered this
+        report before, the routing table for the previous request is removed.
+        """
+        ven_routes = self.ven_report_routes.setdefault(ven_id, {})
+        previous_request_id = ven_routes.get(report_specifier_id)
+        if previous_request_id is not None:
+            self.report_routes.pop(previous_request_id, None)
+            if self.mailbox is not None:
+                self.mailbox.release(f'report/{previous_request_id}')
+        ven_routes[report_specifier_id] = report_request_id
+        route = self.report_routes[report_request_id] = {}
+        if self.mailbox is not None:
+            self.mailbox.claim(f'reports/{ven_id}')
+            self.mailbox.claim(f'report/{report_request_id}')
+        return route
+
+    def remove_report_routes(self, ven_id):
+        """
+        Remove the routing tables for the reports that we requested from this VEN, for
+        instance because it canceled its registration.
+        """
+        if self.mailbox is not None and ven_id not in self.ven_report_routes:
+            # The routing tables may be in another worker process
+            self.mailbox.send(f'reports/{ven_id}', 'remove_report_routes', ven_id)
+        for report_request_id in self.ven_report_routes.pop(ven_id, {}).values():
+            self.report_routes.pop(report_request_id, None)
+            if self.mailbox is not None:
+                self.mailbox.release(f'report/{report_request_id}')
+        if self.mailbox is not None:
+            self.mailbox.release(f'reports/{ven_id}')
+        self.registered_reports_hashes.pop(ven_id, None)
+
     async def on_register_report(self, payload):
         """
         Pre-handler for a oadrOnRegisterReport message. This will call your own handler (if defined)
@@ -228,27 +334,83 @@ class ReportService(VTNService):
         """
         Handle a report that we received from the VEN.
         """
+        if self.report_queue is not None:
+            # Check that the whole message fits in the queue, before anything is handled
+            batches = []
+            for report in payload['reports']:
+                route = self.report_routes.get(report['report_request_id'])
+                if route is not None:
+                    batches.extend(self.report_queue.make_batches(report['report_request_id'],
+                                                                  _report_records(report), route))
+            try:
+                await self.report_queue.put_batches(batches)
+            except self.report_queue.reject_error:
+                queue = self.report_queue
+                logger.warning(f"Report queue full, rejected the oadrUpdateReport from VEN {payload.get('ven_id')} "
+                               f"(batches {len(batches)}, depth {queue.depth}/{queue.max_size}, "
+                               f"received {queue.received}, delivered {queue.delivered}, "
+                               f"dropped {queue.dropped}, rejected {queue.rejected}).")
+                raise
+
         for report in payload['reports']:
             report_request_id = report['report_request_id']
-            if not self.report_callbacks:
+            route = self.report_routes.get(report_request_id)
+            if route is None and self.mailbox is not None \
+                    and self.mailbox.send(f'report/{report_request_id}', 'report_values',
+                                          report_request_id, list(_report_records(report))):
+                # The callbacks for this report are in another worker process
+                continue
+            if route is None:
+                # We have no callbacks for this report, so we pass it to the default handler
                 result = self.on_update_report(report)
                 if iscoroutine(result):
                     result = await result
-                continue
-            for r_id, values in utils.group_by(report['intervals'], 'report_payload.r_id').items():
-                # Find the callback that was registered.
-                if (report_request_id, r_id) in self.report_callbacks:
-                    # Collect the values
-                    values = [(ri['dtstart'], ri['report_payload']['value']) for ri in values]
-                    # Call the callback function to deliver the values
-                    result = self.report_callbacks[(report_request_id, r_id)](values)
-                    if iscoroutine(result):
-                        result = await result
+            elif self.report_queue is None:
+                await self._deliver_report_values(route, _report_records(report))
 
         response_type = 'oadrUpdatedReport'
         response_payload = {}
         return response_type, response_payload
 
+    async def _receive_report_values(self, report_request_id, records):
+        """
+        Deliver the values of a report that another worker process received.
+        """
+        route = self.report_routes.get(report_request_id)
+        if route is None:
+            return
+        if self.report_queue is None:
+            await self._deliver_report_values(route, records)
+            return
+        try:
+            await self.report_queue.put(report_request_id, records, route)
+        except errors.ProtocolError:
+            # The worker that received the report has already responded to the VEN
+            pass
+
+    async def _deliver_report_values(self, route, records):
+        """
+        Deliver the (r_id, dtstart, value) records from a report to the callbacks in its
+        routing table. The values are collected per r_id, and delivered once the report
+        has been read, or each time report_chunk_size values have been collected.
+        """
+        chunk_size = self.report_chunk_size
+        values = {}
+        for r_id, dtstart, value in records:
+            r_values = values.get(r_id)
+            if r_values is None:
+                if r_id not in route:
+                    # We did not request the values for this r_id
+                    continue
+                r_values = values[r_id] = []
+            r_values.append((dtstart, value))
+            if chunk_size and len(r_values) >= chunk_size:
+                del values[r_id]
+                await utils.await_if_required(route[r_id](r_values))
+        for r_id, r_values in values.items():
+            # Call the callback function to deliver the values
+            await utils.await_if_required(route[r_id](r_values))
+
     async def on_update_report(self, payload):
         """
         Placeholder for the on_update_report handler.
@@ -298,3 +460,64 @@ class ReportService(VTNService):
                         "your VTN-provided reports, but you are not handling that yet.")
         else:
             await utils.await_if_required(self.on_registered_report(payload))
+
+
+def _report_records(report):
+    """
+    Get the (r_id, dtstart, value) records of a report, either as they were streamed from
+    the XML or from its parsed intervals.
+    """
+    if 'interval_values' in report:
+        return report.pop('interval_values')
+    return ((ri['report_payload']['r_id'], ri['dtstart'], ri['report_payload']['value'])
+            for ri in report.get('intervals', []))
+
+
+def _hash_reports(reports):
+    """
+    Return a hash of the contents of the METADATA reports that a VEN registers, leaving out
+    the parts that change every time the reports are sent.
+    """
+    digest = hashlib.sha256()
+    for report in reports:
+        digest.update(repr(sorted((key, value) for key, value in report.items()
+                                  if key not in ('created_date_time', 'report_id'))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ReportCallbacks(MutableMapping):
+    """
+    A view of the report routing tables as a dict of callbacks by
+    (report_request_id, r_id).
+    """
+
+    def __init__(self, routes):
+        self._routes = routes
+
+    def __getitem__(self, key):
+        report_request_id, r_id = key
+        try:
+            return self._routes[report_request_id][r_id]
+        except KeyError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, callback):
+        report_request_id, r_id = key
+        self._routes.setdefault(report_request_id, {})[r_id] = callback
+
+    def __delitem__(self, key):
+        report_request_id, r_id = key
+        route = self._routes.get(report_request_id, {})
+        if r_id not in route:
+            raise KeyError(key)
+        del route[r_id]
+        if not route:
+            del self._routes[report_request_id]
+
+    def __iter__(self):
+        for report_request_id, route in list(self._routes.items()):
+            for r_id in list(route):
+                yield (report_request_id, r_id)
+
+    def __len__(self):
+        return sum(len(route) for route in self._routes.values())
@@ -15,6 +15,7 @@
 # limitations under the License.
 
 from asyncio import iscoroutine
+from functools import partial
 from http import HTTPStatus
 import logging
 import traceback
@@ -24,7 +25,8 @@ from lxml.etree import XMLSyntaxError
 from signxml.exceptions import InvalidSignature
 
 from openleadr import enums, errors, hooks, utils
-from openleadr.messaging import parse_message, validate_xml_schema, authenticate_message
+from openleadr.messaging import parse_message_tree, parse_xml, validate_xml_schema, validate_xml_tree, \
+    authenticate_message
 
 from dataclasses import is_dataclass, asdict
 
@@ -34,6 +36,11 @@ logger = logging.getLogger('openleadr')
 class VTNService:
 
     verify_message_signatures = True
+    signing_pool = None
+    verification_pool = None
+    validation_policy = None
+    lookup_cache = None
+    admission_controller = None
 
     def __init__(self, vtn_id):
         self.vtn_id = vtn_id
@@ -46,6 +53,7 @@ class VTNService:
         """
         Handle all incoming POST requests.
         """
+        admitted = False
         try:
             # Check the Content-Type header
             content_type = request.headers.get('content-type', '')
@@ -56,15 +64,37 @@ class VTNService:
             content = await request.read()
             hooks.call('before_parse', content)
 
-            # Validate the message to the XML Schema
-            message_tree = validate_xml_schema(content)
+            # Validate the message to the XML Schema. The validation policy may only skip
+            # the validation for authenticated VENs, so messages that will be authenticated
+            # are validated after the authentication.
+            deferred_validation = self.validation_policy is not None and request.secure \
+                and (hasattr(self, 'fingerprint_lookup') or hasattr(self, 'ven_lookup'))
+            if deferred_validation:
+                message_tree = parse_xml(content)
+            else:
+                message_tree = validate_xml_schema(content)
 
-            # Parse the message to a type and payload dict
-            message_type, message_payload = parse_message(content)
+            # Parse the message tree to a type and payload dict
+            try:
+                message_type, message_payload = self.parse_message(message_tree)
+            except Exception:
+                if deferred_validation:
+                    # Report the validation error if the message could not be parsed
+                    validate_xml_tree(message_tree)
+                raise
 
             if message_type == 'oadrResponse':
+                if deferred_validation:
+                    # The validation policy applies to every message type
+                    await self._authenticate(request, message_tree, message_payload, {}, deferred_validation)
                 raise errors.SendEmptyHTTPResponse()
 
+            # Shed the request if the VTN is too busy
+            if self.admission_controller is not None:
+                if not self.admission_controller.admit(self.__service_name__):
+                    raise errors.RequestShed(message_type, message_payload)
+                admitted = True
+
             if 'vtn_id' in message_payload \
                     and message_payload['vtn_id'] is not None \
                     and message_payload['vtn_id'] != self.vtn_id:
@@ -72,26 +102,15 @@ class VTNService:
                                             f"you supplied {message_payload['vtn_id']}.")
 
             # Check if we know this VEN, ask for reregistration otherwise
+            lookups = {}    # The lookup results for this request, so that each lookup is done once
             if message_type not in ('oadrCreatePartyRegistration', 'oadrQueryRegistration') \
                     and 'ven_id' in message_payload and hasattr(self, 'ven_lookup'):
-                result = await utils.await_if_required(self.ven_lookup(ven_id=message_payload['ven_id']))
+                result = await self._lookup('ven_lookup', message_payload['ven_id'], lookups)
                 if result is None or result.get('registration_id', None) is None:
                     raise errors.RequestReregistration(message_payload['ven_id'])
 
-            # Authenticate the message
-            if request.secure and 'ven_id' in message_payload:
-                if hasattr(self, 'fingerprint_lookup'):
-                    await authenticate_message(request, message_tree, message_payload,
-                                               fingerprint_lookup=self.fingerprint_lookup,
-                                               verify_message_signature=self.verify_message_signatures)
-                elif hasattr(self, 'ven_lookup'):
-                    await authenticate_message(request, message_tree, message_payload,
-                                               ven_lookup=self.ven_lookup,
-                                               verify_message_signature=self.verify_message_signatures)
-                else:
-                    logger.error("Could not authenticate this VEN because "
-                                 "you did not provide a 'ven_lookup' function. Please see "
-                                 "https://openleadr.org/docs/server.html#signing-messages for info.")
+            # Authenticate the message, and validate it if that was deferred
+            await self._authenticate(request, message_tree, message_payload, lookups, deferred_validation)
 
             # Pass the message off to the handler and get the response type and payload
             try:
@@ -100,6 +119,10 @@ class VTNService:
                     message_payload['fingerprint'] = utils.get_cert_fingerprint_from_request(request)
                 response_type, response_payload = await self.handle_message(message_type,
                                                                             message_payload)
+            except errors.ProtocolError:
+                # An OpenADR error response, for instance for a report that didn't fit in the
+                # report queue, and not an error in the handler
+                raise
             except Exception as err:
                 logger.error("An exception occurred during the execution of your "
                              f"{self.__class__.__name__} handler: "
@@ -116,7 +139,13 @@ class VTNService:
         except errors.RequestReregistration as err:
             response_type = 'oadrRequestReregistration'
             response_payload = {'ven_id': err.ven_id}
-            msg = self._create_message(response_type, **response_payload)
+            msg = await self._create_message_async(response_type, **response_payload)
+            response = web.Response(text=msg,
+                                    status=HTTPStatus.OK,
+                                    content_type='application/xml')
+        except errors.RequestShed as err:
+            response_type, response_payload = self.shed_response(err.message_type, err.message_payload)
+            msg = await self._create_message_async(response_type, **response_payload)
             response = web.Response(text=msg,
                                     status=HTTPStatus.OK,
                                     content_type='application/xml')
@@ -129,7 +158,7 @@ class VTNService:
             response_type, response_payload = self.error_response(message_type,
                                                                   err.response_code,
                                                                   err.response_description)
-            msg = self._create_message(response_type, **response_payload)
+            msg = await self._create_message_async(response_type, **response_payload)
             response = web.Response(text=msg,
                                     status=HTTPStatus.OK,
                                     content_type='application/xml')
@@ -156,13 +185,77 @@ class VTNService:
             response = web.Response(status=HTTPStatus.INTERNAL_SERVER_ERROR)
         else:
             # We've successfully handled this message
-            msg = self._create_message(response_type, **response_payload)
+            msg = await self._create_message_async(response_type, **response_payload)
             response = web.Response(text=msg,
                                     status=HTTPStatus.OK,
                                     content_type='application/xml')
+        finally:
+            if admitted:
+                self.admission_controller.release()
         hooks.call('before_respond', response.text)
         return response
 
+    def parse_message(self, message_tree):
+        """
+        Distill the message type and payload from the validated message tree.
+        """
+        return parse_message_tree(message_tree)
+
+    async def _lookup(self, name, ven_id, lookups):
+        """
+        Call the ven_lookup or fingerprint_lookup for a VEN, at most once per request,
+        and through the lookup cache if there is one.
+        """
+        if (name, ven_id) not in lookups:
+            lookup = getattr(self, name)
+            if name == 'ven_lookup':
+                lookup = partial(_call_with_ven_id, lookup)
+            if self.lookup_cache is None:
+                lookups[(name, ven_id)] = await utils.await_if_required(lookup(ven_id))
+            else:
+                lookups[(name, ven_id)] = await self.lookup_cache.get(name, ven_id, lookup)
+        return lookups[(name, ven_id)]
+
+    async def _authenticate(self, request, message_tree, message_payload, lookups, deferred_validation):
+        """
+        Authenticate the sender of the message, if the request came in over TLS. If the
+        validation was deferred, validate the message afterwards: with the validation
+        policy if the sender was authenticated, and always otherwise.
+        """
+        authenticated = False
+        if request.secure and 'ven_id' in message_payload:
+            if hasattr(self, 'fingerprint_lookup'):
+                await authenticate_message(request, message_tree, message_payload,
+                                           fingerprint_lookup=partial(self._lookup, 'fingerprint_lookup',
+                                                                      lookups=lookups),
+                                           verify_message_signature=self.verify_message_signatures,
+                                           verification_pool=self.verification_pool)
+                authenticated = True
+            elif hasattr(self, 'ven_lookup'):
+                await authenticate_message(request, message_tree, message_payload,
+                                           ven_lookup=partial(self._lookup, 'ven_lookup', lookups=lookups),
+                                           verify_message_signature=self.verify_message_signatures,
+                                           verification_pool=self.verification_pool)
+                authenticated = True
+            else:
+                logger.error("Could not authenticate this VEN because "
+                             "you did not provide a 'ven_lookup' function. Please see "
+                             "https://openleadr.org/docs/server.html#signing-messages for info.")
+
+        if deferred_validation:
+            if authenticated:
+                validate_xml_tree(message_tree, self.validation_policy, message_payload['ven_id'])
+            else:
+                validate_xml_tree(message_tree)
+
+    async def _create_message_async(self, message_type, **message_payload):
+        """
+        Create the response message, using the signing pool if one is configured.
+        """
+        if self.signing_pool is None:
+            return self._create_message(message_type, **message_payload)
+        return await self.signing_pool.run(self._create_message, message_type, **message_payload)
+
     async def handle_message(self, message_type, message_payload):
         hooks.call('before_handle', message_type, message_payload)
         if message_type in self.handlers:
@@ -194,10 +287,29 @@ class VTNService:
                                                                   "A message of type "
                                                                   f"{message_type} should not be "
                                                                   f"sent to this endpoint ({self.__service_name__})")
-        logger.info(f"Responding to {message_type} with a {response_type} message: {response_payload}.")
-        hooks.call('after_handle', response_type, response_payload)
+        if '_rendered_events' in response_payload:
+            # The pre-rendered events are only meant for the template
+            visible_payload = {key: value for key, value in response_payload.items() if key != '_rendered_events'}
+        else:
+            visible_payload = response_payload
+        logger.info(f"Responding to {message_type} with a {response_type} message: {visible_payload}.")
+        hooks.call('after_handle', response_type, visible_payload)
         return response_type, response_payload
 
+    def shed_response(self, message_type, message_payload):
+        """
+        The response to a request that was shed by the admission controller. This is an
+        oadrResponse with the shed error; services override this for the message types
+        that expect a different response.
+        """
+        error = self.admission_controller.shed_error()
+        response_payload = {'response': {'response_code': error.response_code,
+                                         'response_description': error.response_description,
+                                         'request_id': message_payload.get('request_id')},
+                            'vtn_id': self.vtn_id,
+                            'ven_id': message_payload.get('ven_id')}
+        return 'oadrResponse', response_payload
+
     def error_response(self, message_type, error_code, error_description):
         if message_type == 'oadrCreatePartyRegistration':
             response_type = 'oadrCreatedPartyRegistration'
@@ -208,3 +320,7 @@ class VTNService:
         response_payload = {'response': {'response_code': error_code,
                                          'response_description': error_description}}
         return response_type, response_payload
+
+
+def _call_with_ven_id(lookup, ven_id):
+    return lookup(ven_id=ven_id)
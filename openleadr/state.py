@@ -0,0 +1,480 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Backends that keep the state of the VTN, so that it survives a restart.
+
+The state consists of the events for each VEN, the 'events updated' flags for
+polling VENs and the reports that were registered by and requested from each VEN.
+Callbacks can not be stored, so the callbacks for events and reports are only kept
+in memory.
+
+Without a backend, the state is only kept in memory. The SQLiteStateBackend writes
+the changes to a local SQLite database in batches, in the background, so that the
+requests don't wait for the disk. After a restart, the state for a VEN is loaded when
+it is first needed, so that the VENs don't have to register again, and the VTN does
+not have to load the state for all VENs at once. You can implement your own backend
+by subclassing StateBackend.
+
+Multiple VTN processes can share an SQLiteStateBackend database (see openleadr.workers).
+Each process calls refresh regularly to find the keys that were changed by the other
+processes, and the EventStore and StateDicts then load those keys again. Two processes
+can change the same key at the same time. For the namespaces that have a merge function
+(see set_merge), the changes of both processes are then merged, instead of the last
+write replacing the first.
+"""
+
+from collections.abc import MutableMapping
+import asyncio
+import logging
+import pickle
+import sqlite3
+import threading
+
+logger = logging.getLogger('openleadr')
+
+_DELETED = object()
+
+
+class StateBackend:
+    """
+    Base class for state backends. The state is stored as (namespace, key, value)
+    combinations, where the namespace and key are strings and the value is any
+    picklable object.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._merges = {}
+
+    def set_merge(self, namespace, merge):
+        """
+        Merge the changes that two processes make to the same key in this namespace. The
+        merge function is called as merge(base, ours, theirs), with the value that this
+        process changed, the value that it wrote, and the value that the other process
+        wrote in the meantime (None for a missing value), and returns the merged value.
+        Backends that can not be shared don't use the merge functions.
+        """
+        self._merges[namespace] = merge
+
+    def subscribe(self, namespace, callback):
+        """
+        Call the callback with the key whenever another process changes a key in this namespace.
+        """
+        self._subscribers.setdefault(namespace, []).append(callback)
+
+    def changes(self):
+        """
+        Get a list of the (namespace, key) combinations that were changed by other processes
+        since the last call. Backends that can not be shared return an empty list.
+        """
+        return []
+
+    def refresh(self):
+        """
+        Notify the subscribers of the keys that were changed by other processes.
+        Returns the number of changed keys.
+        """
+        changes = self.changes()
+        for namespace, key in changes:
+            for callback in self._subscribers.get(namespace, ()):
+                callback(key)
+        return len(changes)
+
+    def load(self, namespace, key):
+        """
+        Get the value that is stored for this key, or None if there is no value.
+        """
+        raise NotImplementedError
+
+    def keys(self, namespace):
+        """
+        Get a list of the keys that have a value in this namespace.
+        """
+        raise NotImplementedError
+
+    def save(self, namespace, key, value):
+        """
+        Store the value for this key. A backend may store the value later, in which
+        case changes that are made to the value in the meantime are stored as well.
+        """
+        raise NotImplementedError
+
+    def delete(self, namespace, key):
+        """
+        Remove the value for this key.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Make sure that all changes are stored.
+        """
+        pass
+
+    async def flush_async(self):
+        """
+        Make sure that all changes are stored, without blocking the event loop.
+        """
+        self.flush()
+
+    def close(self):
+        """
+        Store all changes and release the resources of the backend.
+        """
+        self.flush()
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    Keeps the state in a dict for each namespace. Nothing survives a restart, but the
+    state can be shared by multiple OpenADRServer instances in the same process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._namespaces = {}
+
+    def load(self, namespace, key):
+        return self._namespaces.get(namespace, {}).get(key)
+
+    def keys(self, namespace):
+        return list(self._namespaces.get(namespace, ()))
+
+    def save(self, namespace, key, value):
+        self._namespaces.setdefault(namespace, {})[key] = value
+
+    def delete(self, namespace, key):
+        self._namespaces.get(namespace, {}).pop(key, None)
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Keeps the state in an SQLite database, using write-behind batching: changes are
+    collected in memory and written in a single transaction every flush_interval
+    seconds, or as soon as batch_size changes are waiting. A key that changes several
+    times before it is written is only written once. The values are pickled right before
+    they are written, on the event loop, and the database writes happen in a thread.
+
+    When there is no running event loop, the changes are written when batch_size changes
+    are waiting, or when flush or close is called.
+
+    Every write increments a version number in the database, so that other processes can
+    find the changed keys by their version. Deleted keys are kept as empty rows for this.
+
+    For the namespaces with a merge function, every write is a compare-and-set: if another
+    process wrote the key since this process loaded or wrote it, the changes are merged in
+    the same transaction, and the key is reported by the next refresh so that it is loaded
+    again.
+
+    :param str path: The path to the database file.
+    :param float flush_interval: The maximum time that a change waits before it is written.
+    :param int batch_size: The number of waiting changes that causes an immediate write.
+    :param float timeout: How long to wait for a lock on the database (in seconds).
+    """
+
+    def __init__(self, path, flush_interval=0.5, batch_size=1000, timeout=5):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS state ("
+                                 "namespace TEXT NOT NULL, "
+                                 "key TEXT NOT NULL, "
+                                 "value BLOB, "
+                                 "version INTEGER NOT NULL, "
+                                 "PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS state_by_version ON state (version)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS state_version (version INTEGER NOT NULL)")
+        self._connection.execute("INSERT INTO state_version (version) SELECT 0 "
+                                 "WHERE NOT EXISTS (SELECT * FROM state_version)")
+        self._version = self._connection.execute("SELECT version FROM state_version").fetchone()[0]
+        self._own_versions = set()  # Versions that were written by this process
+        self._lock = threading.Lock()
+        self._pending = {}      # {(namespace, key): value or _DELETED}, not yet pickled
+        self._writing = {}      # {(namespace, key): pickled value or None}, being written
+        self._bases = {}        # {(namespace, key): (version, pickled value)} that our changes are based on
+        self._merged = set()    # Keys that were merged, to be loaded again at the next refresh
+        self._flush_handle = None
+        self._flush_task = None
+        self.writes = 0         # The number of rows that were written
+        self.batches = 0        # The number of transactions that were used to write them
+        self.merges = 0         # The number of concurrent changes that were merged
+
+    def load(self, namespace, key):
+        item = (namespace, key)
+        if item in self._pending:
+            value = self._pending[item]
+            return None if value is _DELETED else value
+        if item in self._writing:
+            value = self._writing[item]
+            return None if value is None else pickle.loads(value)
+        with self._lock:
+            row = self._connection.execute("SELECT value, version FROM state WHERE namespace = ? AND key = ?",
+                                           item).fetchone()
+            if row is not None and namespace in self._merges:
+                self._bases[item] = (row[1], row[0])
+        return None if row is None or row[0] is None else pickle.loads(row[0])
+
+    def keys(self, namespace):
+        with self._lock:
+            keys = {row[0] for row in self._connection.execute("SELECT key FROM state WHERE namespace = ? "
+                                                               "AND value IS NOT NULL", (namespace,))}
+        for changes in (self._writing, self._pending):
+            for (change_namespace, key), value in changes.items():
+                if change_namespace == namespace:
+                    if value is None or value is _DELETED:
+                        keys.discard(key)
+                    else:
+                        keys.add(key)
+        return list(keys)
+
+    def save(self, namespace, key, value):
+        self._pending[(namespace, key)] = value
+        self._schedule_flush()
+
+    def delete(self, namespace, key):
+        self._pending[(namespace, key)] = _DELETED
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+            return
+        if self._flush_task is not None:
+            # The next flush is scheduled when the current one is done
+            return
+        if len(self._pending) >= self.batch_size:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+            self._flush_handle = None
+            self._start_flush(loop)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush, loop)
+
+    def _start_flush(self, loop):
+        self._flush_handle = None
+        self._flush_task = loop.create_task(self._flush_in_background())
+
+    async def _flush_in_background(self):
+        try:
+            await self._write_pending(asyncio.get_running_loop())
+        except Exception as err:
+            logger.error(f"Could not write the VTN state to {self.path}: {err.__class__.__name__}: {err}")
+        finally:
+            self._flush_task = None
+        if self._pending:
+            self._schedule_flush()
+
+    async def _write_pending(self, loop):
+        self._take_pending()
+        try:
+            await loop.run_in_executor(None, self._write, self._writing)
+        finally:
+            self._writing = {}
+
+    def _take_pending(self):
+        self._writing = {item: None if value is _DELETED else pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                         for item, value in self._pending.items()}
+        self._pending = {}
+
+    def _write(self, changes):
+        if not changes:
+            return
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute("UPDATE state_version SET version = version + 1")
+                version = self._connection.execute("SELECT version FROM state_version").fetchone()[0]
+                rows = []
+                bases = {}
+                merged = set()
+                for item, value in changes.items():
+                    if item[0] in self._merges:
+                        value = self._compare_and_set(item, value)
+                        if value is _DELETED:
+                            continue
+                        if value is not changes[item]:
+                            merged.add(item)
+                        bases[item] = (version, value)
+                    rows.append((*item, value, version))
+                self._connection.executemany("INSERT OR REPLACE INTO state (namespace, key, value, version) "
+                                             "VALUES (?, ?, ?, ?)", rows)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+            self._own_versions.add(version)
+            # A merged value is based on the value that this process wrote, until it is
+            # loaded again; the next write of the key is merged again until then
+            for item, base in bases.items():
+                if item not in merged:
+                    self._bases[item] = base
+            self._merged.update(merged)
+            self.writes += len(rows)
+            self.batches += 1
+            self.merges += len(merged)
+
+    def _compare_and_set(self, item, value):
+        """
+        Get the value to write for this key: the value itself if no other process wrote the
+        key since this process loaded it, and the merged value otherwise. Returns _DELETED
+        if there is nothing to write.
+        """
+        row = self._connection.execute("SELECT value, version FROM state WHERE namespace = ? AND key = ?",
+                                       item).fetchone()
+        base_version, base = self._bases.get(item, (None, None))
+        if row is None or row[1] == base_version:
+            return value
+        merged = self._merges[item[0]](_unpickle(base), _unpickle(value), _unpickle(row[0]))
+        if merged is None and row[0] is None:
+            return _DELETED
+        return None if merged is None else pickle.dumps(merged, pickle.HIGHEST_PROTOCOL)
+
+    def changes(self):
+        with self._lock:
+            version = self._connection.execute("SELECT version FROM state_version").fetchone()[0]
+            if version == self._version:
+                return []
+            rows = self._connection.execute("SELECT namespace, key, version FROM state WHERE version > ?",
+                                            (self._version,)).fetchall()
+            own_versions = self._own_versions
+            self._own_versions = {own_version for own_version in own_versions if own_version > version}
+            self._version = version
+            merged = self._merged
+            self._merged = set()
+        # Keys that are still waiting to be written by this process keep their new value
+        changes = [(namespace, key) for namespace, key, row_version in rows
+                   if (row_version not in own_versions or (namespace, key) in merged)
+                   and (namespace, key) not in self._pending]
+        return changes
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._take_pending()
+        try:
+            self._write(self._writing)
+        finally:
+            self._writing = {}
+
+    async def flush_async(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self._write_pending(asyncio.get_running_loop())
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+
+def _unpickle(value):
+    return None if value is None else pickle.loads(value)
+
+
+def merge_dicts(base, ours, theirs):
+    """
+    A merge function for values that are dicts (see StateBackend.set_merge). The items
+    that this process added, changed or removed are applied to the dict of the other
+    process. If both changed the same item, the change of this process is kept.
+    """
+    base = base or {}
+    merged = dict(theirs or {})
+    ours = ours or {}
+    for key, value in ours.items():
+        if key not in base or base[key] != value:
+            merged[key] = value
+    for key in base:
+        if key not in ours:
+            merged.pop(key, None)
+    return merged or None
+
+
+class StateDict(MutableMapping):
+    """
+    A dict that stores its items in a StateBackend. The keys are read from the
+    backend up front, but a value is only loaded when it is first used.
+
+    A value that is changed in place must be assigned again to be stored. A value that
+    is changed by another process is loaded again when it is next used.
+    """
+
+    def __init__(self, backend, namespace):
+        self.backend = backend
+        self.namespace = namespace
+        self._data = {}
+        self._stored = set(backend.keys(namespace))     # Keys that were not loaded yet
+        backend.subscribe(namespace, self.forget)
+
+    def forget(self, key):
+        """
+        Forget the loaded value for this key, so that it is loaded again when it is next used.
+        """
+        self._data.pop(key, None)
+        self._stored.add(key)
+
+    def __getitem__(self, key):
+        if key in self._stored:
+            self._load(key)
+        return self._data[key]
+
+    def _load(self, key):
+        self._stored.discard(key)
+        value = self.backend.load(self.namespace, key)
+        if value is not None:
+            self._data[key] = value
+
+    def __setitem__(self, key, value):
+        self._stored.discard(key)
+        self._data[key] = value
+        self.backend.save(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        if key not in self._stored and key not in self._data:
+            raise KeyError(key)
+        self._stored.discard(key)
+        self._data.pop(key, None)
+        self.backend.delete(self.namespace, key)
+
+    def __contains__(self, key):
+        if key in self._stored:
+            self._load(key)
+        return key in self._data
+
+    def __iter__(self):
+        for key in list(self._stored):
+            self._load(key)
+        return iter(list(self._data))
+
+    def __len__(self):
+        for key in list(self._stored):
+            self._load(key)
+        return len(self._data)
+
+    def __repr__(self):
+        return f"StateDict({self.namespace!r}, {dict(self)!r})"
@@ -25,12 +25,29 @@ import ssl
 import hashlib
 import uuid
 import logging
+import weakref
 
 logger = logging.getLogger('openleadr')
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 DATETIME_FORMAT_NO_MICROSECONDS = "%Y-%m-%dT%H:%M:%SZ"
 
+_INT_REGEX = re.compile(r'^-?\d+$')
+_FLOAT_REGEX = re.compile(r'^-?[\d.]+$')
+
+# Keys that normalize_dict restructures, even if their value is not a dict
+_RESTRUCTURED_KEYS = {'target', 'pending_reports', 'event', 'request_event', 'created_event',
+                      'report_request', 'report', 'specifier_payload', 'report_description',
+                      'event_signal', 'qualified_event_id', 'signal_payload', 'current_value',
+                      'report_payload', 'test_event'}
+
+# Normalized keys for all element names in the schema, filled on first use
+_NORMALIZED_KEYS = {}
+
+# The peer certificate fingerprint for each TLS connection, by its SSL object. An entry
+# is removed when its connection is gone.
+_PEER_FINGERPRINTS = weakref.WeakKeyDictionary()
+
 
 def generate_id(*args, **kwargs):
     """
@@ -39,6 +56,20 @@ def generate_id(*args, **kwargs):
     return str(uuid.uuid4())
 
 
+def generate_ids(count):
+    """
+    Generate a list of identifiers like generate_id does, but faster, by drawing the
+    random bytes for all of them at once. They are random (version 4) UUIDs.
+    """
+    random_bytes = bytearray(os.urandom(16 * count))
+    for i in range(0, 16 * count, 16):
+        random_bytes[i + 6] = (random_bytes[i + 6] & 0x0f) | 0x40   # Version 4
+        random_bytes[i + 8] = (random_bytes[i + 8] & 0x3f) | 0x80   # RFC 4122 variant
+    h = random_bytes.hex()
+    return [f'{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}'
+            for i in range(0, 32 * count, 32)]
+
+
 def flatten_xml(message):
     """
     Flatten the entire XML structure.
@@ -59,26 +90,15 @@ def normalize_dict(ordered_dict):
     """
     if is_dataclass(ordered_dict):
         ordered_dict = asdict(ordered_dict)
-
-    def normalize_key(key):
-        if key.startswith('oadr'):
-            key = key[4:]
-        elif key.startswith('ei'):
-            key = key[2:]
-        # Don't normalize the measurement descriptions
-        if key in enums._MEASUREMENT_NAMESPACES:
-            return key
-        key = re.sub(r'([a-z])([A-Z])', r'\1_\2', key)
-        if '-' in key:
-            key = key.replace('-', '_')
-        return key.lower()
+    if not _NORMALIZED_KEYS:
+        _fill_normalized_keys()
 
     d = {}
     for key, value in ordered_dict.items():
         # Interpret values from the dict
         if key.startswith("@"):
             continue
-        key = normalize_key(key)
+        key = _NORMALIZED_KEYS.get(key) or normalize_key(key)
 
         if isinstance(value, (OrderedDict, dict)):
             d[key] = normalize_dict(value)
@@ -98,9 +118,9 @@ def normalize_dict(ordered_dict):
         elif value in ('true', 'false'):
             d[key] = parse_boolean(value)
         elif isinstance(value, str):
-            if re.match(r'^-?\d+$', value):
+            if _INT_REGEX.match(value):
                 d[key] = int(value)
-            elif re.match(r'^-?[\d.]+$', value):
+            elif _FLOAT_REGEX.match(value):
                 d[key] = float(value)
             else:
                 d[key] = value
@@ -112,6 +132,10 @@ def normalize_dict(ordered_dict):
             d[key[5:]] = d.pop(key)
             key = key[5:]
 
+        # Plain values of regular keys don't need any of the restructuring below
+        if key not in _RESTRUCTURED_KEYS and not isinstance(d[key], dict):
+            continue
+
         # Group all targets as a list of dicts under the key "target"
         if key == 'target':
             targets = d.pop(key)
@@ -266,6 +290,60 @@ def normalize_dict(ordered_dict):
     return d
 
 
+def normalize_value(value):
+    """
+    Interpret a plain string value from a message in the same way as normalize_dict.
+    """
+    if value in ('true', 'false'):
+        return parse_boolean(value)
+    if _INT_REGEX.match(value):
+        return int(value)
+    if _FLOAT_REGEX.match(value):
+        return float(value)
+    return value
+
+
+def normalize_key(key):
+    """
+    Convert an OpenADR element name to the snake_case key used by OpenLEADR.
+    """
+    if key.startswith('oadr'):
+        key = key[4:]
+    elif key.startswith('ei'):
+        key = key[2:]
+    # Don't normalize the measurement descriptions
+    if key in enums._MEASUREMENT_NAMESPACES:
+        return key
+    key = re.sub(r'([a-z])([A-Z])', r'\1_\2', key)
+    if '-' in key:
+        key = key.replace('-', '_')
+    return key.lower()
+
+
+def _schema_element_names():
+    """
+    Collect the names of all elements that are defined in the OpenADR XML Schema.
+    """
+    names = set()
+    schema_dir = os.path.join(os.path.dirname(__file__), 'schema')
+    for filename in os.listdir(schema_dir):
+        if filename.endswith('.xsd'):
+            with open(os.path.join(schema_dir, filename), encoding='utf-8') as file:
+                names.update(re.findall(r'<xsd?:element name="([^"]+)"', file.read()))
+    return names
+
+
+def _fill_normalized_keys():
+    """
+    Pre-compute the normalized key for every element name in the schema. Because
+    normalize_dict is also used on its own output, the normalized keys are included as well.
+    """
+    for name in _schema_element_names():
+        normalized = normalize_key(name)
+        _NORMALIZED_KEYS[name] = normalized
+        _NORMALIZED_KEYS[normalized] = normalize_key(normalized)
+
+
 def parse_datetime(value):
     """
     Parse an ISO8601 datetime into a datetime.datetime object.
@@ -408,7 +486,6 @@ def certificate_domain(cert):
     from cryptography import x509
     from cryptography.hazmat.backends import default_backend
 
-
     if os.path.exists(cert):
         with open(cert) as file:
             cert = file.read()
@@ -524,11 +601,29 @@ def cron_config(interval, randomize_seconds=False):
 
 
 def get_cert_fingerprint_from_request(request):
-    ssl_object = request.transport.get_extra_info('ssl_object')
-    if ssl_object:
-        der_bytes = ssl_object.getpeercert(binary_form=True)
-        if der_bytes:
-            return certificate_fingerprint_from_der(der_bytes)
+    """
+    Get the fingerprint of the client certificate of the TLS connection of this request.
+    The fingerprint is calculated once for each connection, and reused for the next
+    requests on a keep-alive connection.
+    """
+    transport = request.transport
+    if transport is None:
+        return None
+    ssl_object = transport.get_extra_info('ssl_object')
+    if not ssl_object:
+        return None
+    try:
+        return _PEER_FINGERPRINTS[ssl_object]
+    except KeyError:
+        pass
+    der_bytes = ssl_object.getpeercert(binary_form=True)
+    fingerprint = certificate_fingerprint_from_der(der_bytes) if der_bytes else None
+    try:
+        _PEER_FINGERPRINTS[ssl_object] = fingerprint
+    except TypeError:
+        # This SSL object can't be referenced weakly, so the fingerprint is not kept
+        pass
+    return fingerprint
 
 
 def group_targets_by_type(list_of_targets):
@@ -619,8 +714,12 @@ def get_active_period_from_intervals(intervals, as_dict=True):
         return ActivePeriod(dtstart=period_start, duration=period_duration)
 
 
-def determine_event_status(active_period):
-    now = datetime.now(timezone.utc)
+def determine_event_status(active_period, now=None):
+    """
+    Determine the status of an event from its active period, at the given time or now.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
     active_period_start = getmember(active_period, 'dtstart')
     if active_period_start.tzinfo is None:
         active_period_start = active_period_start.astimezone(timezone.utc)
@@ -654,20 +753,13 @@ def getmember(obj, member, missing='_RAISE_'):
     """
     Get a member from a dict or dataclass. Nesting is possible.
     """
-    def getmember_inner(obj, member, missing='_RAISE_'):
-        if is_dataclass(obj):
-            if not missing == '_RAISE_' and not hasattr(obj, member):
-                return missing
-            else:
-                return getattr(obj, member)
-        else:
-            if missing == '_RAISE_':
-                return obj[member]
-            else:
-                return obj.get(member, missing)
-
     for m in member.split("."):
-        obj = getmember_inner(obj, m, missing=missing)
+        if type(obj) is not dict and hasattr(type(obj), '__dataclass_fields__'):
+            obj = getattr(obj, m) if missing == '_RAISE_' else getattr(obj, m, missing)
+        elif missing == '_RAISE_':
+            obj = obj[m]
+        else:
+            obj = obj.get(m, missing)
     return obj
 
 
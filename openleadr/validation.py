@@ -0,0 +1,138 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Policies that decide which incoming messages are validated against the OpenADR XML Schema.
+
+Schema validation is a large part of the cost of handling a message. For messages from known
+VENs that are also authenticated by other means, you might want to validate only a sample of
+the messages, or only the first few messages from each VEN. A ValidationPolicy holds rules
+for this, per message type and per ven_id, and counts the validation failures.
+
+A policy only applies to authenticated messages: on the VTN, to messages from VENs that
+were authenticated by their TLS client certificate, and on the VEN, to messages that are
+signed by the VTN. All other messages are always validated.
+"""
+
+from collections import Counter
+import threading
+
+ALWAYS = 'always'
+SAMPLED = 'sampled'
+FIRST = 'first'
+NEVER = 'never'
+
+
+class ValidationPolicy:
+    """
+    Decides which incoming messages are validated against the XML Schema.
+
+    The rules are looked up in this order: a rule for the message type and ven_id, a rule for
+    the ven_id, a rule for the message type, and finally the default. Messages without a
+    ven_id only match the rules that have no ven_id. After a VEN has sent a message that
+    failed validation, all of its messages are validated.
+    """
+
+    def __init__(self, default=ALWAYS, n=None):
+        """
+        :param str default: The mode for messages that no rule applies to.
+        :param int n: The sampling interval or number of messages for the default mode.
+        """
+        self.rules = {}
+        self.default = self._make_rule(default, n)
+        self.validated = Counter()          # Validated messages, by message type
+        self.skipped = Counter()            # Messages that were not validated, by message type
+        self.failures = Counter()           # Failed validations, by (message type, ven_id)
+        self._seen = Counter()              # Messages seen, by (rule, ven_id)
+        self._failed_vens = set()
+        self._lock = threading.Lock()
+
+    def set_rule(self, mode, n=None, message_type=None, ven_id=None):
+        """
+        Set the validation mode for a message type, a ven_id, or both.
+
+        :param str mode: One of 'always', 'sampled' (validate 1 in n messages), 'first'
+                         (validate the first n messages) or 'never'.
+        :param int n: The sampling interval for 'sampled', or the number of messages for 'first'.
+        :param str message_type: The message type that the rule applies to, or None for all.
+        :param str ven_id: The ven_id that the rule applies to, or None for all.
+        """
+        if message_type is None and ven_id is None:
+            self.default = self._make_rule(mode, n)
+        else:
+            self.rules[(message_type, ven_id)] = self._make_rule(mode, n)
+
+    def remove_rule(self, message_type=None, ven_id=None):
+        """
+        Remove a rule that was set with set_rule.
+        """
+        self.rules.pop((message_type, ven_id), None)
+
+    def should_validate(self, message_type, ven_id=None):
+        """
+        Decide whether this message should be validated. Returns a bool. The ven_id must be
+        the authenticated ven_id of the sender, not a ven_id read from an unvalidated message.
+        """
+        key = self._find_rule(message_type, ven_id)
+        mode, n = self.rules.get(key, self.default)
+        with self._lock:
+            if ven_id in self._failed_vens:
+                result = True
+            elif mode == ALWAYS:
+                result = True
+            elif mode == NEVER:
+                result = False
+            else:
+                # Count messages per VEN, for the rule that applies to them
+                self._seen[(key, ven_id)] += 1
+                count = self._seen[(key, ven_id)]
+                if mode == SAMPLED:
+                    result = count % n == 1 or n == 1
+                else:
+                    result = count <= n
+            if result:
+                self.validated[message_type] += 1
+            else:
+                self.skipped[message_type] += 1
+        return result
+
+    def record_failure(self, message_type, ven_id=None):
+        """
+        Count a failed validation. All further messages from this VEN will be validated.
+        """
+        with self._lock:
+            self.failures[(message_type, ven_id)] += 1
+            if ven_id is not None:
+                self._failed_vens.add(ven_id)
+
+    def _find_rule(self, message_type, ven_id):
+        if ven_id is not None:
+            if (message_type, ven_id) in self.rules:
+                return (message_type, ven_id)
+            if (None, ven_id) in self.rules:
+                return (None, ven_id)
+        if (message_type, None) in self.rules:
+            return (message_type, None)
+        return None
+
+    @staticmethod
+    def _make_rule(mode, n):
+        if mode not in (ALWAYS, SAMPLED, FIRST, NEVER):
+            raise ValueError(f"The validation mode must be one of '{ALWAYS}', '{SAMPLED}', "
+                             f"'{FIRST}' or '{NEVER}', not '{mode}'.")
+        if mode in (SAMPLED, FIRST) and (not isinstance(n, int) or n < 1):
+            raise ValueError(f"The validation mode '{mode}' requires a positive integer n.")
+        return (mode, n)
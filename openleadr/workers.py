@@ -0,0 +1,181 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Run a VTN in multiple worker processes that share a single port.
+
+Each worker creates its own OpenADRServer, and the operating system divides the incoming
+connections between the workers (using SO_REUSEPORT), so that parsing, validating,
+signing and verifying the XML messages can use all CPU cores. The workers share their
+state through an openleadr.state.SQLiteStateBackend on the same database file, and
+their replay protection through an openleadr.replay.SQLiteNonceStore.
+
+The first worker (worker_id 0) keeps the event statuses up to date and delivers the
+messages to push-mode VENs, so add your events from that worker. Every worker writes the
+changes that it makes to the events to the shared state; changes that two workers make
+at the same time are merged. Callbacks stay in the worker that added them: a worker that
+receives the response to an event, or a report, for a callback in another worker passes
+it on through the WorkerMailbox. A worker refuses to start with a nonce store that is only
+kept in its own memory, because the next message from a VEN can reach another worker.
+SO_REUSEPORT is not available on Windows.
+"""
+
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import os
+import signal
+
+from openleadr import utils
+from openleadr.state import StateDict
+
+logger = logging.getLogger('openleadr')
+
+
+class WorkerMailbox:
+    """
+    Passes messages to the worker process that holds a callback, through the shared state
+    backend. A worker claims the keys of its callbacks, and the other workers send the
+    messages for those keys to it. The messages are picked up when the state is refreshed.
+
+    :param StateBackend backend: The state backend that the workers share.
+    :param int worker_id: The worker_id of this worker.
+    """
+
+    def __init__(self, backend, worker_id):
+        self.backend = backend
+        self.worker_id = worker_id
+        self.handlers = {}      # {kind: function that handles the messages of this kind}
+        self.owners = StateDict(backend, 'callback_owners')
+        backend.subscribe('mailbox', self._receive)
+
+    def claim(self, key):
+        """
+        Receive the messages for this key in this worker.
+        """
+        if self.owners.get(key) != self.worker_id:
+            self.owners[key] = self.worker_id
+
+    def release(self, key):
+        """
+        Stop receiving the messages for this key.
+        """
+        if self.owners.get(key) == self.worker_id:
+            del self.owners[key]
+
+    def send(self, key, kind, *args):
+        """
+        Send a message to the worker that claimed this key. Returns False if no other
+        worker claimed it.
+        """
+        owner = self.owners.get(key)
+        if owner is None or owner == self.worker_id:
+            return False
+        self.backend.save('mailbox', f'{owner}/{utils.generate_id()}', (kind, args))
+        return True
+
+    def _receive(self, key):
+        if not key.startswith(f'{self.worker_id}/'):
+            return
+        message = self.backend.load('mailbox', key)
+        if message is None:
+            return
+        self.backend.delete('mailbox', key)
+        kind, args = message
+        try:
+            result = self.handlers[kind](*args)
+        except Exception as err:
+            logger.error(f"Could not handle the {kind} message from another worker: "
+                         f"{err.__class__.__name__}: {err}")
+            return
+        if inspect.isawaitable(result):
+            asyncio.ensure_future(result)
+
+
+def start_workers(create_server, workers=None):
+    """
+    Start the worker processes, and return the list of multiprocessing.Process objects.
+
+    :param callable create_server: A function that receives the worker_id (0 for the first
+                                   worker) and returns a configured OpenADRServer (or a
+                                   coroutine that does). It is called in the worker process,
+                                   so it must be importable, for instance a module-level function.
+    :param int workers: The number of worker processes. Defaults to the number of CPU cores.
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for worker_id in range(workers or os.cpu_count()):
+        process = context.Process(target=_run_worker, args=(create_server, worker_id),
+                                  name=f'openleadr-worker-{worker_id}')
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_workers(processes, timeout=10):
+    """
+    Stop the worker processes gracefully, and wait for them to exit.
+    """
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+def run_workers(create_server, workers=None):
+    """
+    Run the VTN in multiple worker processes until it is interrupted. Call this from
+    the ``if __name__ == '__main__':`` block of your script.
+
+    :param callable create_server: A function that receives the worker_id and returns an
+                                   OpenADRServer, see start_workers.
+    :param int workers: The number of worker processes. Defaults to the number of CPU cores.
+    """
+    processes = start_workers(create_server, workers)
+    try:
+        for process in processes:
+            process.join()
+            if process.exitcode:
+                logger.error(f"Worker {process.name} exited with exit code {process.exitcode}.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_workers(processes)
+
+
+def _run_worker(create_server, worker_id):
+    asyncio.run(_serve(create_server, worker_id))
+
+
+async def _serve(create_server, worker_id):
+    server = create_server(worker_id)
+    if inspect.isawaitable(server):
+        server = await server
+    server.worker_id = worker_id
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    await server.run()
+    await stopped.wait()
+    await server.stop()
+    if server.state_backend is not None:
+        server.state_backend.close()
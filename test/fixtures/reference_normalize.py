@@ -0,0 +1,228 @@
+
+"""
+The normalize_dict function as it was before its key table and restructuring
+shortcuts were added, kept unchanged so that the current implementation can be
+compared against it.
+"""
+
+from dataclasses import is_dataclass, asdict
+from collections import OrderedDict
+from openleadr import enums
+from openleadr.utils import parse_duration, parse_datetime, parse_boolean, group_targets_by_type
+import re
+
+
+def reference_normalize_dict(ordered_dict):
+    """
+    Main conversion function for the output of xmltodict to the OpenLEADR
+    representation of OpenADR contents.
+
+    :param ordered_dict dict: The OrderedDict, dict or dataclass that you wish to convert.
+    """
+    if is_dataclass(ordered_dict):
+        ordered_dict = asdict(ordered_dict)
+
+    def normalize_key(key):
+        if key.startswith('oadr'):
+            key = key[4:]
+        elif key.startswith('ei'):
+            key = key[2:]
+        # Don't normalize the measurement descriptions
+        if key in enums._MEASUREMENT_NAMESPACES:
+            return key
+        key = re.sub(r'([a-z])([A-Z])', r'\1_\2', key)
+        if '-' in key:
+            key = key.replace('-', '_')
+        return key.lower()
+
+    d = {}
+    for key, value in ordered_dict.items():
+        # Interpret values from the dict
+        if key.startswith("@"):
+            continue
+        key = normalize_key(key)
+
+        if isinstance(value, (OrderedDict, dict)):
+            d[key] = reference_normalize_dict(value)
+
+        elif isinstance(value, list):
+            d[key] = []
+            for item in value:
+                if isinstance(item, (OrderedDict, dict)):
+                    dict_item = reference_normalize_dict(item)
+                    d[key].append(reference_normalize_dict(dict_item))
+                else:
+                    d[key].append(item)
+        elif key in ("duration", "startafter", "max_period", "min_period"):
+            d[key] = parse_duration(value)
+        elif ("date_time" in key or key == "dtstart") and isinstance(value, str):
+            d[key] = parse_datetime(value)
+        elif value in ('true', 'false'):
+            d[key] = parse_boolean(value)
+        elif isinstance(value, str):
+            if re.match(r'^-?\d+$', value):
+                d[key] = int(value)
+            elif re.match(r'^-?[\d.]+$', value):
+                d[key] = float(value)
+            else:
+                d[key] = value
+        else:
+            d[key] = value
+
+        # Do our best to make the dictionary structure as pythonic as possible
+        if key.startswith("x_ei_"):
+            d[key[5:]] = d.pop(key)
+            key = key[5:]
+
+        # Group all targets as a list of dicts under the key "target"
+        if key == 'target':
+            targets = d.pop(key)
+            new_targets = []
+            if targets:
+                for ikey in targets:
+                    if isinstance(targets[ikey], list):
+                        new_targets.extend([{ikey: value} for value in targets[ikey]])
+                    else:
+                        new_targets.append({ikey: targets[ikey]})
+            d[key + "s"] = new_targets
+            key = key + "s"
+
+            # Also add a targets_by_type element to this dict
+            # to access the targets in a more convenient way.
+            d['targets_by_type'] = group_targets_by_type(new_targets)
+
+        # Group all reports as a list of dicts under the key "pending_reports"
+        if key == "pending_reports":
+            # If there are pending reports, turn them into a list of dicts,
+            # each with a single 'report_request_id' key.
+            if isinstance(d[key], dict) and 'report_request_id' in d[key]:
+
+                # If there is only one report_request_id, make sure it is
+                # turned into a list before further processing.
+                if not isinstance(d[key]['report_request_id'], list):
+                    d[key]['report_request_id'] = [d[key]['report_request_id']]
+
+                # When collecting the report_request_ids, make sure even numeric
+                # ids get turned into strings.
+                d[key] = [{'report_request_id': str(rrid)}
+                          for rrid in d[key]['report_request_id']
+                          if d[key]['report_request_id'] is not None]
+
+            # If there are no pending reports, make sure we get an empty list back
+            # so any iteration can proceed as normal.
+            elif d[key] is None:
+                d[key] = []
+
+        # Group all events al a list of dicts under the key "events"
+        elif key == "event" and isinstance(d[key], list):
+            events = d.pop("event")
+            new_events = []
+            for event in events:
+                new_event = event['event']
+                new_event['response_required'] = event['response_required']
+                new_events.append(new_event)
+            d["events"] = new_events
+
+        # If there's only one event, also put it into a list
+        elif key == "event" and isinstance(d[key], dict) and "event" in d[key]:
+            oadr_event = d.pop('event')
+            ei_event = oadr_event['event']
+            ei_event['response_required'] = oadr_event['response_required']
+            d['events'] = [ei_event]
+
+        elif key in ("request_event", "created_event") and isinstance(d[key], dict):
+            d = d[key]
+
+        # Plurarize some lists
+        elif key in ('report_request', 'report', 'specifier_payload'):
+            if isinstance(d[key], list):
+                d[key + 's'] = d.pop(key)
+            else:
+                d[key + 's'] = [d.pop(key)]
+
+        elif key in ('report_description', 'event_signal'):
+            descriptions = d.pop(key)
+            if not isinstance(descriptions, list):
+                descriptions = [descriptions]
+            for description in descriptions:
+                # We want to make the identification of the measurement universal
+                for measurement in enums._MEASUREMENT_NAMESPACES:
+                    if measurement in description:
+                        name, item = measurement, description.pop(measurement)
+                        break
+                else:
+                    break
+                item['description'] = item.pop('item_description', None)
+                item['unit'] = item.pop('item_units', None)
+                if 'si_scale_code' in item:
+                    item['scale'] = item.pop('si_scale_code')
+                if 'pulse_factor' in item:
+                    item['pulse_factor'] = item.pop('pulse_factor')
+                description['measurement'] = {'name': name,
+                                              **item}
+            d[key + 's'] = descriptions
+
+        # Promote the contents of the Qualified Event ID
+        elif key == "qualified_event_id" and isinstance(d['qualified_event_id'], dict):
+            qeid = d.pop('qualified_event_id')
+            d['event_id'] = qeid['event_id']
+            d['modification_number'] = qeid['modification_number']
+
+        # Durations are encapsulated in their own object, remove this nesting
+        elif isinstance(d[key], dict) and "duration" in d[key] and len(d[key]) == 1:
+            d[key] = d[key]["duration"]
+
+        # In general, remove all double nesting
+        elif isinstance(d[key], dict) and key in d[key] and len(d[key]) == 1:
+            d[key] = d[key][key]
+
+        # In general, remove the double nesting of lists of items
+        elif isinstance(d[key], dict) and key[:-1] in d[key] and len(d[key]) == 1:
+            if isinstance(d[key][key[:-1]], list):
+                d[key] = d[key][key[:-1]]
+            else:
+                d[key] = [d[key][key[:-1]]]
+
+        # Payload values are wrapped in an object according to their type. We don't need that.
+        elif key in ("signal_payload", "current_value"):
+            value = d[key]
+            if isinstance(d[key], dict):
+                if 'payload_float' in d[key] and 'value' in d[key]['payload_float'] \
+                        and d[key]['payload_float']['value'] is not None:
+                    d[key] = float(d[key]['payload_float']['value'])
+                elif 'payload_int' in d[key] and 'value' in d[key]['payload_int'] \
+                        and d[key]['payload_int'] is not None:
+                    d[key] = int(d[key]['payload_int']['value'])
+
+        # Report payloads contain an r_id and a type-wrapped payload_float
+        elif key == 'report_payload':
+            if 'payload_float' in d[key] and 'value' in d[key]['payload_float']:
+                v = d[key].pop('payload_float')
+                d[key]['value'] = float(v['value'])
+            elif 'payload_int' in d[key] and 'value' in d[key]['payload_int']:
+                v = d[key].pop('payload_float')
+                d[key]['value'] = int(v['value'])
+
+        # All values other than 'false' must be interpreted as True for testEvent (rule 006)
+        elif key == 'test_event' and not isinstance(d[key], bool):
+            d[key] = True
+
+        # Promote the 'text' item
+        elif isinstance(d[key], dict) and "text" in d[key] and len(d[key]) == 1:
+            if key == 'uid':
+                d[key] = int(d[key]["text"])
+            else:
+                d[key] = d[key]["text"]
+
+        # Promote a 'date-time' item
+        elif isinstance(d[key], dict) and "date_time" in d[key] and len(d[key]) == 1:
+            d[key] = d[key]["date_time"]
+
+        # Promote 'properties' item, discard the unused? 'components' item
+        elif isinstance(d[key], dict) and "properties" in d[key] and len(d[key]) <= 2:
+            d[key] = d[key]["properties"]
+
+        # Remove all empty dicts
+        elif isinstance(d[key], dict) and len(d[key]) == 0:
+            d.pop(key)
+    return d
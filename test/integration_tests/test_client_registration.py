@@ -16,7 +16,7 @@
 
 from openleadr import OpenADRClient, OpenADRServer, enums
 from openleadr.utils import generate_id, certificate_fingerprint
-from openleadr.messaging import create_message, parse_message
+from openleadr.messaging import create_message, parse_message, SigningPool, VerificationPool
 from datetime import datetime, timezone, timedelta
 
 import asyncio
@@ -96,3 +96,31 @@ async def test_create_party_registration_with_signatures(start_server_with_signa
     assert response_type == 'oadrCreatedPartyRegistration'
     assert response_payload['ven_id'] == VEN_ID
     await client.stop()
+
+@pytest.mark.asyncio
+async def test_create_party_registration_with_signing_pool():
+    server_pool = SigningPool(max_workers=2)
+    verification_pool = VerificationPool(max_workers=2)
+    client_pool = SigningPool(max_workers=1)
+    server = OpenADRServer(vtn_id=VTN_ID, cert=CERTFILE, key=KEYFILE, fingerprint_lookup=fingerprint_lookup,
+                           http_port=SERVER_PORT, signing_pool=server_pool,
+                           verification_pool=verification_pool)
+    server.add_handler('on_create_party_registration', _on_create_party_registration)
+    await server.run_async()
+    with open(CERTFILE) as file:
+        cert = file.read()
+    client = OpenADRClient(ven_name=VEN_NAME,
+                           vtn_url=f"http://localhost:{SERVER_PORT}/OpenADR2/Simple/2.0b",
+                           cert=CERTFILE, key=KEYFILE, ca_file=CAFILE, vtn_fingerprint=certificate_fingerprint(cert),
+                           signing_pool=client_pool)
+
+    response_type, response_payload = await client.create_party_registration()
+    assert response_type == 'oadrCreatedPartyRegistration'
+    assert response_payload['ven_id'] == VEN_ID
+    assert server_pool.queue_depth == 0
+    assert client_pool.queue_depth == 0
+    await client.stop()
+    await server.stop()
+    server_pool.shutdown()
+    verification_pool.shutdown()
+    client_pool.shutdown()
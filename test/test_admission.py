@@ -0,0 +1,137 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+from datetime import timedelta
+
+import aiohttp
+import pytest
+
+from openleadr import OpenADRServer, enums
+from openleadr.admission import AdmissionController
+from openleadr.messaging import create_message, parse_message
+
+VTN_URL = 'http://localhost:8083/OpenADR2/Simple/2.0b'
+
+
+def test_admission_controller_limits(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr('openleadr.admission.time.monotonic', lambda: now[0])
+    controller = AdmissionController(max_concurrency=3, rates={'EiRegisterParty': (1, 2)})
+    assert controller.admit('EiRegisterParty')
+    assert controller.admit('EiRegisterParty')
+    assert not controller.admit('EiRegisterParty')
+    assert controller.admit('OadrPoll')
+    # All three slots are taken
+    assert not controller.admit('OadrPoll')
+    controller.release()
+    assert controller.admit('OadrPoll')
+    now[0] += 1
+    controller.release()
+    assert controller.admit('EiRegisterParty')
+    assert controller.admitted == {'EiRegisterParty': 3, 'OadrPoll': 2}
+    assert controller.shed == {'EiRegisterParty': 1, 'OadrPoll': 1}
+    assert controller.in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_server_sheds_requests():
+    async def post(session, service, message_type, **message_payload):
+        async with session.post(f'{VTN_URL}/{service}', data=create_message(message_type, **message_payload),
+                                headers={'Content-Type': 'application/xml'}) as response:
+            return parse_message(await response.read())
+
+    def on_create_party_registration(registration_info):
+        return 'ven123', 'reg123'
+
+    controller = AdmissionController(rates={'EiRegisterParty': (0.001, 1)}, shed_poll_freq=timedelta(minutes=5))
+    server = OpenADRServer(vtn_id='MYVTN', http_port=8083, http_host='localhost',
+                           admission_controller=controller)
+    server.add_handler('on_create_party_registration', on_create_party_registration)
+    registration = dict(request_id='req123', profile_name='2.0b', transport_name='simpleHttp',
+                        transport_address='http://localhost', report_only=False, xml_signature=False,
+                        ven_name='ven123', http_pull_model=True)
+    await server.run()
+    try:
+        async with aiohttp.ClientSession() as session:
+            message_type, message_payload = await post(session, 'EiRegisterParty',
+                                                       'oadrCreatePartyRegistration', **registration)
+            assert message_type == 'oadrCreatedPartyRegistration'
+            assert message_payload['response']['response_code'] == 200
+            assert message_payload['ven_id'] == 'ven123'
+
+            message_type, message_payload = await post(session, 'EiRegisterParty',
+                                                       'oadrCreatePartyRegistration', **registration)
+            assert message_type == 'oadrCreatedPartyRegistration'
+            assert message_payload['response']['response_code'] == \
+                enums.STATUS_CODES.DEPLOYMENT_ERROR_OR_OTHER_ERROR
+            assert message_payload['response']['request_id'] == 'req123'
+            assert message_payload['requested_oadr_poll_freq'] == timedelta(minutes=5)
+
+            # Other services are not limited
+            message_type, message_payload = await post(session, 'OadrPoll', 'oadrPoll', ven_id='ven123')
+            assert message_type == 'oadrResponse'
+            assert message_payload['response']['response_code'] == 200
+    finally:
+        await server.stop()
+    assert controller.admitted == {'EiRegisterParty': 1, 'OadrPoll': 1}
+    assert controller.shed == {'EiRegisterParty': 1}
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_server_sheds_event_and_report_requests():
+    async def post(session, service, message_type, **message_payload):
+        async with session.post(f'{VTN_URL}/{service}', data=create_message(message_type, **message_payload),
+                                headers={'Content-Type': 'application/xml'}) as response:
+            assert response.status == 200
+            return parse_message(await response.read())
+
+    controller = AdmissionController(rates={'EiEvent': (0, 0), 'EiReport': (0, 0)})
+    server = OpenADRServer(vtn_id='MYVTN', http_port=8083, http_host='localhost',
+                           admission_controller=controller)
+    await server.run()
+    try:
+        async with aiohttp.ClientSession() as session:
+            message_type, message_payload = await post(session, 'EiEvent', 'oadrRequestEvent',
+                                                       request_id='req123', ven_id='ven123')
+            assert message_type == 'oadrDistributeEvent'
+            assert message_payload['response']['response_code'] == \
+                enums.STATUS_CODES.DEPLOYMENT_ERROR_OR_OTHER_ERROR
+            assert message_payload['response']['request_id'] == 'req123'
+            assert message_payload['request_id'] is not None
+            assert message_payload['vtn_id'] == 'MYVTN'
+            assert message_payload.get('events', []) == []
+
+            message_type, message_payload = await post(session, 'EiReport', 'oadrRegisterReport',
+                                                       request_id='req456', ven_id='ven123', reports=[])
+            assert message_type == 'oadrRegisteredReport'
+            assert message_payload['response']['response_code'] == \
+                enums.STATUS_CODES.DEPLOYMENT_ERROR_OR_OTHER_ERROR
+            assert message_payload['response']['request_id'] == 'req456'
+            assert message_payload['ven_id'] == 'ven123'
+            assert message_payload.get('report_requests', []) == []
+
+            message_type, message_payload = await post(session, 'EiReport', 'oadrUpdateReport',
+                                                       request_id='req789', ven_id='ven123', reports=[])
+            assert message_type == 'oadrUpdatedReport'
+            assert message_payload['response']['response_code'] == \
+                enums.STATUS_CODES.DEPLOYMENT_ERROR_OR_OTHER_ERROR
+            assert message_payload['response']['request_id'] == 'req789'
+    finally:
+        await server.stop()
+    assert controller.shed == {'EiEvent': 1, 'EiReport': 2}
+    assert controller.admitted == {}
+    assert controller.in_flight == 0
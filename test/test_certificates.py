@@ -4,6 +4,7 @@ import os
 from functools import partial
 from openleadr import OpenADRServer, OpenADRClient, enable_default_logging
 from openleadr.utils import certificate_fingerprint
+from openleadr.messaging import VerificationPool
 from openleadr import errors
 from async_timeout import timeout
 
@@ -132,3 +133,38 @@ async def test_ssl_certificates_wrong_fingerprint(caplog):
 
     await client.stop()
     await server.stop()
+
+@pytest.mark.asyncio
+async def test_ssl_certificates_with_verification_pool():
+    loop = asyncio.get_event_loop()
+    registration_future = loop.create_future()
+    verification_pool = VerificationPool(max_workers=2)
+    server = OpenADRServer(vtn_id='myvtn',
+                           http_cert=VTN_CERT,
+                           http_key=VTN_KEY,
+                           http_ca_file=CA_CERT,
+                           cert=VTN_CERT,
+                           key=VTN_KEY,
+                           fingerprint_lookup=lookup_fingerprint,
+                           verification_pool=verification_pool)
+    server.add_handler('on_create_party_registration', partial(on_create_party_registration,
+                                                               future=registration_future))
+    await server.run_async()
+    client = OpenADRClient(ven_name='myven',
+                           vtn_url='https://localhost:8080/OpenADR2/Simple/2.0b',
+                           cert=VEN_CERT,
+                           key=VEN_KEY,
+                           ca_file=CA_CERT,
+                           vtn_fingerprint=vtn_fingerprint)
+    await client.create_party_registration()
+    assert client.registration_id == 'reg5678'
+
+    # The poll carries a ven_id, so its signature is verified in the pool
+    response_type, response_payload = await client.poll()
+    assert response_type == 'oadrResponse'
+    assert response_payload['response']['response_code'] == 200
+    assert verification_pool.in_flight == 0
+
+    await client.stop()
+    await server.stop()
+    verification_pool.shutdown()
@@ -1,4 +1,5 @@
 from openleadr import OpenADRClient, OpenADRServer, enable_default_logging, objects, utils
+from openleadr.messaging import parse_message
 import pytest
 import asyncio
 import datetime
@@ -99,6 +100,43 @@ async def test_request_event():
     await server.stop()
 
 
+@pytest.mark.asyncio
+async def test_rendered_events_stay_out_of_hooks():
+    from openleadr import hooks
+    handled = []
+
+    async def after_handle(response_type, response_payload):
+        handled.append((response_type, response_payload))
+
+    server = OpenADRServer(vtn_id='myvtn')
+    server.add_event(ven_id='ven123',
+                     signal_name='simple',
+                     signal_type='level',
+                     intervals=[{'dtstart': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=1),
+                                 'duration': datetime.timedelta(minutes=10),
+                                 'signal_payload': 1}],
+                     callback=partial(event_callback, future=asyncio.get_event_loop().create_future()))
+    event_service = server.services['event_service']
+    hooks.register('after_handle', after_handle)
+    try:
+        response_type, response_payload = await event_service.handle_message('oadrRequestEvent',
+                                                                             {'ven_id': 'ven123'})
+        await asyncio.sleep(0)
+    finally:
+        hooks.HOOKS['after_handle'].remove(after_handle)
+    assert response_type == 'oadrDistributeEvent'
+    assert isinstance(response_payload['_rendered_events'], str)
+    assert len(handled) == 1
+    hook_type, hook_payload = handled[0]
+    assert hook_type == 'oadrDistributeEvent'
+    assert '_rendered_events' not in hook_payload
+    assert utils.getmember(hook_payload['events'][0], 'event_descriptor.event_id') \
+        == server.events['ven123'][0].event_descriptor.event_id
+    message = event_service._create_message('oadrDistributeEvent', **response_payload)
+    message_type, message_payload = parse_message(message)
+    assert len(message_payload['events']) == 1
+
+
 @pytest.mark.asyncio
 async def test_raw_event():
     now = datetime.datetime.now(datetime.timezone.utc)
@@ -338,6 +376,143 @@ async def test_cancel_event():
     await client.stop()
 
 
+@pytest.mark.asyncio
+async def test_group_event():
+    def on_create_party_registration(registration_info):
+        return registration_info['ven_name'], 'reg' + registration_info['ven_name']
+
+    async def on_update_event(event, future):
+        if future.done() is False:
+            future.set_result(event)
+        return 'optIn'
+
+    responses = []
+    loop = asyncio.get_event_loop()
+    all_responded = loop.create_future()
+
+    def event_callback(ven_id, event_id, opt_type):
+        responses.append((ven_id, opt_type))
+        if len(responses) == 2:
+            all_responded.set_result(True)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    server = OpenADRServer(vtn_id='MYVTN', requested_poll_freq=datetime.timedelta(seconds=1))
+    server.add_handler('on_create_party_registration', on_create_party_registration)
+    event_id = server.add_group_event(ven_ids=['ven123', 'ven456'],
+                                      signal_name='simple',
+                                      signal_type='level',
+                                      intervals=[objects.Interval(dtstart=now + datetime.timedelta(minutes=10),
+                                                                  duration=datetime.timedelta(minutes=10),
+                                                                  signal_payload=1)],
+                                      target={'group_id': 'group1'},
+                                      callback=event_callback)
+    assert server.events['ven123'][0] is server.events['ven456'][0]
+    await server.run()
+
+    clients = []
+    cancel_futures = []
+    for ven_name in ('ven123', 'ven456'):
+        client = OpenADRClient(ven_name=ven_name,
+                               vtn_url='http://localhost:8080/OpenADR2/Simple/2.0b')
+        client.add_handler('on_event', on_event)
+        cancel_future = loop.create_future()
+        client.add_handler('on_update_event', partial(on_update_event, future=cancel_future))
+        cancel_futures.append(cancel_future)
+        clients.append(client)
+        await client.run()
+
+    await asyncio.wait_for(all_responded, 5)
+    assert sorted(responses) == [('ven123', 'optIn'), ('ven456', 'optIn')]
+    delivery_states = server.events.delivery_states(event_id)
+    assert sorted(delivery_states) == ['ven123', 'ven456']
+    for ven_id, state in delivery_states.items():
+        # Modification number 0 of the event was delivered to and acknowledged by both VENs
+        assert state.delivered is not None and state.delivered == 0
+        assert state.acknowledged is not None and state.acknowledged == 0
+        assert state.opt_type == 'optIn'
+
+    server.cancel_group_event(event_id)
+    for cancel_future in cancel_futures:
+        result = await asyncio.wait_for(cancel_future, 5)
+        assert utils.getmember(result, 'event_descriptor.event_status') == 'cancelled'
+        assert utils.getmember(result, 'event_descriptor.modification_number') == 1
+
+    for client in clients:
+        await client.stop()
+    await server.stop()
+
+
+def test_cancel_group_event_without_vens(caplog):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    server = OpenADRServer(vtn_id='MYVTN')
+    intervals = [objects.Interval(dtstart=now + datetime.timedelta(minutes=10),
+                                  duration=datetime.timedelta(minutes=10),
+                                  signal_payload=1)]
+    event_id = server.add_group_event(ven_ids=[], signal_name='simple', signal_type='level',
+                                      intervals=intervals, callback=event_callback)
+    server.cancel_group_event(event_id)
+    assert f"The group event {event_id} is no longer shared by any VENs" in caplog.text
+
+    event_id = server.add_group_event(ven_ids=['ven123', 'ven456'], signal_name='simple', signal_type='level',
+                                      intervals=intervals, callback=event_callback)
+    server.events.detach_event('ven123', event_id)
+    server.cancel_group_event(event_id)
+    event = server.events.get_group_event(event_id)
+    assert utils.getmember(event, 'event_descriptor.event_status') == 'cancelled'
+    assert utils.getmember(event, 'event_descriptor.modification_number') == 1
+    assert utils.getmember(server.events.get_event('ven123', event_id),
+                           'event_descriptor.modification_number') == 0
+
+
+@pytest.mark.asyncio
+async def test_add_events_bulk_poll():
+    def on_create_party_registration(registration_info):
+        return registration_info['ven_name'], 'reg' + registration_info['ven_name']
+
+    responses = []
+    loop = asyncio.get_event_loop()
+    all_responded = loop.create_future()
+
+    def event_callback(ven_id, event_id, opt_type):
+        responses.append((ven_id, event_id, opt_type))
+        if len(responses) == 2:
+            all_responded.set_result(True)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    server = OpenADRServer(vtn_id='MYVTN', requested_poll_freq=datetime.timedelta(seconds=1))
+    server.add_handler('on_create_party_registration', on_create_party_registration)
+    event_ids = server.add_events_bulk(ven_ids=['ven123', 'ven456'],
+                                       signal_name='simple',
+                                       signal_type='level',
+                                       intervals=[objects.Interval(dtstart=now + datetime.timedelta(minutes=10),
+                                                                   duration=datetime.timedelta(minutes=10),
+                                                                   signal_payload=1)],
+                                       callback=event_callback)
+    await server.run()
+
+    received = {}
+    clients = []
+    for ven_name in ('ven123', 'ven456'):
+        client = OpenADRClient(ven_name=ven_name,
+                               vtn_url='http://localhost:8080/OpenADR2/Simple/2.0b')
+        future = loop.create_future()
+        received[ven_name] = future
+        client.add_handler('on_event', partial(on_event_opt_in, future=future))
+        clients.append(client)
+        await client.run()
+
+    await asyncio.wait_for(all_responded, 5)
+    assert sorted(responses) == sorted([('ven123', event_ids[0], 'optIn'), ('ven456', event_ids[1], 'optIn')])
+    for ven_name, event_id in zip(('ven123', 'ven456'), event_ids):
+        event = await asyncio.wait_for(received[ven_name], 5)
+        assert event['event_descriptor']['event_id'] == event_id
+        assert event['targets'] == [{'ven_id': ven_name}]
+
+    for client in clients:
+        await client.stop()
+    await server.stop()
+
+
 @pytest.mark.asyncio
 async def test_event_external_polling_function():
     async def opt_in_to_event(event, future=None):
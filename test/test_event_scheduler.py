@@ -0,0 +1,217 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from openleadr import OpenADRServer, enums, objects
+from openleadr.event_scheduler import EventStatusScheduler, event_transitions
+from openleadr.event_store import EventStore
+
+
+def make_event(event_id, start_in, duration=timedelta(milliseconds=200), ramp_up_period=None, priority=0):
+    now = datetime.now(timezone.utc)
+    return objects.Event(
+        event_descriptor=objects.EventDescriptor(event_id=event_id,
+                                                 modification_number=0,
+                                                 market_context='http://marketcontext01',
+                                                 event_status=enums.EVENT_STATUS.FAR,
+                                                 priority=priority,
+                                                 created_date_time=now),
+        active_period=objects.ActivePeriod(dtstart=now + start_in, duration=duration,
+                                           ramp_up_period=ramp_up_period),
+        event_signals=[objects.EventSignal(signal_name='simple', signal_type='level', signal_id='sig1',
+                                           intervals=[objects.Interval(dtstart=now + start_in,
+                                                                       duration=duration,
+                                                                       signal_payload=1)])],
+        targets=[objects.Target(ven_id='ven123')])
+
+
+def test_event_transitions():
+    event = make_event('event1', timedelta(minutes=10), duration=timedelta(minutes=5),
+                       ramp_up_period=timedelta(minutes=2))
+    dtstart = event.active_period.dtstart
+    assert event_transitions(event) == [(dtstart - timedelta(minutes=2), 'near'),
+                                        (dtstart, 'active'),
+                                        (dtstart + timedelta(minutes=5), 'completed')]
+    # An event without a duration never completes
+    event = make_event('event2', timedelta(minutes=10), duration=timedelta(0))
+    assert event_transitions(event) == [(event.active_period.dtstart, 'active')]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_updates_statuses():
+    store = EventStore()
+    changes = []
+    scheduler = EventStatusScheduler(store, lambda *args: changes.append(args))
+    event1 = make_event('event1', timedelta(milliseconds=100), ramp_up_period=timedelta(milliseconds=50))
+    event2 = make_event('event2', timedelta(minutes=-1), duration=timedelta(minutes=10))
+    store.add_event('ven123', event1)
+    store.add_event('ven123', event2)
+    scheduler.schedule_event(event1, 'ven123')
+    scheduler.schedule_event(event2, 'ven123')
+    # The status of an event that already started is corrected right away
+    assert event2.event_descriptor.event_status == 'active'
+    assert len(scheduler) == 4
+
+    scheduler.start()
+    await asyncio.sleep(0.5)
+    scheduler.stop()
+    assert changes == [(['ven123'], 'event1', 'far', 'near'),
+                       (['ven123'], 'event1', 'near', 'active'),
+                       (['ven123'], 'event1', 'active', 'completed')]
+    assert event1.event_descriptor.event_status == 'completed'
+    assert store.events_with_status('completed') == [('ven123', event1)]
+    assert len(scheduler) == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_skips_removed_and_cancelled_events():
+    store = EventStore()
+    changes = []
+    scheduler = EventStatusScheduler(store, lambda *args: changes.append(args))
+    event1 = make_event('event1', timedelta(milliseconds=50))
+    event2 = make_event('event2', timedelta(milliseconds=50))
+    for event in (event1, event2):
+        store.add_event('ven123', event)
+        scheduler.schedule_event(event, 'ven123')
+    store.remove_event('ven123', 'event1')
+    store.set_event_status('ven123', 'event2', enums.EVENT_STATUS.CANCELLED)
+    scheduler.start()
+    await asyncio.sleep(0.4)
+    scheduler.stop()
+    assert changes == []
+    assert event2.event_descriptor.event_status == 'cancelled'
+
+
+@pytest.mark.asyncio
+async def test_scheduler_group_event():
+    store = EventStore()
+    changes = []
+    scheduler = EventStatusScheduler(store, lambda *args: changes.append(args))
+    event = make_event('event1', timedelta(milliseconds=50))
+    store.add_group_event(['ven123', 'ven456'], event)
+    scheduler.start()
+    scheduler.schedule_event(event)
+    await asyncio.sleep(0.1)
+    scheduler.stop()
+    assert changes == [(['ven123', 'ven456'], 'event1', 'far', 'active')]
+    assert len(store.events_with_status('active')) == 2
+
+
+@pytest.mark.asyncio
+async def test_server_event_status_change_handler():
+    server = OpenADRServer(vtn_id='myvtn')
+    changes = []
+
+    async def on_event_status_change(ven_id, event_id, old_status, new_status):
+        changes.append((ven_id, event_id, old_status, new_status))
+
+    server.add_handler('on_event_status_change', on_event_status_change)
+    event_id = server.add_raw_event('ven123', make_event('event1', timedelta(milliseconds=50)),
+                                    callback=lambda ven_id, event_id, opt_type: None)
+    server.events_updated['ven123'] = False
+    server.services['event_service'].scheduler.start()
+    await asyncio.sleep(0.1)
+    server.services['event_service'].scheduler.stop()
+    assert changes == [('ven123', event_id, 'far', 'active')]
+    assert server.events_updated['ven123'] is True
+
+
+
+@pytest.mark.asyncio
+async def test_add_events_bulk():
+    server = OpenADRServer(vtn_id='myvtn')
+    changes = []
+
+    async def on_event_status_change(ven_id, event_id, old_status, new_status):
+        changes.append((ven_id, event_id, old_status, new_status))
+
+    server.add_handler('on_event_status_change', on_event_status_change)
+    now = datetime.now(timezone.utc)
+    ven_ids = ['ven123', 'ven456', 'ven789']
+    event_ids = server.add_events_bulk(ven_ids, 'simple', 'level',
+                                       [{'dtstart': now + timedelta(milliseconds=50),
+                                         'duration': timedelta(milliseconds=200),
+                                         'signal_payload': 1}],
+                                       callback=lambda ven_id, event_id, opt_type: None)
+    assert len(set(event_ids)) == 3
+    for ven_id, event_id in zip(ven_ids, event_ids):
+        event = server.events.get_event(ven_id, event_id)
+        assert event.targets == [{'ven_id': ven_id}]
+        assert event.event_descriptor.event_status == 'far'
+        assert event_id in server.event_callbacks
+    assert server.events_updated == {'ven123': True, 'ven456': True, 'ven789': True}
+    assert len(server.services['event_service'].scheduler) == 2
+
+    server.cancel_event('ven456', event_ids[1])
+    assert server.events.get_event('ven123', event_ids[0]).event_descriptor.event_status == 'far'
+
+    server.services['event_service'].scheduler.start()
+    await asyncio.sleep(0.1)
+    server.services['event_service'].scheduler.stop()
+    assert changes == [('ven123', event_ids[0], 'far', 'active'),
+                       ('ven789', event_ids[2], 'far', 'active')]
+
+
+def test_add_events_bulk_with_targets():
+    server = OpenADRServer(vtn_id='myvtn')
+    intervals = [{'dtstart': datetime.now(timezone.utc), 'duration': timedelta(minutes=10), 'signal_payload': 1}]
+    event_ids = server.add_events_bulk({'ven123': {'resource_id': 'res1'},
+                                        'ven456': [{'resource_id': 'res2'}]},
+                                       'simple', 'level', intervals)
+    assert server.events.get_event('ven123', event_ids[0]).targets == [{'resource_id': 'res1'}]
+    assert server.events.get_event('ven456', event_ids[1]).targets == [{'resource_id': 'res2'}]
+
+    event_ids = server.add_events_bulk(['ven123', 'ven456'], 'simple', 'level', intervals,
+                                       target={'group_id': 'group1'})
+    assert server.events.get_event('ven123', event_ids[0]).targets == [{'group_id': 'group1'}]
+    assert server.events.get_event('ven456', event_ids[1]).event_descriptor.event_status == 'active'
+
+    # The events don't share anything that can be changed
+    first = server.events.get_event('ven123', event_ids[0])
+    second = server.events.get_event('ven456', event_ids[1])
+    assert first.targets_by_type == {'group_id': ['group1']}
+    for member in ('targets', 'targets_by_type', 'active_period', 'event_descriptor', 'event_signals'):
+        assert getattr(first, member) is not getattr(second, member)
+    assert first.targets[0] is not second.targets[0]
+    assert first.event_signals[0].intervals[0] is not second.event_signals[0].intervals[0]
+
+
+def test_add_events_bulk_repeated_ven_id():
+    server = OpenADRServer(vtn_id='myvtn')
+    intervals = [{'dtstart': datetime.now(timezone.utc), 'duration': timedelta(minutes=10), 'signal_payload': 1}]
+    event_ids = server.add_events_bulk(['ven123', 'ven456', 'ven123'], 'simple', 'level', intervals)
+    assert len(set(event_ids)) == 3
+    for ven_id, event_id in zip(['ven123', 'ven456', 'ven123'], event_ids):
+        assert server.events.get_event(ven_id, event_id).targets == [{'ven_id': ven_id}]
+    assert len(server.events['ven123']) == 2
+
+def test_ordered_events_with_cached_keys():
+    store = EventStore()
+    store.add_event('ven123', make_event('later', timedelta(minutes=20)))
+    store.add_event('ven123', make_event('active_low', timedelta(minutes=-2), duration=timedelta(minutes=10)))
+    store.add_event('ven123', make_event('active_high', timedelta(minutes=-1), duration=timedelta(minutes=10),
+                                         priority=1))
+    store.add_event('ven123', make_event('sooner', timedelta(minutes=10)))
+    scheduler = EventStatusScheduler(store)
+    for event in store.get_events('ven123'):
+        scheduler.schedule_event(event, 'ven123')
+    cached = [event.event_descriptor.event_id for event in store.ordered_events('ven123', update_statuses=False)]
+    updated = [event.event_descriptor.event_id for event in store.ordered_events('ven123')]
+    assert cached == updated == ['active_low', 'active_high', 'sooner', 'later']
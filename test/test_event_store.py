@@ -0,0 +1,210 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import datetime, timedelta, timezone
+
+from openleadr import enums, objects, utils
+from openleadr.event_store import CompletedEvents, EventStore
+
+
+def make_event(event_id, priority=0, start_in=timedelta(minutes=10), modification_number=0):
+    now = datetime.now(timezone.utc)
+    return objects.Event(
+        event_descriptor=objects.EventDescriptor(event_id=event_id,
+                                                 modification_number=modification_number,
+                                                 market_context='http://marketcontext01',
+                                                 event_status=enums.EVENT_STATUS.FAR,
+                                                 priority=priority,
+                                                 created_date_time=now),
+        active_period=objects.ActivePeriod(dtstart=now + start_in, duration=timedelta(minutes=5)),
+        event_signals=[objects.EventSignal(signal_name='simple', signal_type='level', signal_id='sig1',
+                                           intervals=[objects.Interval(dtstart=now + start_in,
+                                                                       duration=timedelta(minutes=5),
+                                                                       signal_payload=1)])],
+        targets=[objects.Target(ven_id='ven123')])
+
+
+def test_event_store_lookups():
+    store = EventStore()
+    event1 = make_event('event1')
+    event2 = make_event('event2', modification_number=2)
+    store.add_event('ven123', event1)
+    store.add_event('ven123', event2)
+    store.add_event('ven456', make_event('event1'))
+
+    assert 'ven123' in store
+    assert store['ven123'] == [event1, event2]
+    assert store.get_event('ven123', 'event1') is event1
+    assert store.get_event('ven123', 'event2', 2) is event2
+    assert store.get_event('ven123', 'event2', 1) is None
+    assert store.get_event('ven789', 'event1') is None
+    assert [ven_id for ven_id, event in store.find_events('event1')] == ['ven123', 'ven456']
+    assert store.find_events('event2', 2) == [('ven123', event2)]
+    assert store.find_events('event2', 3) == []
+
+    assert store.remove_event('ven123', 'event1') is event1
+    assert store.remove_event('ven123', 'event1') is None
+    assert store['ven123'] == [event2]
+    assert [ven_id for ven_id, event in store.find_events('event1')] == ['ven456']
+
+
+def test_event_store_replaces_event_with_same_id():
+    store = EventStore()
+    store.add_event('ven123', make_event('event1'))
+    new_event = make_event('event1', modification_number=1)
+    store.add_event('ven123', new_event)
+    assert store['ven123'] == [new_event]
+
+
+def test_event_store_status_index():
+    store = EventStore()
+    store.add_event('ven123', make_event('event1'))
+    store.add_event('ven123', make_event('event2'))
+    assert len(store.events_with_status(enums.EVENT_STATUS.FAR)) == 2
+    store.set_event_status('ven123', 'event1', enums.EVENT_STATUS.CANCELLED)
+    assert store.events_with_status(enums.EVENT_STATUS.CANCELLED) == [('ven123', store.get_event('ven123', 'event1'))]
+    assert len(store.events_with_status(enums.EVENT_STATUS.FAR)) == 1
+    store.remove_event('ven123', 'event1')
+    assert store.events_with_status(enums.EVENT_STATUS.CANCELLED) == []
+
+
+def test_event_store_ordering():
+    store = EventStore()
+    store.add_event('ven123', make_event('later', start_in=timedelta(minutes=20)))
+    store.add_event('ven123', make_event('active_low', priority=2, start_in=timedelta(minutes=-1)))
+    store.add_event('ven123', make_event('sooner', start_in=timedelta(minutes=10)))
+    ordered = [event.event_descriptor.event_id for event in store.ordered_events('ven123')]
+    assert ordered == ['active_low', 'sooner', 'later']
+    # The status index follows the updated statuses
+    assert [event.event_descriptor.event_id
+            for ven_id, event in store.events_with_status(enums.EVENT_STATUS.ACTIVE)] == ['active_low']
+
+
+def test_event_store_group_event():
+    store = EventStore()
+    event = make_event('event1')
+    store.add_event('ven123', make_event('event1'))
+    store.add_group_event(['ven123', 'ven456', 'ven789'], event)
+    assert store.is_group_event('event1')
+    assert all(store['ven' + i] == [event] for i in ('123', '456', '789'))
+    assert store.delivery_state('ven123', 'event1').delivered is None
+
+    store.mark_delivered('ven123', 'event1')
+    store.mark_acknowledged('ven123', 'event1', 0, 'optIn')
+    state = store.delivery_state('ven123', 'event1')
+    assert (state.delivered, state.acknowledged, state.opt_type) == (0, 0, 'optIn')
+
+    # The rendered event is shared by all VENs and reused until the event changes
+    renders = []
+    def render(event):
+        renders.append(event)
+        return f'rendered{len(renders)}'
+    assert store.render_events('ven123', [event], render) == 'rendered1'
+    assert store.render_events('ven456', [event], render) == 'rendered1'
+    utils.increment_event_modification_number(event)
+    assert store.render_events('ven123', [event], render) == 'rendered2'
+    store.set_group_event_status('event1', enums.EVENT_STATUS.CANCELLED)
+    assert store.render_events('ven456', [event], render) == 'rendered3'
+    assert store.render_events('ven123', [event], render) == 'rendered3'
+    assert len(store.events_with_status(enums.EVENT_STATUS.CANCELLED)) == 3
+
+    # A detached event is no longer shared
+    detached = store.detach_event('ven456', 'event1')
+    assert detached is not event
+    assert store.get_event('ven456', 'event1') is detached
+    assert sorted(store.delivery_states('event1')) == ['ven123', 'ven789']
+
+    assert store.remove_group_event('event1') == ['ven123', 'ven789']
+    assert not store.is_group_event('event1')
+    assert store.find_events('event1') == [('ven456', detached)]
+
+
+def test_event_store_render_cache():
+    store = EventStore()
+    event1 = make_event('event1')
+    event2 = make_event('event2', start_in=timedelta(minutes=20))
+    store.add_event('ven123', event1)
+    store.add_event('ven123', event2)
+    render = lambda event: utils.getmember(event, 'event_descriptor.event_id') + ';'
+    cache = store.render_cache
+
+    assert store.render_events('ven123', store.ordered_events('ven123'), render) == 'event1;event2;'
+    assert (cache.hits, cache.misses, cache.event_misses) == (0, 1, 2)
+    assert store.render_events('ven123', store.ordered_events('ven123'), render) == 'event1;event2;'
+    assert (cache.hits, cache.misses, cache.event_misses) == (1, 1, 2)
+
+    # Modifying one event only renders that event again
+    store.set_event_status('ven123', 'event2', enums.EVENT_STATUS.CANCELLED)
+    utils.increment_event_modification_number(event2)
+    assert store.render_events('ven123', [event1, event2], render) == 'event1;event2;'
+    assert (cache.hits, cache.misses, cache.event_hits, cache.event_misses) == (1, 2, 1, 3)
+
+    # Adding or removing events invalidates the event set
+    event3 = make_event('event3')
+    store.add_event('ven123', event3)
+    assert store.render_events('ven123', store.get_events('ven123'), render) == 'event1;event2;event3;'
+    assert (cache.hits, cache.misses, cache.event_misses) == (1, 3, 4)
+    store.remove_event('ven123', 'event3')
+    assert len(cache) == 2
+    assert cache.hit_rate == 0.25
+
+
+def test_completed_events(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('openleadr.event_store.time.monotonic', lambda: now[0])
+    completed = CompletedEvents(ttl=60, max_per_ven=2)
+    completed.add('ven123', 'event1')
+    completed.add('ven456', 'event1')
+    now[0] += 30
+    completed.add('ven123', 'event2')
+    assert ('ven123', 'event1') in completed
+    assert ('ven123', 'event3') not in completed
+    assert len(completed) == 3
+
+    # The oldest event_id for a VEN is evicted when there are too many
+    completed.add('ven123', 'event3')
+    assert ('ven123', 'event1') not in completed
+    assert completed.count('ven123') == 2
+
+    # Event_ids expire after the ttl
+    now[0] += 31
+    assert ('ven456', 'event1') not in completed
+    assert len(completed) == 2
+    now[0] += 30
+    assert len(completed) == 0
+    assert completed.count('ven123') == 0
+    assert not completed._event_ids and not completed._expiry
+
+
+def test_completed_events_compaction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('openleadr.event_store.time.monotonic', lambda: now[0])
+    completed = CompletedEvents(ttl=60, max_per_ven=10)
+    for i in range(1000):
+        now[0] += 0.001
+        completed.add('ven123', 'event1')
+        completed.add('ven456', f'event{i}')
+    assert len(completed) == 11
+    assert len(completed._expiry) <= 2 * len(completed) + 16
+
+    # Adding an event_id again still renews its ttl
+    now[0] += 59
+    completed.add('ven123', 'event1')
+    now[0] += 2
+    assert ('ven123', 'event1') in completed
+    assert completed.count('ven456') == 0
+    assert len(completed._expiry) == 1
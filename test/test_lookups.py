@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import aiohttp
+import pytest
+
+from openleadr import OpenADRServer
+from openleadr.lookups import LookupCache
+from openleadr.messaging import create_message, parse_message
+
+VTN_URL = 'http://localhost:8083/OpenADR2/Simple/2.0b'
+
+
+@pytest.mark.asyncio
+async def test_lookup_cache_single_flight():
+    calls = []
+
+    async def lookup(ven_id):
+        calls.append(ven_id)
+        await asyncio.sleep(0.05)
+        return {'ven_id': ven_id, 'registration_id': 'reg123'}
+
+    cache = LookupCache()
+    results = await asyncio.gather(*[cache.get('ven_lookup', 'ven123', lookup) for _ in range(10)])
+    assert calls == ['ven123']
+    assert all(result == {'ven_id': 'ven123', 'registration_id': 'reg123'} for result in results)
+    assert await cache.get('ven_lookup', 'ven123', lookup) == results[0]
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 9, 1)
+    assert cache.hit_rate == 10 / 11
+
+    cache.invalidate('ven123')
+    await cache.get('ven_lookup', 'ven123', lookup)
+    assert calls == ['ven123', 'ven123']
+
+
+@pytest.mark.asyncio
+async def test_lookup_cache_ttl_and_size(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr('openleadr.lookups.time.monotonic', lambda: now[0])
+    calls = []
+
+    def lookup(ven_id):
+        calls.append(ven_id)
+        return None if ven_id == 'unknown' else {'ven_id': ven_id}
+
+    cache = LookupCache(ttl=10, max_size=2)
+    await cache.get('ven_lookup', 'ven1', lookup)
+    await cache.get('ven_lookup', 'ven2', lookup)
+    await cache.get('ven_lookup', 'ven1', lookup)
+    await cache.get('ven_lookup', 'ven3', lookup)
+    assert len(cache) == 2
+    # ven2 was the least recently used, ven1 is still cached
+    await cache.get('ven_lookup', 'ven1', lookup)
+    await cache.get('ven_lookup', 'ven2', lookup)
+    assert calls == ['ven1', 'ven2', 'ven3', 'ven2']
+
+    now[0] += 11
+    await cache.get('ven_lookup', 'ven2', lookup)
+    assert calls[-1] == 'ven2' and len(calls) == 5
+
+    # Unknown VENs are not cached
+    await cache.get('ven_lookup', 'unknown', lookup)
+    await cache.get('ven_lookup', 'unknown', lookup)
+    assert calls.count('unknown') == 2
+
+
+@pytest.mark.asyncio
+async def test_lookup_cache_shares_exceptions():
+    async def lookup(ven_id):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database down")
+
+    cache = LookupCache()
+    results = await asyncio.gather(*[cache.get('ven_lookup', 'ven123', lookup) for _ in range(3)],
+                                   return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_server_looks_up_ven_once():
+    calls = []
+
+    async def ven_lookup(ven_id):
+        calls.append(ven_id)
+        await asyncio.sleep(0.05)
+        return {'ven_id': ven_id, 'registration_id': 'reg123'}
+
+    async def poll(session):
+        async with session.post(f'{VTN_URL}/OadrPoll', data=create_message('oadrPoll', ven_id='ven123'),
+                                headers={'Content-Type': 'application/xml'}) as response:
+            return parse_message(await response.read())
+
+    server = OpenADRServer(vtn_id='MYVTN', http_port=8083, http_host='localhost', ven_lookup=ven_lookup)
+    await server.run()
+    try:
+        async with aiohttp.ClientSession() as session:
+            results = await asyncio.gather(*[poll(session) for _ in range(5)])
+            assert calls == ['ven123']
+            assert all(message_type == 'oadrResponse' for message_type, message_payload in results)
+            await poll(session)
+            assert calls == ['ven123']
+            server.invalidate_ven('ven123')
+            await poll(session)
+            assert calls == ['ven123', 'ven123']
+    finally:
+        await server.stop()
@@ -15,8 +15,12 @@
 # limitations under the License.
 
 from openleadr.utils import generate_id, group_targets_by_type
-from openleadr.messaging import create_message, parse_message, validate_xml_schema
-from openleadr import enums
+from openleadr.messaging import create_message, parse_message, parse_message_tree, validate_xml_schema, TEMPLATES
+from openleadr.preflight import preflight_message
+from openleadr.serializers import SERIALIZERS, disable_serializers, enable_serializers, serialize_message
+from openleadr.utils import flatten_xml, normalize_dict
+from openleadr.messaging import NAMESPACES, _build_name, _tree_to_dict
+from openleadr import enums, objects
 from pprint import pprint
 from termcolor import colored
 from datetime import datetime, timezone, timedelta
@@ -25,6 +29,9 @@ from pprint import pprint, pformat
 from lxml import etree
 from dataclasses import asdict
 import re
+import copy
+import xmltodict
+from test.fixtures.reference_normalize import reference_normalize_dict
 
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
@@ -300,8 +307,9 @@ def test_message(message_type, data):
     # print("    ", file=file)
     # print(".. code-block:: python3", file=file)
     # print("    ", file=file)
-    validate_xml_schema(message)
+    tree = validate_xml_schema(message)
     parsed = parse_message(message)[1]
+    assert parse_message_tree(tree) == (message_type, parsed)
     # dict_lines = pformat(parsed).splitlines()
     # for line in dict_lines:
     #     print("    " + line, file=file)
@@ -319,3 +327,87 @@ def test_message(message_type, data):
                 if 'measurement' in signal:
                     signal['measurement'].pop('ns')
     assert parsed == data
+
+
+@pytest.mark.parametrize('message_type,data', testcases)
+def test_normalize_dict_matches_reference(message_type, data):
+    message = create_message(message_type, **copy.deepcopy(data))
+    parsed = xmltodict.parse(message, process_namespaces=True, namespaces=NAMESPACES)
+    tree = validate_xml_schema(message)
+    for message_dict in (parsed, {_build_name(tree.tag): _tree_to_dict(tree)}):
+        payload = message_dict['oadrPayload']['oadrSignedObject'][message_type]
+        assert normalize_dict(copy.deepcopy(payload)) == reference_normalize_dict(copy.deepcopy(payload))
+
+def _has_report_descriptions(data):
+    return any('report_descriptions' in report for report in data.get('reports', []) if isinstance(report, dict))
+
+# Reports with report descriptions are rendered by the template
+fallback_testcases = [tc for tc in testcases if tc[0] in SERIALIZERS and _has_report_descriptions(tc[1])]
+serializer_testcases = [tc for tc in testcases if tc[0] in SERIALIZERS and not _has_report_descriptions(tc[1])] + [
+('oadrResponse', dict(response={'response_code': 400, 'response_description': 'INVALID DATA'}, ven_id=None)),
+('oadrCreatedEvent', dict(response={'response_code': 200, 'response_description': 'OK', 'request_id': generate_id()}, ven_id='123ABC')),
+('oadrCreatedEvent', dict(response={'response_code': 200, 'response_description': 'OK', 'request_id': generate_id()},
+                          event_responses=[{'response_code': 200, 'request_id': generate_id(), 'event_id': generate_id(),
+                                            'modification_number': 2, 'opt_type': 'optOut'}],
+                          ven_id='123ABC')),
+('oadrRequestEvent', dict(request_id=generate_id(), ven_id='123ABC', reply_limit=3)),
+('oadrUpdateReport', dict(request_id=generate_id(), ven_id='123ABC',
+                          reports=[objects.Report(report_specifier_id=generate_id(),
+                                                  report_name='TELEMETRY_USAGE',
+                                                  report_request_id=generate_id(),
+                                                  created_date_time=datetime.now(timezone.utc),
+                                                  dtstart=datetime.now(timezone.utc),
+                                                  intervals=[objects.ReportInterval(dtstart=datetime.now(timezone.utc) + timedelta(minutes=i),
+                                                                                    duration=timedelta(minutes=1),
+                                                                                    report_payload=objects.ReportPayload(r_id='rid1', value=i * 1.5, confidence=100))
+                                                             for i in range(5)])])),
+('oadrUpdateReport', dict(request_id=generate_id(),
+                          reports=[{'report_id': generate_id(),
+                                    'report_specifier_id': generate_id(),
+                                    'report_request_id': generate_id(),
+                                    'created_date_time': datetime.now(timezone.utc),
+                                    'intervals': [{'dtstart': datetime.now(timezone.utc),
+                                                   'report_payload': {'r_id': 'rid2', 'value': 12, 'accuracy': 0.1, 'data_quality': 'Quality Good - Non Specific'}}]}])),
+]
+
+@pytest.mark.parametrize('message_type,data', serializer_testcases)
+def test_serializer_matches_template(message_type, data):
+    payload = preflight_message(message_type, data)
+    template_output = TEMPLATES.get_template(f'{message_type}.xml').render(**payload)
+    serializer_output = serialize_message(message_type, payload)
+    assert serializer_output is not None
+    assert serializer_output == template_output
+    validate_xml_schema(create_message(message_type, **data))
+
+@pytest.mark.parametrize('message_type,data', testcases)
+def test_templates_render_flat(message_type, data):
+    payload = preflight_message(message_type, data)
+    output = TEMPLATES.get_template(f'{message_type}.xml').render(**payload)
+    assert '\n' not in output
+    assert output == flatten_xml(output)
+    assert not re.search(r'>\s+<', output)
+
+def test_serializer_falls_back_to_template():
+    assert serialize_message('oadrDistributeEvent', {}) is None
+    assert serialize_message('oadrResponse', {'ven_id': '123ABC'}) is None
+    for message_type, data in fallback_testcases:
+        assert serialize_message(message_type, preflight_message(message_type, data)) is None
+
+def test_all_serializers_are_tested():
+    assert {message_type for message_type, data in serializer_testcases} == set(SERIALIZERS)
+
+def test_disable_serializers():
+    payload = preflight_message('oadrPoll', {'ven_id': '123ABC'})
+    request_payload = preflight_message('oadrRequestEvent', {'ven_id': '123ABC', 'request_id': '123'})
+    try:
+        disable_serializers('oadrPoll')
+        assert serialize_message('oadrPoll', payload) is None
+        assert serialize_message('oadrRequestEvent', request_payload) is not None
+        disable_serializers()
+        assert serialize_message('oadrRequestEvent', request_payload) is None
+        validate_xml_schema(create_message('oadrPoll', ven_id='123ABC'))
+    finally:
+        enable_serializers()
+    assert serialize_message('oadrPoll', payload) is not None
+    with pytest.raises(ValueError):
+        enable_serializers('oadrDistributeEvent')
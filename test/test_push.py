@@ -0,0 +1,249 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from openleadr import OpenADRClient, OpenADRServer, objects
+from openleadr.messaging import create_message, parse_message
+from openleadr.push import PushDispatcher
+
+VEN_URL = 'http://localhost:8081/OpenADR2/Simple/2.0b'
+
+
+async def start_receiver(handler):
+    app = web.Application()
+    app.add_routes([web.post('/OpenADR2/Simple/2.0b/EiEvent', handler),
+                    web.post('/OpenADR2/Simple/2.0b/EiRegisterParty', handler)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host='localhost', port=8081).start()
+    return runner
+
+
+async def make_message(message_type, **message_payload):
+    return create_message(message_type, **message_payload)
+
+
+@pytest.mark.asyncio
+async def test_push_dispatcher_retries_and_ordering():
+    received = []
+    attempts = []
+
+    async def handler(request):
+        attempts.append(request.path)
+        if len(attempts) == 1:
+            return web.Response(status=500)
+        received.append(parse_message(await request.read()))
+        return web.Response(text='')
+
+    async def lazy_message():
+        return 'oadrCancelPartyRegistration', {'ven_id': 'ven123', 'registration_id': 'reg2'}
+
+    runner = await start_receiver(handler)
+    dispatcher = PushDispatcher(max_concurrency=2, retries=2, retry_delay=0.01)
+    dispatcher.vtn_id = 'VTN'
+    dispatcher.create_message = make_message
+    dispatcher.register('ven123', VEN_URL + '/')
+    try:
+        dispatcher.push('ven123', ('oadrCancelPartyRegistration', {'ven_id': 'ven123', 'registration_id': 'reg1'}))
+        dispatcher.push('ven123', lazy_message)
+        dispatcher.push('ven123', ('oadrCancelPartyRegistration', {'ven_id': 'ven123', 'registration_id': 'reg3'}))
+        while dispatcher._workers:
+            await asyncio.sleep(0.01)
+    finally:
+        await dispatcher.close()
+        await runner.cleanup()
+
+    # The first attempt failed and was retried, without changing the order of the messages
+    assert len(attempts) == 4
+    assert [payload['registration_id'] for message_type, payload in received] == ['reg1', 'reg2', 'reg3']
+    assert dispatcher.delivered == 3
+    assert dispatcher.failed == 0
+
+
+@pytest.mark.asyncio
+async def test_push_dispatcher_gives_up():
+    failures = []
+    dispatcher = PushDispatcher(retries=1, retry_delay=0.01, timeout=1)
+    dispatcher.vtn_id = 'VTN'
+    dispatcher.create_message = make_message
+    dispatcher.register('ven123', 'http://localhost:8082/OpenADR2/Simple/2.0b')
+    dispatcher.push('ven123', ('oadrRequestReregistration', {'ven_id': 'ven123'}),
+                    on_failure=lambda ven_id, message_type: failures.append((ven_id, message_type)))
+    while dispatcher._workers:
+        await asyncio.sleep(0.01)
+    assert failures == [('ven123', 'oadrRequestReregistration')]
+    assert dispatcher.failed == 1
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_push_events_to_client():
+    def on_create_party_registration(registration_info):
+        return 'ven123', 'reg123'
+
+    loop = asyncio.get_event_loop()
+    received_event = loop.create_future()
+    opt_in = loop.create_future()
+
+    async def on_event(event):
+        received_event.set_result(event)
+        return 'optIn'
+
+    def event_callback(ven_id, event_id, opt_type):
+        opt_in.set_result(opt_type)
+
+    server = OpenADRServer(vtn_id='MYVTN', requested_poll_freq=timedelta(seconds=10))
+    server.add_handler('on_create_party_registration', on_create_party_registration)
+    await server.run()
+
+    client = OpenADRClient(ven_name='ven123',
+                           vtn_url='http://localhost:8080/OpenADR2/Simple/2.0b',
+                           transport_address=VEN_URL, allow_insecure_push=True)
+    client.add_handler('on_event', on_event)
+    await client.run()
+    assert server.push_dispatcher.is_push_ven('ven123')
+    assert not any(job.func == client._poll for job in client.scheduler.get_jobs())
+
+    now = datetime.now(timezone.utc)
+    event_id = server.add_event(ven_id='ven123',
+                                signal_name='simple',
+                                signal_type='level',
+                                intervals=[objects.Interval(dtstart=now + timedelta(minutes=10),
+                                                            duration=timedelta(minutes=10),
+                                                            signal_payload=1)],
+                                callback=event_callback)
+
+    # The event arrives long before the next poll would have happened
+    event = await asyncio.wait_for(received_event, 2)
+    assert event['event_descriptor']['event_id'] == event_id
+    assert await asyncio.wait_for(opt_in, 2) == 'optIn'
+    assert server.events_updated['ven123'] is False
+
+    await client.stop()
+    await server.stop()
+
+
+def test_push_dispatcher_rejects_invalid_addresses():
+    dispatcher = PushDispatcher()
+    for address in ('ftp://ven123.example.com/OpenADR2', 'file:///etc/passwd', 'http://', 'ven123.example.com'):
+        with pytest.raises(ValueError):
+            dispatcher.register('ven123', address)
+    assert not dispatcher.is_push_ven('ven123')
+    dispatcher.register('ven123', 'https://ven123.example.com/OpenADR2/Simple/2.0b/')
+    assert dispatcher.is_push_ven('ven123')
+
+    dispatcher = PushDispatcher(allow_address=lambda ven_id, address: address.startswith(f'https://{ven_id}.'))
+    with pytest.raises(ValueError):
+        dispatcher.register('ven123', 'https://elsewhere.example.com/OpenADR2/Simple/2.0b')
+    assert not dispatcher.is_push_ven('ven123')
+    dispatcher.register('ven123', 'https://ven123.example.com/OpenADR2/Simple/2.0b')
+    assert dispatcher.is_push_ven('ven123')
+
+
+@pytest.mark.asyncio
+async def test_client_refuses_unauthenticated_push():
+    client = OpenADRClient(ven_name='ven123', vtn_url='http://localhost:8080/OpenADR2/Simple/2.0b',
+                           transport_address=VEN_URL)
+    client.loop = asyncio.get_event_loop()
+    with pytest.raises(ValueError) as err:
+        await client._start_push_server()
+    assert 'plain http' in str(err.value)
+
+    client.transport_address = 'https://localhost:8081/OpenADR2/Simple/2.0b'
+    client.cert_path = client.key_path = 'ven.cert'
+    with pytest.raises(ValueError) as err:
+        await client._start_push_server()
+    assert 'authenticate' in str(err.value)
+    assert client.push_runner is None
+
+
+@pytest.mark.asyncio
+async def test_client_refuses_pushed_messages_for_others():
+    client = OpenADRClient(ven_name='ven123', vtn_url='http://localhost:8080/OpenADR2/Simple/2.0b',
+                           ven_id='ven123', transport_address=VEN_URL, allow_insecure_push=True)
+    client.vtn_id = 'MYVTN'
+    client.loop = asyncio.get_event_loop()
+    await client._start_push_server()
+    # Keep the accepted messages in the queue
+    client.push_queue_task.cancel()
+    messages = [('EiEvent', 403, create_message('oadrDistributeEvent', request_id='req123', vtn_id='OTHERVTN',
+                                                events=[])),
+                ('EiEvent', 200, create_message('oadrDistributeEvent', request_id='req123', vtn_id='MYVTN',
+                                                events=[])),
+                ('EiRegisterParty', 403, create_message('oadrCancelPartyRegistration', request_id='req123',
+                                                        registration_id='reg123', ven_id='ven456')),
+                ('EiRegisterParty', 200, create_message('oadrCancelPartyRegistration', request_id='req123',
+                                                        registration_id='reg123', ven_id='ven123'))]
+    try:
+        async with aiohttp.ClientSession() as session:
+            for service, status, message in messages:
+                async with session.post(f'{VEN_URL}/{service}', data=message,
+                                        headers={'Content-Type': 'application/xml'}) as response:
+                    assert response.status == status
+        assert client.push_queue.qsize() == 2
+    finally:
+        await client.push_runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_completed_events_are_removed_once_pushed():
+    received = []
+
+    async def handler(request):
+        received.append(parse_message(await request.read()))
+        return web.Response(text='')
+
+    server = OpenADRServer(vtn_id='MYVTN')
+    event_service = server.services['event_service']
+    server.push_dispatcher.register('ven123', 'http://localhost:8082/OpenADR2/Simple/2.0b')
+    server.push_dispatcher.retries = 0
+    now = datetime.now(timezone.utc)
+    event_id = server.add_event(ven_id='ven123',
+                                signal_name='simple',
+                                signal_type='level',
+                                intervals=[objects.Interval(dtstart=now - timedelta(minutes=20),
+                                                            duration=timedelta(minutes=10),
+                                                            signal_payload=1)])
+
+    def event_ids():
+        return [event.event_descriptor.event_id for event in server.events.get_events('ven123')]
+
+    # Nobody listens at the transport address, so the completed event is kept
+    while server.push_dispatcher._workers:
+        await asyncio.sleep(0.01)
+    assert server.push_dispatcher.failed == 1
+    assert event_ids() == [event_id]
+    assert server.events_updated['ven123'] is True
+
+    # Once the push has been delivered, the completed event is removed
+    runner = await start_receiver(handler)
+    server.push_dispatcher.register('ven123', VEN_URL)
+    try:
+        event_service.events_changed(['ven123'])
+        while server.push_dispatcher._workers:
+            await asyncio.sleep(0.01)
+    finally:
+        await server.push_dispatcher.close()
+        await runner.cleanup()
+    assert [message_type for message_type, message_payload in received] == ['oadrDistributeEvent']
+    assert event_ids() == []
+    assert ('ven123', event_id) in event_service.completed_event_ids
@@ -0,0 +1,89 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import datetime, timedelta, timezone
+from multiprocessing import Pool
+import os
+
+import pytest
+from lxml import etree
+
+from openleadr import messaging
+from openleadr.messaging import create_message, validate_xml_signature
+from openleadr.replay import MemoryNonceStore, SQLiteNonceStore
+
+with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'certificates', 'dummy_ven.crt'), 'rb') as file:
+    TEST_CERT = file.read()
+with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'certificates', 'dummy_ven.key'), 'rb') as file:
+    TEST_KEY = file.read()
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def nonce_store(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryNonceStore()
+    else:
+        store = SQLiteNonceStore(str(tmp_path / 'nonces.db'))
+        yield store
+        store.close()
+
+
+def test_nonce_store_refuses_duplicates(nonce_store):
+    now = datetime.now(timezone.utc)
+    expires = now + timedelta(seconds=5)
+    assert nonce_store.add(now, 'abc', expires) is True
+    assert nonce_store.add(now, 'abc', expires) is False
+    assert nonce_store.add(now, 'def', expires) is True
+    assert nonce_store.add(now + timedelta(seconds=1), 'abc', expires) is True
+    assert len(nonce_store) == 3
+
+
+def test_nonce_store_expires_nonces(nonce_store):
+    now = datetime.now(timezone.utc)
+    assert nonce_store.add(now - timedelta(seconds=10), 'abc', now - timedelta(seconds=5)) is True
+    assert nonce_store.add(now, 'def', now + timedelta(seconds=5)) is True
+    assert len(nonce_store) == 1
+
+
+def test_replay_protection_uses_nonce_store(nonce_store):
+    original_store = messaging.NONCE_CACHE
+    messaging.NONCE_CACHE = nonce_store
+    try:
+        msg = create_message('oadrPoll', ven_id='ven123', cert=TEST_CERT, key=TEST_KEY)
+        validate_xml_signature(etree.fromstring(msg.encode('utf-8')))
+        with pytest.raises(ValueError, match='already used'):
+            validate_xml_signature(etree.fromstring(msg.encode('utf-8')))
+        assert len(nonce_store) == 1
+    finally:
+        messaging.NONCE_CACHE = original_store
+
+
+def _add_nonce(path):
+    store = SQLiteNonceStore(path)
+    now = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    try:
+        return store.add(now, 'abc', now + timedelta(seconds=5))
+    finally:
+        store.close()
+
+
+def test_sqlite_nonce_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'nonces.db')
+    SQLiteNonceStore(path).close()
+    with Pool(4) as pool:
+        results = pool.map(_add_nonce, [path] * 8)
+    assert results.count(True) == 1
@@ -2,13 +2,16 @@ from openleadr import OpenADRClient, OpenADRServer, enable_default_logging
 import asyncio
 import pytest
 import aiohttp
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from functools import partial
 import logging
 from random import random
 import time
 
-from openleadr.messaging import create_message
+from openleadr.messaging import create_message, parse_message_tree, validate_xml_schema
+from openleadr.service import RegistrationService, ReportService
+from openleadr.ingestion import ReportQueue
+from openleadr import errors
 
 loop = asyncio.get_event_loop()
 loop.set_debug(True)
@@ -899,3 +902,258 @@ async def test_report_from_vtn_to_ven():
 
     await client.stop()
     await server.stop()
+
+def _update_report_message(count):
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    intervals = [{'dtstart': start + timedelta(minutes=i),
+                  'report_payload': {'r_id': 'rid1' if i % 2 else 'rid2', 'value': float(i)}}
+                 for i in range(count)]
+    return create_message('oadrUpdateReport',
+                          request_id='req123',
+                          ven_id='ven123',
+                          reports=[{'report_id': 'rep1',
+                                    'report_request_id': 'rr1',
+                                    'report_specifier_id': 'spec1',
+                                    'report_name': 'TELEMETRY_USAGE',
+                                    'created_date_time': start,
+                                    'intervals': intervals}])
+
+def test_stream_report_interval_values():
+    tree = validate_xml_schema(_update_report_message(10))
+    message_type, payload = parse_message_tree(tree)
+    message_type, streamed_payload = parse_message_tree(tree, stream_report_intervals=True)
+    report = payload['reports'][0]
+    streamed_report = streamed_payload['reports'][0]
+    assert 'intervals' not in streamed_report
+    assert list(streamed_report.pop('interval_values')) == \
+        [(ri['report_payload']['r_id'], ri['dtstart'], ri['report_payload']['value']) for ri in report.pop('intervals')]
+    assert streamed_report == report
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('chunk_size', [None, 2])
+async def test_update_report_delivers_streamed_values(chunk_size):
+    received = {'rid1': [], 'rid2': []}
+    calls = []
+    def callback(r_id, values):
+        calls.append(len(values))
+        received[r_id].extend(values)
+    service = ReportService('vtn123')
+    service.report_chunk_size = chunk_size
+    service.report_callbacks[('rr1', 'rid1')] = partial(callback, 'rid1')
+    service.report_callbacks[('rr1', 'rid2')] = partial(callback, 'rid2')
+    message_type, payload = service.parse_message(validate_xml_schema(_update_report_message(9)))
+    await service.update_report(payload)
+    assert [value for dtstart, value in received['rid1']] == [1.0, 3.0, 5.0, 7.0]
+    assert [value for dtstart, value in received['rid2']] == [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert received['rid1'][0][0] == datetime(2021, 1, 1, 0, 1, tzinfo=timezone.utc)
+    if chunk_size:
+        assert max(calls) == chunk_size
+    else:
+        assert calls == [5, 4]
+
+@pytest.mark.asyncio
+async def test_update_report_with_report_queue():
+    received = {'rid1': [], 'rid2': []}
+    def callback(r_id, batch):
+        received[r_id].append(batch)
+    report_queue = ReportQueue(batch_size=2)
+    service = ReportService('vtn123', report_queue=report_queue)
+    service.report_callbacks[('rr1', 'rid1')] = partial(callback, 'rid1')
+    service.report_callbacks[('rr1', 'rid2')] = partial(callback, 'rid2')
+    message_type, payload = service.parse_message(validate_xml_schema(_update_report_message(9)))
+    response_type, response_payload = await service.update_report(payload)
+    assert response_type == 'oadrUpdatedReport'
+    await report_queue.join()
+    assert [len(batch) for batch in received['rid1']] == [2, 2]
+    assert [len(batch) for batch in received['rid2']] == [2, 2, 1]
+    assert [value for batch in received['rid1'] for value in batch.values] == [1.0, 3.0, 5.0, 7.0]
+    assert received['rid2'][0].timestamps == [datetime(2021, 1, 1, 0, 0, tzinfo=timezone.utc),
+                                              datetime(2021, 1, 1, 0, 2, tzinfo=timezone.utc)]
+    assert list(received['rid2'][0]) == [(datetime(2021, 1, 1, 0, 0, tzinfo=timezone.utc), 0.0),
+                                         (datetime(2021, 1, 1, 0, 2, tzinfo=timezone.utc), 2.0)]
+    assert report_queue.received == report_queue.delivered == 9
+    await report_queue.close()
+
+class _Request:
+    secure = False
+
+    def __init__(self, content):
+        self.headers = {'content-type': 'application/xml'}
+        self.content = content.encode('utf-8')
+
+    async def read(self):
+        return self.content
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('when_full', ['reject', 'drop'])
+async def test_report_queue_when_full(when_full, caplog):
+    release = asyncio.Event()
+    received = []
+    async def callback(batch):
+        await release.wait()
+        received.append(batch)
+    report_queue = ReportQueue(max_size=1, batch_size=10, when_full=when_full)
+    service = ReportService('vtn123', report_queue=report_queue)
+    service.report_callbacks[('rr1', 'rid1')] = callback
+    message = validate_xml_schema(_update_report_message(4))
+    # The first batch is taken by the worker, the second one fills the queue
+    for i in range(2):
+        message_type, payload = service.parse_message(message)
+        await service.update_report(payload)
+        await asyncio.sleep(0)
+    message_type, payload = service.parse_message(message)
+    if when_full == 'reject':
+        with pytest.raises(errors.DeploymentError):
+            await service.update_report(payload)
+        assert report_queue.rejected == 1
+        # The VEN gets an error response, and the rejection is not logged as a handler error
+        caplog.clear()
+        service._create_message = create_message
+        response = await service.handler(_Request(_update_report_message(4)))
+        assert '<ei:responseCode>469</ei:responseCode>' in response.text
+        assert report_queue.rejected == 2
+        assert "Report queue full, rejected the oadrUpdateReport from VEN ven123 " \
+               "(batches 1, depth 1/1, received 4, delivered 0, dropped 0, rejected 2)." in caplog.text
+        assert 'An exception occurred' not in caplog.text
+    else:
+        await service.update_report(payload)
+        assert report_queue.dropped == 2
+    release.set()
+    await report_queue.close()
+    assert len(received) == 2
+    assert report_queue.delivered == 4
+
+
+def _update_report_payload(*report_request_ids):
+    now = datetime.now(timezone.utc)
+    return {'ven_id': 'ven123',
+            'reports': [{'report_request_id': report_request_id,
+                         'intervals': [{'dtstart': now, 'report_payload': {'r_id': 'rid1', 'value': 1.0}}]}
+                        for report_request_id in report_request_ids]}
+
+
+@pytest.mark.asyncio
+async def test_report_queue_rejects_whole_message():
+    release = asyncio.Event()
+    received = []
+    async def callback(batch):
+        await release.wait()
+        received.append(batch.report_request_id)
+    report_queue = ReportQueue(max_size=2, batch_size=10, when_full='reject')
+    service = ReportService('vtn123', report_queue=report_queue)
+    for report_request_id in ('rr1', 'rr2', 'rr3'):
+        service.report_callbacks[(report_request_id, 'rid1')] = callback
+
+    # The first batch is taken by the worker, the second one waits in the queue
+    await service.update_report(_update_report_payload('rr1'))
+    await asyncio.sleep(0)
+    await service.update_report(_update_report_payload('rr1'))
+    assert report_queue.depth == 1
+
+    # There is room for one more batch, but not for both reports in the message
+    with pytest.raises(errors.DeploymentError):
+        await service.update_report(_update_report_payload('rr2', 'rr3'))
+    assert report_queue.depth == 1
+
+    # A message with more batches than max_size never fits
+    release.set()
+    await report_queue.join()
+    with pytest.raises(errors.DeploymentError):
+        await service.update_report(_update_report_payload('rr1', 'rr2', 'rr3'))
+    assert report_queue.rejected == 2
+    await report_queue.close()
+    assert received == ['rr1', 'rr1']
+    assert report_queue.received == report_queue.delivered == 2
+
+
+def _register_report_payload(ven_id, report_specifier_id='spec1', max_period=timedelta(minutes=1)):
+    descriptions = [{'r_id': r_id,
+                     'report_data_source': {'resource_id': 'Device001'},
+                     'reading_type': 'Direct Read',
+                     'measurement': {'description': 'Voltage', 'unit': 'V', 'scale': 'none'},
+                     'sampling_rate': {'min_period': timedelta(seconds=10),
+                                       'max_period': max_period}}
+                    for r_id in ('rid1', 'rid2')]
+    return {'ven_id': ven_id,
+            'reports': [{'report_name': 'METADATA_TELEMETRY_USAGE',
+                         'report_specifier_id': report_specifier_id,
+                         'report_descriptions': descriptions}]}
+
+@pytest.mark.asyncio
+async def test_report_routes():
+    received = []
+    unrouted = []
+    async def on_register_report(ven_id, resource_id, measurement, unit, scale,
+                                 min_sampling_interval, max_sampling_interval):
+        return (received.extend, min_sampling_interval)
+    service = ReportService('vtn123')
+    service.on_register_report = on_register_report
+    service.on_update_report = unrouted.append
+    response_type, response_payload = await service.register_report(_register_report_payload('ven123'))
+    report_request_id = response_payload['report_requests'][0].report_request_id
+    assert service.report_routes == {report_request_id: {'rid1': received.extend, 'rid2': received.extend}}
+    assert service.report_callbacks[(report_request_id, 'rid1')] == received.extend
+    assert len(service.report_callbacks) == 2
+
+    # Registering a changed report replaces its routing table
+    response_type, response_payload = await service.register_report(
+        _register_report_payload('ven123', max_period=timedelta(minutes=5)))
+    new_report_request_id = response_payload['report_requests'][0].report_request_id
+    assert list(service.report_routes) == [new_report_request_id]
+
+    # Values for the old request go to the default handler, values for the new one to the callbacks
+    message = validate_xml_schema(_update_report_message(4).replace('rr1', new_report_request_id))
+    message_type, payload = service.parse_message(message)
+    assert 'interval_values' in payload['reports'][0]
+    await service.update_report(payload)
+    assert sorted(value for dtstart, value in received) == [0.0, 1.0, 2.0, 3.0]
+    message = validate_xml_schema(_update_report_message(4).replace('rr1', report_request_id))
+    message_type, payload = service.parse_message(message)
+    assert len(payload['reports'][0]['intervals']) == 4
+    await service.update_report(payload)
+    assert len(unrouted) == 1
+
+    # Canceling the registration removes the routing tables for the VEN
+    registration_service = RegistrationService('vtn123', poll_freq=timedelta(seconds=10))
+    registration_service.report_service = service
+    registration_service.on_cancel_party_registration = lambda payload: None
+    await registration_service.cancel_party_registration({'ven_id': 'ven123'})
+    assert service.report_routes == {}
+    assert service.ven_report_routes == {}
+
+@pytest.mark.asyncio
+async def test_repeated_report_registration_is_skipped():
+    calls = []
+    def on_register_report(ven_id, resource_id, measurement, unit, scale,
+                           min_sampling_interval, max_sampling_interval):
+        calls.append(ven_id)
+        return (print, min_sampling_interval)
+    service = ReportService('vtn123')
+    service.on_register_report = on_register_report
+    response_type, response_payload = await service.register_report(_register_report_payload('ven123'))
+    report_requests = response_payload['report_requests']
+    assert len(calls) == 2
+
+    # The same reports, sent at a different time
+    payload = _register_report_payload('ven123')
+    payload['reports'][0]['created_date_time'] = datetime.now(timezone.utc)
+    response_type, response_payload = await service.register_report(payload)
+    assert response_payload['report_requests'] == report_requests
+    assert len(calls) == 2
+    assert service.skipped_registrations == 1
+    assert len(service.registered_reports['ven123']) == 1
+
+    # Changed reports are registered again, and replace the previous copy
+    response_type, response_payload = await service.register_report(
+        _register_report_payload('ven123', max_period=timedelta(minutes=5)))
+    assert response_payload['report_requests'][0].report_request_id != report_requests[0].report_request_id
+    assert len(calls) == 4
+    assert len(service.registered_reports['ven123']) == 1
+
+    # Without routes, for instance after a restart, the reports are registered again
+    service.report_routes.clear()
+    response_type, response_payload = await service.register_report(
+        _register_report_payload('ven123', max_period=timedelta(minutes=5)))
+    assert len(calls) == 6
+
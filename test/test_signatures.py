@@ -16,12 +16,15 @@
 
 
 from openleadr.utils import generate_id, certificate_fingerprint, ensure_bytes
-from openleadr.messaging import create_message, parse_message, validate_xml_signature, validate_xml_schema, validate_xml_signature_none
+from openleadr.messaging import create_message, create_message_async, parse_message, parse_message_tree, validate_xml_signature, validate_xml_schema, validate_xml_signature_none, SigningPool, VerificationPool, load_certificate, load_certificate_chain, load_signing_key
+from openleadr.errors import FingerprintMismatch
 from hashlib import sha256
 from base64 import b64encode
 from datetime import datetime, timedelta, timezone
 from lxml import etree
+import asyncio
 import os
+import pytest
 
 with open(os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'certificates', 'dummy_ven.crt'), 'rb') as file:
     TEST_CERT = file.read()
@@ -35,6 +38,7 @@ def test_message_validation():
     validate_xml_signature(tree)
     parsed_type, parsed_message = parse_message(msg)
     assert parsed_type == 'oadrPoll'
+    assert parse_message_tree(tree) == (parsed_type, parsed_message)
 
 def test_message_validation_disable_signature():
     msg = create_message('oadrPoll', ven_id='123', cert=TEST_CERT, key=TEST_KEY, disable_signature=True)
@@ -93,3 +97,70 @@ def test_message_validation_complex():
     validate_xml_signature(tree)
     parsed_type, parsed_msg = parse_message(msg)
 
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('use_processes', [False, True])
+async def test_signing_pool(use_processes):
+    pool = SigningPool(max_workers=2, use_processes=use_processes)
+    try:
+        msg = await create_message_async('oadrPoll', ven_id='ven123', cert=TEST_CERT, key=TEST_KEY,
+                                         signing_pool=pool)
+        tree = etree.fromstring(msg.encode('utf-8'))
+        validate_xml_signature(tree)
+        assert parse_message(msg)[1]['ven_id'] == 'ven123'
+    finally:
+        pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_signing_pool_queue_depth():
+    pool = SigningPool(max_workers=1)
+    try:
+        tasks = [asyncio.create_task(pool.create_message('oadrPoll', ven_id='123',
+                                                         cert=TEST_CERT, key=TEST_KEY))
+                 for i in range(5)]
+        await asyncio.sleep(0)
+        assert pool.in_flight == 1
+        assert pool.queue_depth == 4
+        messages = await asyncio.gather(*tasks)
+        assert pool.in_flight == 0
+        assert pool.queue_depth == 0
+        for msg in messages:
+            validate_xml_signature(etree.fromstring(msg.encode('utf-8')))
+    finally:
+        pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_create_message_async_without_pool():
+    msg = await create_message_async('oadrPoll', ven_id='123', cert=TEST_CERT, key=TEST_KEY)
+    validate_xml_signature(etree.fromstring(msg.encode('utf-8')))
+
+def test_load_certificate_is_cached():
+    fingerprint = certificate_fingerprint(TEST_CERT)
+    x509_cert = load_certificate(TEST_CERT)
+    assert load_certificate(TEST_CERT, fingerprint) is x509_cert
+    assert load_certificate(TEST_CERT.decode('utf-8')) is x509_cert
+
+@pytest.mark.asyncio
+async def test_verification_pool():
+    pool = VerificationPool(max_workers=2)
+    try:
+        msg = create_message('oadrPoll', ven_id='ven123', cert=TEST_CERT, key=TEST_KEY)
+        tree = etree.fromstring(msg.encode('utf-8'))
+        await pool.validate_xml_signature(tree, cert_fingerprint=certificate_fingerprint(TEST_CERT))
+        with pytest.raises(ValueError):
+            # The same message can not be accepted twice
+            await pool.validate_xml_signature(tree)
+        with pytest.raises(FingerprintMismatch):
+            await pool.validate_xml_signature(tree, cert_fingerprint='00:11:22:33:44:55:66:77:88:99')
+        assert pool.in_flight == 0
+    finally:
+        pool.shutdown()
+
+def test_create_message_with_preloaded_key():
+    key = load_signing_key(TEST_KEY)
+    cert = load_certificate_chain(TEST_CERT)
+    assert load_signing_key(TEST_KEY) is key
+    assert load_certificate_chain(TEST_CERT) is cert
+    msg = create_message('oadrPoll', ven_id='ven123', cert=cert, key=key)
+    tree = etree.fromstring(msg.encode('utf-8'))
+    validate_xml_signature(tree, cert_fingerprint=certificate_fingerprint(TEST_CERT))
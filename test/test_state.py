@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from openleadr import OpenADRServer, enums
+from openleadr.state import MemoryStateBackend, SQLiteStateBackend, StateDict
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryStateBackend()
+    else:
+        backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+        yield backend
+        backend.close()
+
+
+def test_state_backend(backend):
+    backend.save('events', 'ven123', {'event1': 1})
+    backend.save('events', 'ven456', {'event2': 2})
+    backend.save('events_updated', 'ven123', True)
+    backend.delete('events', 'ven456')
+    backend.flush()
+    assert backend.load('events', 'ven123') == {'event1': 1}
+    assert backend.load('events', 'ven456') is None
+    assert backend.keys('events') == ['ven123']
+    assert backend.keys('events_updated') == ['ven123']
+
+
+def test_state_dict_loads_lazily(backend):
+    backend.save('registered_reports', 'ven123', ['report1'])
+    backend.save('registered_reports', 'ven456', ['report2'])
+    state_dict = StateDict(backend, 'registered_reports')
+    assert state_dict._data == {}
+    assert state_dict['ven123'] == ['report1']
+    assert state_dict._data == {'ven123': ['report1']}
+    assert len(state_dict) == 2
+    del state_dict['ven456']
+    state_dict['ven789'] = ['report3']
+    assert sorted(state_dict) == ['ven123', 'ven789']
+    assert backend.load('registered_reports', 'ven456') is None
+    assert backend.load('registered_reports', 'ven789') == ['report3']
+
+
+@pytest.mark.asyncio
+async def test_sqlite_state_backend_writes_behind(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / 'state.db'), flush_interval=0.05)
+    value = {'status': 'far'}
+    for i in range(10):
+        backend.save('events_updated', f'ven{i}', True)
+    backend.save('events', 'ven123', value)
+    value['status'] = 'active'
+    assert backend.writes == 0
+    assert backend.load('events', 'ven123') is value
+    await asyncio.sleep(0.1)
+    assert backend.writes == 11
+    assert backend.batches == 1
+
+    other = SQLiteStateBackend(str(tmp_path / 'state.db'))
+    assert other.load('events', 'ven123') == {'status': 'active'}
+    assert len(other.keys('events_updated')) == 10
+    other.close()
+    backend.close()
+
+
+@pytest.mark.asyncio
+async def test_server_state_survives_restart(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path)
+    server = OpenADRServer(vtn_id='myvtn', state_backend=backend)
+    now = datetime.now(timezone.utc)
+    intervals = [{'dtstart': now + timedelta(milliseconds=100),
+                  'duration': timedelta(minutes=10),
+                  'signal_payload': 1}]
+    event_id = server.add_event('ven123', 'simple', 'level', intervals,
+                                callback=lambda ven_id, event_id, opt_type: None)
+    group_event_id = server.add_group_event(['ven123', 'ven456'], 'simple', 'level', intervals,
+                                            callback=lambda ven_id, event_id, opt_type: None)
+    server.services['report_service'].registered_reports['ven123'] = [{'report_name': 'TELEMETRY_USAGE'}]
+    server.push_dispatcher.register('ven789', 'http://localhost:8081/OpenADR2/Simple/2.0b')
+    server.events_updated['ven123'] = False
+    server.events_updated['ven456'] = False
+    await backend.flush_async()
+    backend.close()
+    await asyncio.sleep(0.1)
+
+    backend = SQLiteStateBackend(path)
+    server = OpenADRServer(vtn_id='myvtn', state_backend=backend)
+    assert server.events.is_group_event(group_event_id)
+    assert 'ven123' not in server.events._events or event_id not in server.events._events['ven123']
+
+    # The events are loaded when they are used, and their status was brought up to date
+    event = server.events.get_event('ven123', event_id)
+    assert event.event_descriptor.event_status == enums.EVENT_STATUS.ACTIVE
+    assert server.events.get_group_event(group_event_id).event_descriptor.event_status == enums.EVENT_STATUS.ACTIVE
+    assert server.events_updated['ven123'] is True
+    assert server.events_updated['ven456'] is True
+    assert server.registered_reports['ven123'] == [{'report_name': 'TELEMETRY_USAGE'}]
+    assert server.push_dispatcher.is_push_ven('ven789')
+    backend.close()
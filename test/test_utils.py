@@ -3,6 +3,8 @@ from dataclasses import dataclass, asdict
 import pytest
 from datetime import datetime, timezone, timedelta
 from collections import deque
+import os
+import ssl
 
 @dataclass
 class dc:
@@ -405,3 +407,53 @@ def test_increment_modification_number():
     assert utils.getmember(event, 'event_descriptor.modification_number') == 1
     utils.increment_event_modification_number(event)
     assert utils.getmember(event, 'event_descriptor.modification_number') == 2
+
+def test_normalize_key():
+    assert utils.normalize_key('oadrReportRequest') == 'report_request'
+    assert utils.normalize_key('eiEventSignal') == 'event_signal'
+    assert utils.normalize_key('x-eiNotification') == 'x_ei_notification'
+    assert utils.normalize_key('powerReal') == 'powerReal'
+
+def test_normalize_dict_leaf_values():
+    assert utils.normalize_dict({'eiResponseCode': '200',
+                                 'oadrValue': '1.5',
+                                 'oadrTestEvent': 'yes',
+                                 'x-eiRampUp': {'duration': 'PT1M'}}) == {'response_code': 200,
+                                                                           'value': 1.5,
+                                                                           'test_event': True,
+                                                                           'ramp_up': timedelta(minutes=1)}
+
+def test_cert_fingerprint_is_kept_per_connection():
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'certificates', 'dummy_ven.crt')) as file:
+        cert = file.read()
+
+    class SSLObject:
+        calls = 0
+
+        def getpeercert(self, binary_form=False):
+            SSLObject.calls += 1
+            return ssl.PEM_cert_to_DER_cert(cert)
+
+    class Transport:
+        def __init__(self):
+            self.ssl_object = SSLObject()
+
+        def get_extra_info(self, name):
+            return self.ssl_object
+
+    class Request:
+        def __init__(self, transport):
+            self.transport = transport
+
+    known_connections = len(utils._PEER_FINGERPRINTS)
+    connection = Transport()
+    for _ in range(3):
+        assert utils.get_cert_fingerprint_from_request(Request(connection)) == utils.certificate_fingerprint(cert)
+    assert SSLObject.calls == 1
+    utils.get_cert_fingerprint_from_request(Request(Transport()))
+    assert SSLObject.calls == 2
+
+    # The fingerprint is forgotten with its connection
+    assert len(utils._PEER_FINGERPRINTS) == known_connections + 1
+    del connection
+    assert len(utils._PEER_FINGERPRINTS) == known_connections
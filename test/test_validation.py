@@ -0,0 +1,184 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import ssl
+
+import aiohttp
+import pytest
+from lxml.etree import XMLSyntaxError
+
+from openleadr import OpenADRServer
+from openleadr.messaging import create_message, parse_message, parse_xml, validate_xml_schema, validate_xml_tree
+from openleadr.utils import certificate_fingerprint
+from openleadr.validation import ValidationPolicy
+
+
+def test_validation_policy_modes():
+    policy = ValidationPolicy()
+    assert all(policy.should_validate('oadrPoll', 'ven123') for i in range(5))
+
+    policy = ValidationPolicy('never')
+    assert not any(policy.should_validate('oadrPoll', 'ven123') for i in range(5))
+
+    policy = ValidationPolicy('sampled', 3)
+    assert [policy.should_validate('oadrPoll', 'ven123') for i in range(7)] == \
+        [True, False, False, True, False, False, True]
+    assert policy.validated['oadrPoll'] == 3
+    assert policy.skipped['oadrPoll'] == 4
+
+    policy = ValidationPolicy('first', 2)
+    assert [policy.should_validate('oadrPoll', 'ven123') for i in range(4)] == [True, True, False, False]
+    # The messages are counted per VEN
+    assert policy.should_validate('oadrPoll', 'ven456')
+
+
+def test_validation_policy_rule_order():
+    policy = ValidationPolicy()
+    policy.set_rule('never', message_type='oadrPoll')
+    policy.set_rule('always', ven_id='ven123')
+    policy.set_rule('never', message_type='oadrPoll', ven_id='ven456')
+    policy.set_rule('never', ven_id='ven456')
+    assert not policy.should_validate('oadrPoll', 'ven789')
+    assert policy.should_validate('oadrRequestEvent', 'ven789')
+    assert policy.should_validate('oadrPoll', 'ven123')
+    assert not policy.should_validate('oadrPoll', 'ven456')
+    assert not policy.should_validate('oadrRequestEvent', 'ven456')
+    assert not policy.should_validate('oadrPoll', None)
+    policy.remove_rule(message_type='oadrPoll')
+    assert policy.should_validate('oadrPoll', 'ven789')
+
+
+def test_validation_policy_invalid_rules():
+    with pytest.raises(ValueError):
+        ValidationPolicy('sometimes')
+    with pytest.raises(ValueError):
+        ValidationPolicy('sampled')
+    with pytest.raises(ValueError):
+        ValidationPolicy().set_rule('first', 0, message_type='oadrPoll')
+
+
+def test_validate_xml_tree_with_policy():
+    policy = ValidationPolicy('never')
+    message = create_message('oadrPoll', ven_id='ven123')
+    invalid_message = message.replace('</ei:venID>', '</ei:venID><ei:unknownElement/>')
+
+    # Not validated, so the invalid message passes
+    tree = validate_xml_tree(parse_xml(invalid_message), policy, 'ven123')
+    assert tree is not None
+    assert policy.skipped['oadrPoll'] == 1
+
+    policy.set_rule('always', ven_id='ven123')
+    with pytest.raises(XMLSyntaxError):
+        validate_xml_tree(parse_xml(invalid_message), policy, 'ven123')
+    assert policy.failures[('oadrPoll', 'ven123')] == 1
+
+    # After a failure, all messages from this VEN are validated
+    policy.set_rule('never', ven_id='ven123')
+    validate_xml_tree(parse_xml(message), policy, 'ven123')
+    assert policy.validated['oadrPoll'] == 2
+
+    # Without a policy, the tree is always validated
+    with pytest.raises(XMLSyntaxError):
+        validate_xml_tree(parse_xml(invalid_message))
+    with pytest.raises(XMLSyntaxError):
+        validate_xml_schema(invalid_message)
+
+
+@pytest.mark.asyncio
+async def test_server_validates_unauthenticated_messages():
+    """
+    Without TLS, the VEN is not authenticated, so the policy does not apply and a venID
+    in the message can't be used to skip the validation.
+    """
+    policy = ValidationPolicy('never')
+    server = OpenADRServer(vtn_id='MYVTN', http_port=8083, http_host='localhost', validation_policy=policy)
+    message = create_message('oadrPoll', ven_id='ven123')
+    invalid_message = message.replace('</ei:venID>', '</ei:venID><ei:unknownElement/>')
+    await server.run()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post('http://localhost:8083/OpenADR2/Simple/2.0b/OadrPoll', data=invalid_message,
+                                    headers={'Content-Type': 'application/xml'}) as response:
+                assert response.status == 400
+    finally:
+        await server.stop()
+    assert policy.skipped['oadrPoll'] == 0
+    assert policy.failures == {}
+
+
+@pytest.mark.asyncio
+async def test_server_applies_policy_to_authenticated_vens():
+    certificates = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'certificates')
+    with open(os.path.join(certificates, 'dummy_ven.crt')) as file:
+        ven_fingerprint = certificate_fingerprint(file.read())
+
+    def fingerprint_lookup(ven_id):
+        return ven_fingerprint if ven_id == 'ven123' else 'AA:BB:CC:DD:EE:FF:00:11:22:33'
+
+    def ven_lookup(ven_id):
+        return {'ven_id': ven_id, 'registration_id': 'reg123', 'fingerprint': fingerprint_lookup(ven_id)}
+
+    policy = ValidationPolicy('never')
+    server = OpenADRServer(vtn_id='MYVTN', http_port=8083, http_host='localhost', validation_policy=policy,
+                           http_cert=os.path.join(certificates, 'dummy_vtn.crt'),
+                           http_key=os.path.join(certificates, 'dummy_vtn.key'),
+                           http_ca_file=os.path.join(certificates, 'dummy_ca.crt'),
+                           ven_lookup=ven_lookup, fingerprint_lookup=fingerprint_lookup,
+                           verify_message_signatures=False)
+    ssl_context = ssl.create_default_context(cafile=os.path.join(certificates, 'dummy_ca.crt'))
+    ssl_context.load_cert_chain(os.path.join(certificates, 'dummy_ven.crt'),
+                                os.path.join(certificates, 'dummy_ven.key'))
+
+    async def poll(session, ven_id):
+        message = create_message('oadrPoll', ven_id=ven_id)
+        invalid_message = message.replace('</ei:venID>', '</ei:venID><ei:unknownElement/>')
+        async with session.post('https://localhost:8083/OpenADR2/Simple/2.0b/OadrPoll', data=invalid_message,
+                                headers={'Content-Type': 'application/xml'}, ssl=ssl_context) as response:
+            return response.status, parse_message(await response.read())
+
+    async def respond(session, ven_id):
+        message = create_message('oadrResponse', ven_id=ven_id,
+                                  response={'response_code': 200, 'response_description': 'OK', 'request_id': '123'})
+        invalid_message = message.replace('</ei:venID>', '</ei:venID><ei:unknownElement/>')
+        async with session.post('https://localhost:8083/OpenADR2/Simple/2.0b/EiEvent', data=invalid_message,
+                                headers={'Content-Type': 'application/xml'}, ssl=ssl_context) as response:
+            return response.status, await response.text()
+
+    await server.run()
+    try:
+        async with aiohttp.ClientSession() as session:
+            # The authenticated VEN may skip the validation
+            status, (message_type, message_payload) = await poll(session, 'ven123')
+            assert status == 200
+            assert message_payload['response']['response_code'] == 200
+
+            # Using another venID in the message is rejected and never skips the validation
+            status, (message_type, message_payload) = await poll(session, 'ven456')
+            assert message_payload['response']['response_code'] == 463
+
+            # The policy also applies to an oadrResponse, which gets an empty response
+            assert await respond(session, 'ven123') == (200, '')
+            policy.set_rule('always', message_type='oadrResponse')
+            status, text = await respond(session, 'ven123')
+            assert status == 400
+    finally:
+        await server.stop()
+    assert policy.skipped['oadrPoll'] == 1
+    assert policy.skipped['oadrResponse'] == 1
+    assert policy.validated['oadrResponse'] == 1
+    assert policy.failures == {('oadrResponse', 'ven123'): 1}
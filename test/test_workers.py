@@ -0,0 +1,277 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Copyright 2020 Contributors to OpenLEADR
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+import aiohttp
+import pytest
+
+from openleadr import OpenADRServer, enums, objects
+from openleadr.event_store import EventStore
+from openleadr.messaging import create_message, parse_message
+from openleadr.replay import SQLiteNonceStore
+from openleadr.service import EventService, PollService, ReportService
+from openleadr.state import SQLiteStateBackend, StateDict
+from openleadr.workers import WorkerMailbox, start_workers, stop_workers
+
+VTN_URL = 'http://localhost:8083/OpenADR2/Simple/2.0b'
+
+
+def create_server(path, worker_id):
+    server = OpenADRServer(vtn_id='MYVTN', http_port=8083, http_host='localhost',
+                           state_backend=SQLiteStateBackend(path, flush_interval=0.01),
+                           nonce_store=SQLiteNonceStore(path + '.nonces'))
+    server.add_handler('on_register_report', on_register_report)
+    if worker_id == 0:
+        server.add_event('ven123', 'simple', 'level',
+                         [{'dtstart': datetime.now(timezone.utc) + timedelta(minutes=10),
+                           'duration': timedelta(minutes=10),
+                           'signal_payload': 1}],
+                         event_id='event123', callback=on_event_response)
+    return server
+
+
+def on_register_report(report):
+    return None
+
+
+def on_event_response(ven_id, event_id, opt_type):
+    pass
+
+
+async def request_events():
+    # Use a new connection for every request, so that the requests are spread over the workers
+    message = create_message('oadrRequestEvent', ven_id='ven123', request_id='req123')
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f'{VTN_URL}/EiEvent', data=message,
+                                headers={'Content-Type': 'application/xml'}) as response:
+            return parse_message(await response.read())
+
+
+@pytest.mark.asyncio
+async def test_workers_share_state(tmp_path):
+    processes = start_workers(partial(create_server, str(tmp_path / 'state.db')), workers=2)
+    try:
+        for _ in range(300):
+            try:
+                message_type, message_payload = await request_events()
+                if message_type == 'oadrDistributeEvent':
+                    break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+        # Give the other worker the time to load the event from the shared state
+        await asyncio.sleep(0.5)
+        for _ in range(10):
+            message_type, message_payload = await request_events()
+            assert message_type == 'oadrDistributeEvent'
+            assert message_payload['events'][0]['event_descriptor']['event_id'] == 'event123'
+    finally:
+        stop_workers(processes)
+    assert all(process.exitcode == 0 for process in processes)
+
+
+def make_event(event_id):
+    now = datetime.now(timezone.utc)
+    return objects.Event(
+        event_descriptor=objects.EventDescriptor(event_id=event_id,
+                                                 modification_number=0,
+                                                 market_context='http://marketcontext01',
+                                                 event_status=enums.EVENT_STATUS.FAR),
+        event_signals=[objects.EventSignal(signal_name='simple', signal_type='level', signal_id='sig1',
+                                           intervals=[objects.Interval(dtstart=now + timedelta(minutes=10),
+                                                                       duration=timedelta(minutes=10),
+                                                                       signal_payload=1)])],
+        targets=[{'ven_id': 'ven123'}])
+
+
+def test_refresh_loads_changes_from_other_processes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path)
+    other_backend = SQLiteStateBackend(path)
+    store = EventStore(backend)
+    other_store = EventStore(other_backend)
+    flags = StateDict(backend, 'events_updated')
+    other_flags = StateDict(other_backend, 'events_updated')
+
+    store.add_event('ven123', make_event('event1'))
+    flags['ven123'] = True
+    backend.flush()
+    assert other_backend.refresh() == 2
+    assert other_store.get_event('ven123', 'event1') is not None
+    assert other_flags['ven123'] is True
+
+    other_store.set_event_status('ven123', 'event1', enums.EVENT_STATUS.CANCELLED)
+    other_store.add_group_event(['ven123', 'ven456'], make_event('event2'))
+    other_flags['ven123'] = False
+    other_backend.flush()
+
+    # A process does not see its own changes as changes
+    assert other_backend.refresh() == 0
+    assert backend.refresh() == 3
+    assert store.get_event('ven123', 'event1').event_descriptor.event_status == enums.EVENT_STATUS.CANCELLED
+    assert store.is_group_event('event2')
+    assert store.get_event('ven456', 'event2') is not None
+    assert flags['ven123'] is False
+    backend.close()
+    other_backend.close()
+
+
+@pytest.mark.asyncio
+async def test_worker_refuses_process_local_state(tmp_path):
+    server = OpenADRServer(vtn_id='MYVTN', http_port=8083, http_host='localhost')
+    server.worker_id = 1
+    with pytest.raises(ValueError) as err:
+        await server.run()
+    for problem in ('state_backend', 'MemoryNonceStore'):
+        assert problem in str(err.value)
+
+
+def test_concurrent_changes_are_merged(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path)
+    other_backend = SQLiteStateBackend(path)
+    store = EventStore(backend)
+    other_store = EventStore(other_backend)
+    store.add_event('ven123', make_event('event1'))
+    store.add_event('ven123', make_event('event2'))
+    store.add_group_event(['ven123', 'ven456'], make_event('event3'))
+    backend.flush()
+    other_backend.refresh()
+    assert len(other_store.get_events('ven123')) == 3
+
+    # Both processes change the events of the same VEN, and the same group event
+    store.set_event_status('ven123', 'event1', enums.EVENT_STATUS.ACTIVE)
+    store.mark_delivered('ven123', 'event3')
+    other_store.remove_event('ven123', 'event2')
+    other_store.mark_acknowledged('ven456', 'event3', 0, 'optIn')
+    backend.flush()
+    other_backend.flush()
+    assert other_backend.merges == 2
+
+    # The process that wrote last loads the merged values at the next refresh
+    assert other_backend.refresh() == 2
+    assert other_store.get_event('ven123', 'event1').event_descriptor.event_status == enums.EVENT_STATUS.ACTIVE
+    assert other_store.get_event('ven123', 'event2') is None
+    assert other_store.delivery_state('ven123', 'event3').delivered == 0
+    assert other_store.delivery_state('ven456', 'event3').opt_type == 'optIn'
+
+    backend.refresh()
+    assert store.get_event('ven123', 'event2') is None
+    assert store.get_event('ven123', 'event1').event_descriptor.event_status == enums.EVENT_STATUS.ACTIVE
+    assert store.delivery_state('ven123', 'event3').delivered == 0
+    assert store.delivery_state('ven456', 'event3').opt_type == 'optIn'
+    backend.close()
+    other_backend.close()
+
+
+def test_events_updated_flags_are_merged(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path)
+    other_backend = SQLiteStateBackend(path)
+    flags = PollService('MYVTN', state_backend=backend).events_updated
+    other_flags = PollService('MYVTN', state_backend=other_backend).events_updated
+    flags['ven123'] = True
+    flags['ven456'] = True
+    backend.flush()
+    other_backend.refresh()
+    assert other_flags['ven123'] is True
+
+    # One process delivers the events, while the other changes them again
+    for ven_id in ('ven123', 'ven456'):
+        assert other_flags[ven_id] is True
+        other_flags[ven_id] = False
+    flags['ven123'] = True
+    backend.flush()
+    other_backend.flush()
+    other_backend.refresh()
+    backend.refresh()
+    assert flags['ven123'] is True and other_flags['ven123'] is True
+    assert flags['ven456'] is False and other_flags['ven456'] is False
+    backend.close()
+    other_backend.close()
+
+
+@pytest.mark.asyncio
+async def test_mailbox_passes_messages_to_the_callbacks(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path)
+    other_backend = SQLiteStateBackend(path)
+    service = EventService('MYVTN', state_backend=backend)
+    other_service = EventService('MYVTN', state_backend=other_backend)
+    responses = []
+    service.events.add_event('ven123', make_event('event1'))
+    service.event_callbacks['event1'] = (None, lambda ven_id, event_id, opt_type: responses.append(opt_type))
+    service.use_mailbox(WorkerMailbox(backend, 0))
+    other_service.use_mailbox(WorkerMailbox(other_backend, 1))
+    backend.flush()
+    other_backend.refresh()
+
+    # The response reaches the other worker, which passes it on
+    await other_service.created_event({'ven_id': 'ven123',
+                                       'event_responses': [{'event_id': 'event1',
+                                                            'modification_number': 0,
+                                                            'opt_type': 'optIn'}]})
+    other_backend.flush()
+    assert backend.refresh() > 0
+    await asyncio.sleep(0)
+    assert responses == ['optIn']
+    assert 'event1' not in service.event_callbacks
+    assert backend.keys('mailbox') == []
+
+    # The callback is called once
+    backend.flush()
+    other_backend.refresh()
+    assert other_service.mailbox.owners.get('event/event1') is None
+    backend.close()
+    other_backend.close()
+
+
+@pytest.mark.asyncio
+async def test_mailbox_passes_report_values(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path)
+    other_backend = SQLiteStateBackend(path)
+    service = ReportService('MYVTN', state_backend=backend)
+    other_service = ReportService('MYVTN', state_backend=other_backend)
+    service.use_mailbox(WorkerMailbox(backend, 0))
+    other_service.use_mailbox(WorkerMailbox(other_backend, 1))
+    values = []
+    route = service._add_report_route('ven123', 'specifier1', 'request1')
+    route['rid1'] = values.extend
+    backend.flush()
+    other_backend.refresh()
+
+    dtstart = datetime.now(timezone.utc)
+    await other_service.update_report({'ven_id': 'ven123',
+                                       'reports': [{'report_request_id': 'request1',
+                                                    'intervals': [{'dtstart': dtstart,
+                                                                   'report_payload': {'r_id': 'rid1',
+                                                                                      'value': 1.5}}]}]})
+    other_backend.flush()
+    backend.refresh()
+    await asyncio.sleep(0)
+    assert values == [(dtstart, 1.5)]
+
+    # A cancelled registration removes the routes in the worker that has them
+    other_service.remove_report_routes('ven123')
+    other_backend.flush()
+    backend.refresh()
+    assert 'request1' not in service.report_routes
+    backend.close()
+    other_backend.close()